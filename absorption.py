@@ -0,0 +1,95 @@
+"""Two-way Type II ANOVA for factors with thousands of levels, by fixed-effects absorption.
+
+The cells backend keeps a dense (a x b) grid of cell statistics and pseudo-inverts the
+reduced normal equations of the smaller factor: O(a * b) memory and O(min(a, b)^3)
+time, which is too much for product or store ids. Here only the observed cells are
+kept. The larger factor is absorbed (demeaned out), and the reduced system of the
+other is solved by preconditioned conjugate gradients. That system is only ever
+applied as products with the sparse count matrix N, so memory is O(n + cells) and
+nothing of size levels^2 is built.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+from scipy.sparse.linalg import LinearOperator, cg
+
+# Relative residual at which conjugate gradients stops; SS come out accurate to about this
+TOLERANCE = 1e-12
+
+
+def sparse_cell_table(codes1, codes2, n, mean, m2):
+    """Type II SS and degrees of freedom from the observed cells only.
+
+    Each argument has one entry per non-empty cell: its level codes, count, mean and
+    M2. Returns the same table as anova.cell_anova_table.
+    """
+    _, codes1 = np.unique(codes1, return_inverse=True)
+    _, codes2 = np.unique(codes2, return_inverse=True)
+    n = np.asarray(n, dtype=float)
+    sums = n * np.asarray(mean, dtype=float)
+    a, b = int(codes1.max()) + 1, int(codes2.max()) + 1
+    total = n.sum()
+    grand_mean = sums.sum() / total
+
+    n1, n2 = np.bincount(codes1, n, a), np.bincount(codes2, n, b)
+    t1, t2 = np.bincount(codes1, sums, a), np.bincount(codes2, sums, b)
+    ss_cells = (n * (mean - grand_mean) ** 2).sum()
+    ss_a = (n1 * (t1 / n1 - grand_mean) ** 2).sum()
+    ss_b = (n2 * (t2 / n2 - grand_mean) ** 2).sum()
+
+    # Absorb the factor with more levels and solve for the other
+    counts = sparse.csr_matrix((n, (codes1, codes2)), shape=(a, b))
+    if b <= a:
+        ss_additive = ss_a + _adjusted_ss(counts, n1, n2, t1, t2)
+        ss_factor2, ss_factor1 = ss_additive - ss_a, ss_additive - ss_b
+    else:
+        ss_additive = ss_b + _adjusted_ss(counts.T.tocsr(), n2, n1, t2, t1)
+        ss_factor1, ss_factor2 = ss_additive - ss_b, ss_additive - ss_a
+
+    # A design that splits into disconnected blocks loses one df per extra block from each effect
+    components = design_blocks(counts)
+    cells = len(n)
+    return {
+        'factor1': (float(max(ss_factor1, 0.0)), float(a - components)),
+        'factor2': (float(max(ss_factor2, 0.0)), float(b - components)),
+        'interaction': (float(max(ss_cells - ss_additive, 0.0)), float(cells - a - b + components)),
+        'within': (float(np.sum(m2)), float(total - cells)),
+    }
+
+
+def design_blocks(counts):
+    """Number of disconnected blocks of the design with (a, b) cell counts, dense or sparse."""
+    counts = sparse.csr_matrix(counts)
+    return csgraph.connected_components(sparse.bmat([[None, counts], [counts.T, None]]), directed=False)[0]
+
+
+def _adjusted_ss(counts, n_absorbed, n_solved, t_absorbed, t_solved):
+    # q' C^+ q for C = diag(n_solved) - N' diag(1 / n_absorbed) N, applied without ever being formed
+    inverse = 1 / n_absorbed
+    diagonal = n_solved - counts.multiply(counts).T @ inverse
+    # C is positive semi-definite, so a level with a zero diagonal has a zero row and column: e.g. one that
+    # shares every absorbed level it was observed in with no other level. Only the rest enter the system.
+    keep = np.flatnonzero(diagonal > n_solved * TOLERANCE)
+    if not len(keep):
+        return 0.0
+    counts, n_solved, diagonal = counts[:, keep], n_solved[keep], diagonal[keep]
+    q = t_solved[keep] - counts.T @ (t_absorbed * inverse)
+    reduced = LinearOperator((len(q), len(q)), dtype=float,
+                             matvec=lambda v: n_solved * v - counts.T @ (inverse * (counts @ v)))
+    # Jacobi preconditioner
+    preconditioner = LinearOperator(reduced.shape, dtype=float, matvec=lambda v: v / diagonal)
+    beta, info = cg(reduced, q, rtol=TOLERANCE, atol=0.0, maxiter=10 * len(q) + 100, M=preconditioner)
+    if info > 0:
+        raise ValueError("The sparse backend did not converge for this design.")
+    return float(q @ beta)
+
+
+def sparse_rows_table(rows):
+    """sparse_cell_table of EncodedRows, aggregated over the observed cells only."""
+    cell, uniques = pd.factorize(rows.cell)
+    n = np.bincount(cell, minlength=len(uniques))
+    mean = np.bincount(cell, weights=rows.y, minlength=len(uniques)) / n
+    m2 = np.bincount(cell, weights=(rows.y - mean[cell]) ** 2, minlength=len(uniques))
+    b = len(rows.levels2)
+    return sparse_cell_table(uniques // b, uniques % b, n, mean, m2)
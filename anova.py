@@ -0,0 +1,303 @@
+import numpy as np
+import pandas as pd
+from defaults import ALPHA, BACKENDS, SS_TYPE  # noqa: F401 (re-exported)
+from absorption import design_blocks, sparse_rows_table
+from fdist import f_crit, f_pvalue
+
+# Keys of a two-way SS table and the names they take in the flattened results
+EFFECT_NAMES = {
+    'factor1': "Rows (Factor 1)",
+    'factor2': "Columns (Factor 2)",
+    'interaction': "Interaction",
+    'within': "Within",
+}
+
+
+def compact_codes(codes, size):
+    """Integer codes (with -1 for missing) in the smallest signed type that holds size values."""
+    return np.asarray(codes).astype(np.min_scalar_type(-max(size, 1)), copy=False)
+
+
+class EncodedRows:
+    """The rows of a two-factor layout as compact integer level codes plus the response.
+
+    Factor levels are discovered once and the combined cell index
+    codes1 * len(levels2) + codes2 is precomputed, so cell statistics, permutations
+    and the bootstrap all work on small integer arrays instead of the original labels.
+    """
+
+    def __init__(self, codes1, codes2, y, levels1, levels2):
+        self.levels1 = list(levels1)
+        self.levels2 = list(levels2)
+        self.codes1 = compact_codes(codes1, len(self.levels1))
+        self.codes2 = compact_codes(codes2, len(self.levels2))
+        self.y = np.asarray(y, dtype=float)
+        self.cell = compact_codes(self.codes1.astype(np.int64) * len(self.levels2) + self.codes2,
+                                  len(self.levels1) * len(self.levels2))
+
+    @classmethod
+    def from_frame(cls, df, factor1, factor2, dependent_var):
+        # Rows with a missing value in any of the three columns are dropped, as patsy does
+        data = df[[factor1, factor2, dependent_var]].dropna()
+        codes1, levels1 = _factorize(data[factor1])
+        codes2, levels2 = _factorize(data[factor2])
+        return cls(codes1, codes2, data[dependent_var].to_numpy(dtype=float), levels1, levels2)
+
+    @property
+    def shape(self):
+        return len(self.levels1), len(self.levels2)
+
+
+def _factorize(values):
+    # Codes in sorted level order; categoricals are factorized by their (cheap) codes
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories
+        if not categories.is_monotonic_increasing:
+            values = values.cat.reorder_categories(categories.sort_values())
+    codes, levels = pd.factorize(values, sort=True)
+    return codes, levels.tolist()
+
+
+class CellStats:
+    """Per-cell count, mean and sum of squared deviations (M2) of a two-factor layout."""
+
+    def __init__(self, levels1, levels2, n, mean, m2):
+        self.levels1 = list(levels1)
+        self.levels2 = list(levels2)
+        self.n = np.asarray(n, dtype=np.int64).reshape(len(self.levels1), len(self.levels2))
+        self.mean = np.asarray(mean, dtype=float).reshape(self.n.shape)
+        self.m2 = np.asarray(m2, dtype=float).reshape(self.n.shape)
+
+    @classmethod
+    def from_codes(cls, codes1, codes2, y, levels1, levels2):
+        return cls.from_rows(EncodedRows(codes1, codes2, y, levels1, levels2))
+
+    @classmethod
+    def from_rows(cls, rows):
+        a, b = rows.shape
+        cell, y = rows.cell, rows.y
+
+        # Two passes over the rows: cell means first, then deviations from them
+        n = np.bincount(cell, minlength=a * b)
+        sums = np.bincount(cell, weights=y, minlength=a * b)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, sums / n, 0.0)
+        m2 = np.bincount(cell, weights=(y - mean[cell]) ** 2, minlength=a * b)
+        return cls(rows.levels1, rows.levels2, n, mean, m2)
+
+    @classmethod
+    def from_frame(cls, df, factor1, factor2, dependent_var):
+        return cls.from_rows(EncodedRows.from_frame(df, factor1, factor2, dependent_var))
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], np.zeros((0, 0)), np.zeros((0, 0)), np.zeros((0, 0)))
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['levels1'], data['levels2'], data['n'], data['mean'], data['m2'])
+
+    def to_dict(self):
+        # JSON-able; floats round-trip exactly through their repr
+        return {'levels1': self.levels1, 'levels2': self.levels2,
+                'n': self.n.tolist(), 'mean': self.mean.tolist(), 'm2': self.m2.tolist()}
+
+    @property
+    def total(self):
+        return int(self.n.sum())
+
+    def transpose(self):
+        return CellStats(self.levels2, self.levels1, self.n.T, self.mean.T, self.m2.T)
+
+    def drop_empty_levels(self):
+        rows, cols = self.n.any(axis=1), self.n.any(axis=0)
+        levels1 = [level for level, keep in zip(self.levels1, rows) if keep]
+        levels2 = [level for level, keep in zip(self.levels2, cols) if keep]
+        return CellStats(levels1, levels2, self.n[np.ix_(rows, cols)],
+                         self.mean[np.ix_(rows, cols)], self.m2[np.ix_(rows, cols)])
+
+    def reindex(self, levels1, levels2):
+        # Place the cells on a (superset) grid of levels; new cells are empty
+        rows = pd.Index(levels1).get_indexer(self.levels1)
+        cols = pd.Index(levels2).get_indexer(self.levels2)
+        shape = (len(levels1), len(levels2))
+        n, mean, m2 = np.zeros(shape, dtype=np.int64), np.zeros(shape), np.zeros(shape)
+        n[np.ix_(rows, cols)] = self.n
+        mean[np.ix_(rows, cols)] = self.mean
+        m2[np.ix_(rows, cols)] = self.m2
+        return CellStats(levels1, levels2, n, mean, m2)
+
+    def merge(self, other):
+        """Combine two sets of cell statistics (Chan et al. parallel update)."""
+        if self.levels1 == other.levels1 and self.levels2 == other.levels2:
+            left, right = self, other
+        else:
+            levels1 = sorted(set(self.levels1) | set(other.levels1))
+            levels2 = sorted(set(self.levels2) | set(other.levels2))
+            left, right = self.reindex(levels1, levels2), other.reindex(levels1, levels2)
+
+        n = left.n + right.n
+        delta = right.mean - left.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(n > 0, right.n / n, 0.0)
+        mean = left.mean + delta * weight
+        m2 = left.m2 + right.m2 + delta ** 2 * left.n * weight
+        return CellStats(left.levels1, left.levels2, n, mean, m2)
+
+
+def cell_anova_table(stats):
+    """Type II sums of squares and degrees of freedom computed from cell statistics.
+
+    The additive model is fitted by absorbing the larger factor and solving the
+    reduced normal equations of the smaller one, so no design matrix over rows is built.
+    """
+    df_factor1, df_factor2, df_interaction = effect_df(stats.n)
+    ss_factor1, ss_factor2, ss_interaction, _ = effect_ss(stats.n, stats.n * stats.mean)
+    return {
+        'factor1': (float(ss_factor1), float(df_factor1)),
+        'factor2': (float(ss_factor2), float(df_factor2)),
+        'interaction': (float(ss_interaction), float(df_interaction)),
+        'within': (float(stats.m2.sum()), float(stats.total - (stats.n > 0).sum())),
+    }
+
+
+def effect_df(n):
+    """Degrees of freedom (factor1, factor2, interaction) of the (a, b) table of cell counts.
+
+    A design whose occupied cells split into disconnected blocks loses one df per
+    extra block from each effect, as in the sparse backend.
+    """
+    nonempty = np.asarray(n) > 0
+    rows, cols = nonempty.any(axis=1), nonempty.any(axis=0)
+    a, b, cells = int(rows.sum()), int(cols.sum()), int(nonempty.sum())
+    blocks = design_blocks(nonempty[np.ix_(rows, cols)]) if cells else 1
+    return a - blocks, b - blocks, cells - a - b + blocks
+
+
+def effect_ss(n, sums):
+    """Type II effect sums of squares from cell counts and one or more tables of cell sums.
+
+    n is the (a, b) table of counts and sums has shape (..., a, b); every result has
+    shape sums.shape[:-2]. Returns (factor1, factor2, interaction, between-cells) SS.
+    Since the reduced normal equations only depend on n, many tables sharing the
+    same counts (e.g. permutations of the response) cost one pseudo-inverse.
+    """
+    n = np.asarray(n, dtype=float)
+    sums = np.asarray(sums, dtype=float)
+    n1, n2 = n.sum(axis=1), n.sum(axis=0)
+    t1, t2 = sums.sum(axis=-1), sums.sum(axis=-2)
+    grand_mean = t1.sum(axis=-1) / n.sum()
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, sums / n, 0.0)
+        ss_cells = (n * (mean - grand_mean[..., None, None]) ** 2).sum(axis=(-2, -1))
+        ss_a = np.nansum(n1 * (t1 / n1 - grand_mean[..., None]) ** 2, axis=-1)
+        ss_b = np.nansum(n2 * (t2 / n2 - grand_mean[..., None]) ** 2, axis=-1)
+
+    # SS of the smaller factor adjusted for the larger one
+    if n.shape[1] <= n.shape[0]:
+        ss_factor2 = _adjusted_ss(n, t1, t2)
+        ss_additive = ss_a + ss_factor2
+        ss_factor1 = ss_additive - ss_b
+    else:
+        ss_factor1 = _adjusted_ss(n.T, t2, t1)
+        ss_additive = ss_b + ss_factor1
+        ss_factor2 = ss_additive - ss_a
+
+    return (np.maximum(ss_factor1, 0.0), np.maximum(ss_factor2, 0.0),
+            np.maximum(ss_cells - ss_additive, 0.0), ss_cells)
+
+
+def _adjusted_ss(n, t_absorbed, t_solved):
+    # Reduced normal equations C beta = q for the columns of n after absorbing its rows
+    n_rows = n.sum(axis=1)
+    keep = n_rows > 0
+    n, n_rows, t_absorbed = n[keep], n_rows[keep], t_absorbed[..., keep]
+    c = np.diag(n.sum(axis=0)) - (n.T / n_rows) @ n
+    q = t_solved - (t_absorbed / n_rows) @ n
+    c_pinv = np.linalg.pinv(c, rcond=len(c) * np.finfo(float).eps, hermitian=True)
+    return np.einsum('...j,jk,...k->...', q, c_pinv, q)
+
+
+def statsmodels_anova_table(df, factor1, factor2, dependent_var):
+    """Reference implementation: full OLS fit followed by anova_lm(typ=2)."""
+    return statsmodels_rows_table(EncodedRows.from_frame(df, factor1, factor2, dependent_var))
+
+
+def statsmodels_rows_table(rows):
+    import statsmodels.api as sm
+    from statsmodels.formula.api import ols
+
+    # Integer codes keep patsy from rediscovering string levels; their order is the sorted level order
+    data = pd.DataFrame({'factor1': rows.codes1, 'factor2': rows.codes2, 'dependent_var': rows.y})
+    model = ols('dependent_var ~ C(factor1) * C(factor2)', data=data).fit()
+    anova_table = sm.stats.anova_lm(model, typ=2)
+    terms = {
+        'factor1': 'C(factor1)',
+        'factor2': 'C(factor2)',
+        'interaction': 'C(factor1):C(factor2)',
+        'within': 'Residual',
+    }
+    return {key: (float(anova_table['sum_sq'][term]), float(anova_table['df'][term]))
+            for key, term in terms.items()}
+
+
+def effects_table(table, alpha=ALPHA):
+    """F tests of the effects in table, an ordered {effect: (ss, df)} whose last entry is the error.
+
+    Returns {effect: {"SS", "df", "MS", "F-statistic", "P-value", "F-crit"}}, then the
+    error with SS, df and MS, then "Total" with the sums of every SS and df.
+    """
+    *effects, (error, (ss_within, df_within)) = table.items()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ms_within = np.divide(ss_within, df_within)
+
+    rows = {}
+    for effect, (ss, df) in effects:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ms = np.divide(ss, df)
+            f_stat = ms / ms_within
+        rows[effect] = {
+            "SS": ss,
+            "df": df,
+            "MS": ms,
+            "F-statistic": f_stat,
+            "P-value": f_pvalue(f_stat, df, df_within),
+            "F-crit": f_crit(alpha, df, df_within),
+        }
+    rows[error] = {"SS": ss_within, "df": df_within, "MS": ms_within}
+    rows["Total"] = {"SS": sum(ss for ss, _ in table.values()), "df": sum(df for _, df in table.values())}
+    return {effect: {key: float(value) for key, value in row.items()} for effect, row in rows.items()}
+
+
+def anova_results(table, alpha=ALPHA):
+    # The two-way results are the general effects table flattened into "<statistic> <effect>" keys
+    rows = effects_table({name: table[key] for key, name in EFFECT_NAMES.items()}, alpha)
+    results = {f"{statistic} {effect}": row[statistic]
+               for statistic in ("SS", "df", "MS", "F-statistic", "P-value", "F-crit")
+               for effect, row in rows.items() if statistic in row}
+
+    return (results, results["P-value Rows (Factor 1)"], results["P-value Columns (Factor 2)"],
+            results["P-value Interaction"])
+
+
+def anova_from_cells(stats, alpha=ALPHA):
+    return anova_results(cell_anova_table(stats), alpha)
+
+
+def anova_from_rows(rows, backend='cells', alpha=ALPHA):
+    if backend == 'statsmodels':
+        table = statsmodels_rows_table(rows)
+    elif backend == 'cells':
+        table = cell_anova_table(CellStats.from_rows(rows))
+    elif backend == 'sparse':
+        table = sparse_rows_table(rows)
+    else:
+        raise ValueError(f"Unknown ANOVA backend: {backend}")
+    return anova_results(table, alpha)
+
+
+def two_way_anova_with_replication(df, factor1, factor2, dependent_var, backend='cells', alpha=ALPHA):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown ANOVA backend: {backend}")
+    return anova_from_rows(EncodedRows.from_frame(df, factor1, factor2, dependent_var), backend, alpha)
@@ -1,12 +1,33 @@
-from flask import Flask, request, render_template_string
-import pandas as pd
-import statsmodels.api as sm
-from statsmodels.formula.api import ols
-from scipy.stats import f
+from flask import Flask, request, jsonify
 import os
 
+from assets import cache_static, compile_page
+from cache import CACHE_PATH, MAX_BYTES, TTL, ResultCache, digest_stream, result_key
+from defaults import ALPHA, BACKENDS, CHUNKSIZE, SS_TYPE, input_format
+from jobs import JobPool, PoolBusy
+from uploads import SPOOL_MAX_SIZE, SpooledRequest, job_source
+
 app = Flask(__name__)
+app.request_class = SpooledRequest
 app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['UPLOAD_MODE'] = os.environ.get('UPLOAD_MODE', 'stream')
+app.config['UPLOAD_SPOOL_MAX_SIZE'] = int(os.environ.get('UPLOAD_SPOOL_MAX_SIZE', SPOOL_MAX_SIZE))
+app.config['ANOVA_BACKEND'] = os.environ.get('ANOVA_BACKEND', 'cells')
+app.config['CSV_CHUNKSIZE'] = int(os.environ.get('CSV_CHUNKSIZE', CHUNKSIZE))
+app.config['RESULT_CACHE_PATH'] = os.environ.get('RESULT_CACHE_PATH', CACHE_PATH)
+app.config['RESULT_CACHE_MAX_BYTES'] = int(os.environ.get('RESULT_CACHE_MAX_BYTES', MAX_BYTES))
+app.config['RESULT_CACHE_TTL'] = int(os.environ.get('RESULT_CACHE_TTL', TTL))
+app.config['ANOVA_WORKERS'] = int(os.environ.get('ANOVA_WORKERS', 0))
+app.config['ANOVA_MAX_PENDING'] = int(os.environ.get('ANOVA_MAX_PENDING', 0))
+
+# Analyses run in a process pool so they don't tie up the web worker (ANOVA_WORKERS=0 runs them inline)
+job_pool = JobPool(app.config['ANOVA_WORKERS'], app.config['ANOVA_MAX_PENDING'] or None)
+
+# An empty RESULT_CACHE_PATH disables the result cache
+result_cache = None
+if app.config['RESULT_CACHE_PATH']:
+    result_cache = ResultCache(app.config['RESULT_CACHE_PATH'],
+                               app.config['RESULT_CACHE_MAX_BYTES'], app.config['RESULT_CACHE_TTL'])
 
 rawhtml = """
 <!DOCTYPE html>
@@ -15,131 +36,15 @@ rawhtml = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Two-Way ANOVA Calculator</title>
-    <style>
-        /* Dark Theme Styles */
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background-color: #121212; /* Dark background */
-            color: #e0e0e0; /* Light text */
-            margin: 0;
-            padding: 0;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            height: 100vh;
-            overflow-y: auto; /* Enable vertical scrolling */
-        }
-
-        .container {
-            margin-top: 50px;
-            background-color: #1e1e1e; /* Slightly lighter dark background */
-            padding: 30px;
-            border-radius: 12px;
-            box-shadow: 0 4px 15px rgba(0, 0, 0, 0.5);
-            width: 450px;
-            text-align: center;
-            animation: fadeIn 0.5s ease-in-out;
-            max-height: 95vh; /* Ensure it doesn't take up more than 95% of the viewport */
-            overflow-y: auto; /* Enable scrolling inside the container if needed */
-        }
-
-        @keyframes fadeIn {
-            from { opacity: 0; transform: translateY(-20px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-
-        h1 {
-            margin-bottom: 20px;
-            font-size: 24px;
-            color: #64b5f6; /* Light blue for headings */
-        }
-
-        label {
-            display: block;
-            margin-bottom: 8px;
-            font-weight: 600;
-            color: #bdbdbd;
-            text-align: left;
-        }
-
-        input[type="file"], input[type="text"] {
-            width: 100%;
-            padding: 10px;
-            margin-bottom: 15px;
-            border: 1px solid #424242; /* Darker border */
-            border-radius: 6px;
-            font-size: 14px;
-            background-color: #303030; /* Darker input background */
-            color: #e0e0e0;
-            transition: border-color 0.3s ease;
-        }
-
-        input[type="file"]:focus, input[type="text"]:focus {
-            border-color: #64b5f6;
-            outline: none;
-        }
-
-        button {
-            width: 100%;
-            padding: 12px;
-            background-color: #64b5f6;
-            color: #121212;
-            border: none;
-            border-radius: 6px;
-            font-size: 16px;
-            font-weight: 600;
-            cursor: pointer;
-            transition: background-color 0.3s ease;
-        }
-
-        button:hover {
-            background-color: #42a5f5;
-        }
-
-        #result {
-            text-align: left;
-            background-color: #212121; /* Slightly darker result background */
-            padding: 20px;
-            border-radius: 12px;
-            box-shadow: 0 2px 8px rgba(0, 0, 0, 0.3);
-            animation: slideIn 0.5s ease-in-out;
-        }
-
-        @keyframes slideIn {
-            from { opacity: 0; transform: translateY(20px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-
-        #result h2 {
-            margin-bottom: 15px;
-            font-size: 20px;
-            color: #64b5f6;
-        }
-
-        #result h3 {
-            margin-bottom: 10px;
-            font-size: 18px;
-            color: #bdbdbd;
-        }
-
-        #result p {
-            margin: 8px 0;
-            font-size: 14px;
-            color: #e0e0e0;
-        }
-
-        #result p strong {
-            color: #bdbdbd;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ stylesheet }}">
 </head>
 <body>
     <div class="container">
         <h1>Two-Way ANOVA Calculator</h1>
         {% if not result %}
             <form method="POST" enctype="multipart/form-data">
-                <label for="csvFile">Upload CSV File:</label>
-                <input type="file" id="csvFile" name="csvFile" accept=".csv" required>
+                <label for="csvFile">Upload Data File (CSV, Parquet, Arrow/Feather or Excel):</label>
+                <input type="file" id="csvFile" name="csvFile" accept=".csv,.gz,.zst,.parquet,.arrow,.feather,.xlsx" required>
                 
                 <label for="factor1">Factor 1 Column:</label>
                 <input type="text" id="factor1" name="factor1" placeholder="Enter factor 1 column name" required>
@@ -208,8 +113,19 @@ rawhtml = """
 </html>
 """
 
-# Ensure the upload folder exists
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
+# Compiled once at import rather than on every request; the form page is rendered once too
+page = compile_page(app, rawhtml, stylesheet='app.css')
+form_page = page.render(result=None)
+app.after_request(cache_static)
+
+
+def upload_job_source(file):
+    return job_source(file, app.config['UPLOAD_MODE'], app.config['UPLOAD_FOLDER'],
+                      app.config['UPLOAD_SPOOL_MAX_SIZE'], picklable=not job_pool.inline)
+
+
+# Ensure the upload folder exists when uploads are saved to disk
+if app.config['UPLOAD_MODE'] == 'disk' and not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
 @app.route('/', methods=['GET', 'POST'])
@@ -217,106 +133,50 @@ def index():
     if request.method == 'POST':
         # Get the uploaded file
         file = request.files['csvFile']
-        if file and file.filename.endswith('.csv'):
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-            file.save(filepath)
-
+        file_format = input_format(file.filename) if file else None
+        if file_format:
             # Get the factor and dependent variable columns
             factor1 = request.form['factor1']
             factor2 = request.form['factor2']
             dependent_var = request.form['dependent_var']
-
-            # Read the CSV file
-            df = pd.read_csv(filepath)
-
-            df = df.rename(columns={
-                f"{factor1}": "factor1",
-                f"{factor2}": "factor2",
-                f"{dependent_var}": "dependent_var"
-            })
-
-            factor1 = "factor1"
-            factor2 = "factor2"
-            dependent_var = "dependent_var"
-
-            # Check if columns exist in the CSV
-            if factor1 not in df.columns or factor2 not in df.columns or dependent_var not in df.columns:
-                return "Error: One or more specified columns do not exist in the CSV file."
-
-            # Perform two-way ANOVA calculations
-            result, p_factor1, p_factor2, p_interaction = two_way_anova_with_replication(df, factor1, factor2, dependent_var)
-
-            # Delete the file after processing
-            os.remove(filepath)
-
-            return render_template_string(rawhtml, result=result)
+            backend = request.form.get('backend', app.config['ANOVA_BACKEND'])
+            if backend not in BACKENDS:
+                return "Error: Unknown ANOVA backend."
+
+            # Results are keyed on the uploaded bytes and every parameter that affects them
+            key = result_key(digest_stream(file.stream), file_format, factor1, factor2, dependent_var, backend,
+                             ALPHA, SS_TYPE)
+            result = result_cache.get(key) if result_cache is not None else None
+            if result is None:
+                # The scientific stack is only imported once a POST needs it, to keep cold starts fast
+                from ingest import ColumnError, analyze_csv
+
+                # Stream the three columns of the uploaded file through the ANOVA backend
+                try:
+                    with upload_job_source(file) as source:
+                        result, p_factor1, p_factor2, p_interaction = job_pool.run(
+                            analyze_csv, source, factor1, factor2, dependent_var,
+                            backend=backend, chunksize=app.config['CSV_CHUNKSIZE'], file_format=file_format)
+                except PoolBusy as e:
+                    return f"Error: {e}", 503, {"Retry-After": "5"}
+                except ColumnError:
+                    return "Error: One or more specified columns do not exist in the uploaded file."
+                except ValueError as e:
+                    return f"Error: {e}"
+                if result_cache is not None:
+                    result_cache.put(key, result)
+
+            return page.render(result=result)
 
         else:
-            return "Error: Please upload a valid CSV file."
-
-    return render_template_string(rawhtml, result=None)
-
-def two_way_anova_with_replication(df, factor1, factor2, dependent_var):
-    model = ols(f'{dependent_var} ~ C({factor1}) * C({factor2})', data=df).fit()
-    anova_table = sm.stats.anova_lm(model, typ=2)
-
-    ss_factor1 = anova_table['sum_sq'][f'C({factor1})']
-    ss_factor2 = anova_table['sum_sq'][f'C({factor2})']
-    ss_interaction = anova_table['sum_sq'][f'C({factor1}):C({factor2})']
-    ss_within = anova_table['sum_sq']['Residual']
-    ss_total = ss_factor1 + ss_factor2 + ss_interaction + ss_within
-
-    df_factor1 = anova_table['df'][f'C({factor1})']
-    df_factor2 = anova_table['df'][f'C({factor2})']
-    df_interaction = anova_table['df'][f'C({factor1}):C({factor2})']
-    df_within = anova_table['df']['Residual']
-    df_total = df_factor1 + df_factor2 + df_interaction + df_within
-
-    ms_factor1 = ss_factor1 / df_factor1
-    ms_factor2 = ss_factor2 / df_factor2
-    ms_interaction = ss_interaction / df_interaction
-    ms_within = ss_within / df_within
-
-    f_factor1 = ms_factor1 / ms_within
-    f_factor2 = ms_factor2 / ms_within
-    f_interaction = ms_interaction / ms_within
-
-    p_factor1 = anova_table['PR(>F)'][f'C({factor1})']
-    p_factor2 = anova_table['PR(>F)'][f'C({factor2})']
-    p_interaction = anova_table['PR(>F)'][f'C({factor1}):C({factor2})']
+            return "Error: Please upload a CSV (optionally .gz or .zst), Parquet, Arrow/Feather or .xlsx file."
 
-    alpha = 0.05
-    f_crit_factor1 = f.ppf(1 - alpha, df_factor1, df_within)
-    f_crit_factor2 = f.ppf(1 - alpha, df_factor2, df_within)
-    f_crit_interaction = f.ppf(1 - alpha, df_interaction, df_within)
+    return form_page
 
-    results = {
-        "SS Rows (Factor 1)": ss_factor1,
-        "SS Columns (Factor 2)": ss_factor2,
-        "SS Interaction": ss_interaction,
-        "SS Within": ss_within,
-        "SS Total": ss_total,
-        "df Rows (Factor 1)": df_factor1,
-        "df Columns (Factor 2)": df_factor2,
-        "df Interaction": df_interaction,
-        "df Within": df_within,
-        "df Total": df_total,
-        "MS Rows (Factor 1)": ms_factor1,
-        "MS Columns (Factor 2)": ms_factor2,
-        "MS Interaction": ms_interaction,
-        "MS Within": ms_within,
-        "F-statistic Rows (Factor 1)": f_factor1,
-        "F-statistic Columns (Factor 2)": f_factor2,
-        "F-statistic Interaction": f_interaction,
-        "P-value Rows (Factor 1)": p_factor1,
-        "P-value Columns (Factor 2)": p_factor2,
-        "P-value Interaction": p_interaction,
-        "F-crit Rows (Factor 1)": f_crit_factor1,
-        "F-crit Columns (Factor 2)": f_crit_factor2,
-        "F-crit Interaction": f_crit_interaction,
-    }
 
-    return results, p_factor1, p_factor2, p_interaction
+@app.route('/healthz')
+def healthz():
+    return jsonify({"status": "ok"})
 
 
 if __name__ == '__main__':
@@ -1,124 +1,262 @@
-from flask import Flask, request, render_template_string, jsonify
-import pandas as pd
-import statsmodels.api as sm
-from statsmodels.formula.api import ols
-from scipy.stats import f
+from flask import Flask, g, request, jsonify, url_for
+import hashlib
+import json
+import logging
 import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import fdist
+from anova import ALPHA, BACKENDS, SS_TYPE, anova_from_cells
+from assets import cache_static, compile_page
+from cache import CACHE_PATH, MAX_BYTES, TTL, ResultCache, digest_stream, result_key
+from datasets import DATASET_DIR, DatasetRegistry, analyze_dataset, register_dataset
+from defaults import METHODS, input_format
+from factorial import SS_TYPES
+from ingest import (CHUNKSIZE, ColumnError, analyze_batch_csv, analyze_csv, analyze_factorial_csv, batch_analyses,
+                    cells_results, factorial_columns, read_cell_stats, read_records_cell_stats)
+from jobs import JOB_STORE_PATH, JOB_TTL, JobPool, JobStore, PoolBusy, run_job
+from metrics import FLUSH_INTERVAL, METRICS_PATH, MetricsStore, histogram
+from schema import BATCH_FORMATS, RESULT_FORMATS, compact_batch, compact_factorial, compact_result, encode_batch
+from sessions import SESSION_STORE_PATH, SESSION_TTL, SessionStore
+from summary import dump_summary, merge_summaries, summarize_file
+from timing import Sampler, StageTimer, timed_call, write_profile
+from uploads import SPOOL_MAX_SIZE, SpooledRequest, job_source, spool_for_job
 
 app = Flask(__name__)
+app.request_class = SpooledRequest
 app.config['UPLOAD_FOLDER'] = 'uploads'
-
-# Ensure the upload folder exists
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
-
-# HTML Template
-rawhtml = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Two-Way ANOVA Calculator</title>
-    <style>
-        /* General Styles */
-        body {
-            font-family: 'Poppins', sans-serif;
-            background: #1a1a2e;
-            color: #e0e0e0;
-            margin: 0;
-            padding: 0;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            min-height: 100vh;
+app.config['UPLOAD_MODE'] = os.environ.get('UPLOAD_MODE', 'stream')
+app.config['UPLOAD_SPOOL_MAX_SIZE'] = int(os.environ.get('UPLOAD_SPOOL_MAX_SIZE', SPOOL_MAX_SIZE))
+app.config['ANOVA_BACKEND'] = os.environ.get('ANOVA_BACKEND', 'cells')
+app.config['CSV_CHUNKSIZE'] = int(os.environ.get('CSV_CHUNKSIZE', CHUNKSIZE))
+app.config['RESULT_CACHE_PATH'] = os.environ.get('RESULT_CACHE_PATH', CACHE_PATH)
+app.config['RESULT_CACHE_MAX_BYTES'] = int(os.environ.get('RESULT_CACHE_MAX_BYTES', MAX_BYTES))
+app.config['RESULT_CACHE_TTL'] = int(os.environ.get('RESULT_CACHE_TTL', TTL))
+# Every web worker has its own pool, so by default they share the cores between them
+app.config['ANOVA_WORKERS'] = int(os.environ.get('ANOVA_WORKERS',
+                                                 max(1, os.cpu_count() // int(os.environ.get('WEB_CONCURRENCY', 1)))))
+app.config['ANOVA_MAX_PENDING'] = int(os.environ.get('ANOVA_MAX_PENDING', 0))
+app.config['MAX_PERMUTATIONS'] = int(os.environ.get('MAX_PERMUTATIONS', 100_000))
+app.config['MAX_BOOTSTRAP'] = int(os.environ.get('MAX_BOOTSTRAP', 100_000))
+app.config['RESAMPLING_WORKERS'] = int(os.environ.get('RESAMPLING_WORKERS', 1))
+app.config['JOB_STORE_PATH'] = os.environ.get('JOB_STORE_PATH', JOB_STORE_PATH)
+app.config['JOB_TTL'] = int(os.environ.get('JOB_TTL', JOB_TTL))
+app.config['SESSION_STORE_PATH'] = os.environ.get('SESSION_STORE_PATH', SESSION_STORE_PATH)
+app.config['SESSION_TTL'] = int(os.environ.get('SESSION_TTL', SESSION_TTL))
+app.config['DATASET_DIR'] = os.environ.get('DATASET_DIR', DATASET_DIR)
+app.config['METRICS_PATH'] = os.environ.get('METRICS_PATH', METRICS_PATH)
+app.config['METRICS_FLUSH_INTERVAL'] = float(os.environ.get('METRICS_FLUSH_INTERVAL', FLUSH_INTERVAL))
+app.config['TIMING_LOG'] = os.environ.get('TIMING_LOG', '1') == '1'
+app.config['TRACK_MEMORY'] = os.environ.get('TRACK_MEMORY', '0') == '1'
+app.config['PROFILE_THRESHOLD'] = float(os.environ.get('PROFILE_THRESHOLD', 0))
+app.config['PROFILE_INTERVAL'] = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'anova-profiles'))
+
+# Critical values for the common alphas are tabulated once, before gunicorn forks its workers
+fdist.warm()
+
+# An empty METRICS_PATH disables the /metrics endpoint and its bookkeeping
+metrics_store = None
+if app.config['METRICS_PATH']:
+    metrics_store = MetricsStore(app.config['METRICS_PATH'], app.config['METRICS_FLUSH_INTERVAL'])
+
+
+def set_in_flight(count):
+    metrics_store.set_gauge('anova_analyses_in_flight', count)
+
+
+# Analyses run in a process pool so they don't tie up the web worker (ANOVA_WORKERS=0 runs them inline)
+job_pool = JobPool(app.config['ANOVA_WORKERS'], app.config['ANOVA_MAX_PENDING'] or None,
+                   on_change=set_in_flight if metrics_store is not None else None)
+job_store = JobStore(app.config['JOB_STORE_PATH'], app.config['JOB_TTL'])
+session_store = SessionStore(app.config['SESSION_STORE_PATH'], app.config['SESSION_TTL'])
+dataset_registry = DatasetRegistry(app.config['DATASET_DIR'])
+
+# An empty RESULT_CACHE_PATH disables the result cache
+result_cache = None
+if app.config['RESULT_CACHE_PATH']:
+    result_cache = ResultCache(app.config['RESULT_CACHE_PATH'],
+                               app.config['RESULT_CACHE_MAX_BYTES'], app.config['RESULT_CACHE_TTL'])
+
+# One JSON line per request with its stage timings
+timing_log = logging.getLogger('anova.timing')
+if app.config['TIMING_LOG'] and not timing_log.handlers:
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    timing_log.addHandler(handler)
+    timing_log.setLevel(logging.INFO)
+    timing_log.propagate = False
+
+# Probes are kept out of the log, and static files and probes out of the metrics
+QUIET_ENDPOINTS = ('healthz', 'metrics')
+UNMETERED_ENDPOINTS = ('static', *QUIET_ENDPOINTS)
+
+
+def analysis_options(form):
+    # Optional settings of a submitted analysis; raises ValueError when one is invalid
+    backend = form.get('backend', app.config['ANOVA_BACKEND'])
+    if backend not in BACKENDS:
+        raise ValueError("Unknown ANOVA backend.")
+    method = form.get('method') or 'classic'
+    if method not in METHODS:
+        raise ValueError("Unknown test method.")
+    try:
+        permutations = int(form.get('permutations') or 0)
+        bootstrap = int(form.get('bootstrap') or 0)
+        seed = int(form['seed']) if form.get('seed') else None
+    except ValueError:
+        raise ValueError("Permutations, bootstrap resamples and seed must be whole numbers.")
+    try:
+        confidence = float(form.get('confidence') or 0.95)
+    except ValueError:
+        raise ValueError("Confidence must be a number.")
+    if not 0 <= permutations <= app.config['MAX_PERMUTATIONS']:
+        raise ValueError(f"Permutations must be between 0 and {app.config['MAX_PERMUTATIONS']}.")
+    if not 0 <= bootstrap <= app.config['MAX_BOOTSTRAP']:
+        raise ValueError(f"Bootstrap resamples must be between 0 and {app.config['MAX_BOOTSTRAP']}.")
+    if not 0 < confidence < 1:
+        raise ValueError("Confidence must be between 0 and 1.")
+    return {'backend': backend, 'permutations': permutations, 'bootstrap': bootstrap, 'confidence': confidence,
+            'seed': seed, 'posthoc': is_checked(form.get('posthoc')), 'method': method}
+
+
+def reproducible(options):
+    # An unseeded permutation test or bootstrap draws new resamples on every run, so its result can't be reused
+    return options['seed'] is not None or not (options['permutations'] or options['bootstrap'])
+
+
+def is_checked(value):
+    # A checkbox field, or a JSON boolean
+    return str(value).lower() in ('1', 'true', 'on', 'yes')
+
+
+def result_format(formats=RESULT_FORMATS):
+    # ?format= (or a form field) picks the encoding; json is the verbose flat form
+    value = request.values.get('format') or 'json'
+    if value not in formats:
+        raise ValueError(f"Unknown result format: {value}. Use one of: {', '.join(formats)}.")
+    return value
+
+
+def format_etag(key, result_format):
+    return key if result_format == 'json' else f'{key}.{result_format}'
+
+
+def not_modified(etag):
+    # Only GET and HEAD answer a matching If-None-Match with 304 (RFC 7232 3.2); other methods just run
+    if request.method in ('GET', 'HEAD') and request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def run_analysis(fn, *args, **kwargs):
+    # Run fn in the job pool, folding the stages it reports through progress into this request's timings
+    profile = app.config['PROFILE_INTERVAL'] if app.config['PROFILE_THRESHOLD'] and not job_pool.inline else None
+    with g.timer.stage('analysis'):
+        result, stages, rows, stacks = job_pool.run(timed_call, fn, args, kwargs, app.config['TRACK_MEMORY'], profile)
+    g.timer.add(stages, rows)
+    g.worker_stacks.update(stacks)
+    return result
+
+
+@app.before_request
+def start_timing():
+    g.timer = StageTimer(app.config['TRACK_MEMORY'])
+    g.worker_stacks = Counter()
+    g.sampler = Sampler(app.config['PROFILE_INTERVAL']).__enter__() if app.config['PROFILE_THRESHOLD'] else None
+
+
+@app.after_request
+def report_timing(response):
+    timer = g.timer
+    stages = timer.finish()
+    elapsed = timer.elapsed
+    response.headers['Server-Timing'] = timer.server_timing()
+    endpoint = request.endpoint or 'unknown'
+
+    profile = None
+    if g.sampler is not None:
+        request_stacks = g.sampler.stop()
+        if elapsed >= app.config['PROFILE_THRESHOLD']:
+            os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+            profile = os.path.join(app.config['PROFILE_DIR'],
+                                   f"{int(time.time() * 1000)}-{endpoint}-{elapsed * 1000:.0f}ms.folded")
+            write_profile(profile, ('request', request_stacks), ('worker', g.worker_stacks))
+
+    analysis = stages['analysis']['seconds'] if 'analysis' in stages else 0.0
+    if metrics_store is not None and endpoint not in UNMETERED_ENDPOINTS:
+        increments = histogram('anova_request_duration_seconds',
+                               {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)},
+                               elapsed)
+        for name, timing in stages.items():
+            increments += histogram('anova_stage_duration_seconds', {'stage': name}, timing['seconds'])
+        if timer.rows:
+            increments.append(('anova_rows_processed_total', {'endpoint': endpoint}, timer.rows))
+            increments.append(('anova_analysis_seconds_total', {'endpoint': endpoint}, analysis))
+        metrics_store.record(increments)
+
+    if app.config['TIMING_LOG'] and endpoint not in QUIET_ENDPOINTS:
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'ms': round(elapsed * 1000, 2),
+            'rows': timer.rows,
+            'rows_per_sec': round(timer.rows / analysis) if timer.rows and analysis else None,
+            'stages': {name: {'ms': round(timing['seconds'] * 1000, 2),
+                              **({'peak_bytes': timing['peak_bytes']} if 'peak_bytes' in timing else {})}
+                       for name, timing in stages.items()},
         }
+        if profile is not None:
+            record['profile'] = profile
+        timing_log.info(json.dumps(record))
+    return response
 
-        .container {
-            background: #222436;
-            padding: 30px;
-            border-radius: 10px;
-            box-shadow: 0 4px 15px rgba(0, 153, 255, 0.4);
-            width: 90%;
-            max-width: 600px;
-        }
 
-        .title{
-            text-align: center;
-        }
+app.after_request(cache_static)
 
-        h1 {
-            font-size: 24px;
-            color: #00aaff;
-            margin-bottom: 15px;
-        }
-
-        label {
-            font-weight: bold;
-            display: block;
-            margin: 10px 0 5px;
-            text-align: left;
-        }
 
-        input[type="file"], input[type="text"] {
-            width: 96%;
-            padding: 10px;
-            margin-bottom: 15px;
-            border: 1px solid #00aaff;
-            border-radius: 5px;
-            font-size: 14px;
-            background: #1e1e2e;
-            color: #fff;
-        }
+@app.teardown_request
+def stop_sampler(exc):
+    # after_request is skipped when a view raises, so make sure the sampling thread ends
+    if g.get('sampler') is not None:
+        g.sampler.stop()
 
-        button {
-            width: 100%;
-            padding: 12px;
-            background: #00aaff;
-            color: #fff;
-            border: none;
-            border-radius: 5px;
-            font-size: 16px;
-            font-weight: bold;
-            cursor: pointer;
-            transition: 0.3s;
-        }
 
-        button:hover {
-            background: #0088cc;
-        }
+def upload_job_source(file):
+    return job_source(file, app.config['UPLOAD_MODE'], app.config['UPLOAD_FOLDER'],
+                      app.config['UPLOAD_SPOOL_MAX_SIZE'], picklable=not job_pool.inline)
 
-        .result-container {
-            background: #121826;
-            padding: 20px;
-            margin-top: 20px;
-            border-radius: 8px;
-            box-shadow: 0 2px 8px rgba(0, 153, 255, 0.3);
-            display: none; /* Initially hidden */
-        }
 
-        .result-container h2 {
-            color: #00aaff;
-            margin-bottom: 15px;
-        }
+UNSUPPORTED_FILE = "Please upload a CSV (optionally .gz or .zst), Parquet, Arrow/Feather or .xlsx file."
 
-        .result-container p {
-            font-size: 14px;
-            margin: 8px 0;
-            color: #e0e0e0;
-        }
+# Ensure the upload folder exists when uploads are saved to disk
+if app.config['UPLOAD_MODE'] == 'disk' and not os.path.exists(app.config['UPLOAD_FOLDER']):
+    os.makedirs(app.config['UPLOAD_FOLDER'])
 
-        .result-container p strong {
-            color: #00ddff;
-        }
-    </style>
+# HTML Template
+rawhtml = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Two-Way ANOVA Calculator</title>
+    <link rel="stylesheet" href="{{ stylesheet }}">
 </head>
 <body>
     <div class="container">
         <h1 class="title">Two-Way ANOVA Calculator</h1>
         <form id="anovaForm" method="POST" enctype="multipart/form-data">
-            <label for="csvFile">Upload CSV File:</label>
-            <input type="file" id="csvFile" name="csvFile" accept=".csv" required>
+            <label for="csvFile">Upload Data File (CSV, Parquet, Arrow/Feather or Excel):</label>
+            <input type="file" id="csvFile" name="csvFile"
+                   accept=".csv,.gz,.zst,.parquet,.arrow,.feather,.xlsx" required>
 
             <label for="factor1">Factor 1 Column:</label>
             <input type="text" id="factor1" name="factor1" placeholder="Enter factor 1 column name" required>
@@ -127,7 +265,30 @@ rawhtml = """
             <input type="text" id="factor2" name="factor2" placeholder="Enter factor 2 column name" required>
 
             <label for="dependent_var">Dependent Variable Column:</label>
-            <input type="text" id="dependent_var" name="dependent_var" placeholder="Enter dependent variable column name" required>
+            <input type="text" id="dependent_var" name="dependent_var"
+                   placeholder="Enter dependent variable column name" required>
+
+            <label for="permutations">Permutations (optional):</label>
+            <input type="number" id="permutations" name="permutations" min="0"
+                   placeholder="e.g. 9999 for a permutation test">
+
+            <label for="bootstrap">Bootstrap Resamples (optional):</label>
+            <input type="number" id="bootstrap" name="bootstrap" min="0"
+                   placeholder="e.g. 10000 for effect size confidence intervals">
+
+            <label for="seed">Random Seed (optional):</label>
+            <input type="number" id="seed" name="seed" min="0" placeholder="Seed for reproducible resampling">
+
+            <label for="method">Test:</label>
+            <select id="method" name="method">
+                <option value="classic">Classic F test</option>
+                <option value="welch">Welch-James (unequal variances)</option>
+                <option value="hc3">HC3-robust Wald test</option>
+                <option value="art">Aligned rank transform (rank-based)</option>
+            </select>
+
+            <label for="posthoc"><input type="checkbox" id="posthoc" name="posthoc" value="1">
+                Post-hoc comparisons (Tukey HSD, Bonferroni/Holm, simple effects)</label>
 
             <button type="submit">Calculate Two-Way ANOVA</button>
         </form>
@@ -138,195 +299,476 @@ rawhtml = """
         </div>
     </div>
 
-    <script>
-        document.getElementById('anovaForm').addEventListener('submit', function(event) {
-            event.preventDefault(); // Prevent form submission
-
-            var formData = new FormData(this); // Get form data
-
-            fetch('/', {
-                method: 'POST',
-                body: formData
-            })
-            .then(response => response.json())
-            .then(data => {
-                // Update the results section
-                document.getElementById('results').innerHTML = `
-                    <h3 class="title">Results</h3>
-                    <p><strong>SS Rows (Factor 1):</strong> ${data['SS Rows (Factor 1)'].toFixed(4)}</p>
-                    <p><strong>SS Columns (Factor 2):</strong> ${data['SS Columns (Factor 2)'].toFixed(4)}</p>
-                    <p><strong>SS Interaction:</strong> ${data['SS Interaction'].toFixed(4)}</p>
-                    <p><strong>SS Within:</strong> ${data['SS Within'].toFixed(4)}</p>
-                    <p><strong>SS Total:</strong> ${data['SS Total'].toFixed(4)}</p>
-                    <p><strong>df Rows (Factor 1):</strong> ${data['df Rows (Factor 1)']}</p>
-                    <p><strong>df Columns (Factor 2):</strong> ${data['df Columns (Factor 2)']}</p>
-                    <p><strong>df Interaction:</strong> ${data['df Interaction']}</p>
-                    <p><strong>df Within:</strong> ${data['df Within']}</p>
-                    <p><strong>df Total:</strong> ${data['df Total']}</p>
-                    <p><strong>MS Rows (Factor 1):</strong> ${data['MS Rows (Factor 1)'].toFixed(4)}</p>
-                    <p><strong>MS Columns (Factor 2):</strong> ${data['MS Columns (Factor 2)'].toFixed(4)}</p>
-                    <p><strong>MS Interaction:</strong> ${data['MS Interaction'].toFixed(4)}</p>
-                    <p><strong>MS Within:</strong> ${data['MS Within'].toFixed(4)}</p>
-                    <p><strong>F-statistic Rows (Factor 1):</strong> ${data['F-statistic Rows (Factor 1)'].toFixed(4)}</p>
-                    <p><strong>F-statistic Columns (Factor 2):</strong> ${data['F-statistic Columns (Factor 2)'].toFixed(4)}</p>
-                    <p><strong>F-statistic Interaction:</strong> ${data['F-statistic Interaction'].toFixed(4)}</p>
-                    <p><strong>P-value Rows (Factor 1):</strong> ${data['P-value Rows (Factor 1)'].toFixed(10)}</p>
-                    <p><strong>P-value Columns (Factor 2):</strong> ${data['P-value Columns (Factor 2)'].toFixed(10)}</p>
-                    <p><strong>P-value Interaction:</strong> ${data['P-value Interaction'].toFixed(10)}</p>
-                    <p><strong>F-crit Rows (Factor 1):</strong> ${data['F-crit Rows (Factor 1)'].toFixed(4)}</p>
-                    <p><strong>F-crit Columns (Factor 2):</strong> ${data['F-crit Columns (Factor 2)'].toFixed(4)}</p>
-                    <p><strong>F-crit Interaction:</strong> ${data['F-crit Interaction'].toFixed(4)}</p>
-
-                    <h3 class="title">Analysis of Results</h3>
-
-                    <h4>Effect of Factor 1 on the Dependent Variable</h4>
-                    ${data['P-value Rows (Factor 1)'] < 0.05 ? 
-                        `<p><strong>Statistically Significant:</strong> Yes (p = ${data['P-value Rows (Factor 1)'].toFixed(4)})</p>
-                        <p>Changes in Factor 1 lead to meaningful variations in the outcome. We reject the null hypothesis that Factor 1 has no effect.</p>` :
-                        `<p><strong>Statistically Significant:</strong> No (p = ${data['P-value Rows (Factor 1)'].toFixed(4)})</p>
-                        <p>Any observed variations due to Factor 1 may be due to random chance. We fail to reject the null hypothesis.</p>`}
-
-                    <h4>Effect of Factor 2 on the Dependent Variable</h4>
-                    ${data['P-value Columns (Factor 2)'] < 0.05 ? 
-                        `<p><strong>Statistically Significant:</strong> Yes (p = ${data['P-value Columns (Factor 2)'].toFixed(4)})</p>
-                        <p>Variations in Factor 2 contribute significantly to differences in the outcome. The null hypothesis is rejected.</p>` :
-                        `<p><strong>Statistically Significant:</strong> No (p = ${data['P-value Columns (Factor 2)'].toFixed(4)})</p>
-                        <p>Factor 2 does not play a crucial role in influencing the outcome. We fail to reject the null hypothesis.</p>`}
-
-                    <h4>Interaction Between Factor 1 and Factor 2</h4>
-                    ${data['P-value Interaction'] < 0.05 ? 
-                        `<p><strong>Statistically Significant:</strong> Yes (p = ${data['P-value Interaction'].toFixed(4)})</p>
-                        <p>The effect of one factor depends on the level of the other factor. The influence of Factor 1 on the dependent variable is not consistent across different levels of Factor 2, and vice versa. This suggests that the two factors interact in a way that impacts the outcome beyond their individual effects.</p>` :
-                        `<p><strong>Statistically Significant:</strong> No (p = ${data['P-value Interaction'].toFixed(4)})</p>
-                        <p>The two factors act independently. The effect of one factor does not change depending on the level of the other factor.</p>`}
-
-                    <h4>Overall Implications</h4>
-                    <p>The analysis reveals that:</p>
-                    <ul>
-                        <li>${data['P-value Rows (Factor 1)'] < 0.05 ? 'Factor 1 has a significant effect on the outcome.' : 'Factor 1 does not have a significant effect on the outcome.'}</li>
-                        <li>${data['P-value Columns (Factor 2)'] < 0.05 ? 'Factor 2 has a significant effect on the outcome.' : 'Factor 2 does not have a significant effect on the outcome.'}</li>
-                        <li>${data['P-value Interaction'] < 0.05 ? 'There is a significant interaction between Factor 1 and Factor 2, indicating that their combined effect is more complex than their individual contributions.' : 'There is no significant interaction between Factor 1 and Factor 2, meaning they act independently.'}</li>
-                    </ul>
-                `;
-
-                // Show the result container
-                document.getElementById('resultContainer').style.display = 'block';
-            })
-            .catch(error => {
-                console.error('Error:', error);
-            });
-        });
-    </script>
+    <script src="{{ script }}"></script>
 </body>
 </html>
 """
 
+# The page has no per-request content, so it is rendered once and revalidated by its ETag
+index_page = compile_page(app, rawhtml, stylesheet='app1.css', script='app1.js').render()
+index_etag = hashlib.sha256(index_page.encode()).hexdigest()
+
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
-        # Get the uploaded file
-        file = request.files['csvFile']
-        if file and file.filename.endswith('.csv'):
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-            file.save(filepath)
-
+        # Get the uploaded file; Werkzeug parses (and spools) the upload on this first access
+        with g.timer.stage('upload'):
+            file = request.files['csvFile']
+        file_format = input_format(file.filename) if file else None
+        if file_format:
             # Get the factor and dependent variable columns
             factor1 = request.form['factor1']
             factor2 = request.form['factor2']
             dependent_var = request.form['dependent_var']
+            try:
+                options = analysis_options(request.form)
+                output = result_format()
+            except ValueError as e:
+                return jsonify({"error": str(e)})
+
+            # Results are keyed on the uploaded bytes and every parameter that affects them
+            key = None
+            if reproducible(options):
+                with g.timer.stage('digest'):
+                    key = result_key(digest_stream(file.stream), file_format, factor1, factor2, dependent_var,
+                                     ALPHA, SS_TYPE, sorted(options.items()))
+                response = not_modified(format_etag(key, output))
+                if response is not None:
+                    return response
+            cache = result_cache if key is not None else None
+
+            with g.timer.stage('cache'):
+                result = cache.get(key) if cache is not None else None
+            if result is None:
+                # Stream the three columns of the uploaded file through the ANOVA backend
+                try:
+                    with upload_job_source(file) as source:
+                        result, p_factor1, p_factor2, p_interaction = run_analysis(
+                            analyze_csv, source, factor1, factor2, dependent_var,
+                            chunksize=app.config['CSV_CHUNKSIZE'], file_format=file_format,
+                            resampling_workers=app.config['RESAMPLING_WORKERS'], **options)
+                except PoolBusy as e:
+                    return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+                except ColumnError:
+                    return jsonify({"error": "One or more specified columns do not exist in the uploaded file."})
+                except ValueError as e:
+                    return jsonify({"error": str(e)})
+                if cache is not None:
+                    cache.put(key, result)
+
+            with g.timer.stage('render'):
+                response = jsonify(compact_result(result) if output == 'compact' else result)
+            if key is not None:
+                response.set_etag(format_etag(key, output))
+            return response
 
-            # Read the CSV file
-            df = pd.read_csv(filepath)
-
-            df = df.rename(columns={
-                f"{factor1}": "factor1",
-                f"{factor2}": "factor2",
-                f"{dependent_var}": "dependent_var"
-            })
-
-            factor1 = "factor1"
-            factor2 = "factor2"
-            dependent_var = "dependent_var"
-
-            # Check if columns exist in the CSV
-            if factor1 not in df.columns or factor2 not in df.columns or dependent_var not in df.columns:
-                return jsonify({"error": "One or more specified columns do not exist in the CSV file."})
-
-            # Perform two-way ANOVA calculations
-            result, p_factor1, p_factor2, p_interaction = two_way_anova_with_replication(df, factor1, factor2, dependent_var)
-
-            # Delete the file after processing
-            os.remove(filepath)
-
-            return jsonify(result)
-
         else:
-            return jsonify({"error": "Please upload a valid CSV file."})
-
-    return render_template_string(rawhtml, result=None)
-
-
-def two_way_anova_with_replication(df, factor1, factor2, dependent_var):
-    model = ols(f'{dependent_var} ~ C({factor1}) * C({factor2})', data=df).fit()
-    anova_table = sm.stats.anova_lm(model, typ=2)
-
-    ss_factor1 = anova_table['sum_sq'][f'C({factor1})']
-    ss_factor2 = anova_table['sum_sq'][f'C({factor2})']
-    ss_interaction = anova_table['sum_sq'][f'C({factor1}):C({factor2})']
-    ss_within = anova_table['sum_sq']['Residual']
-    ss_total = ss_factor1 + ss_factor2 + ss_interaction + ss_within
-
-    df_factor1 = anova_table['df'][f'C({factor1})']
-    df_factor2 = anova_table['df'][f'C({factor2})']
-    df_interaction = anova_table['df'][f'C({factor1}):C({factor2})']
-    df_within = anova_table['df']['Residual']
-    df_total = df_factor1 + df_factor2 + df_interaction + df_within
-
-    ms_factor1 = ss_factor1 / df_factor1
-    ms_factor2 = ss_factor2 / df_factor2
-    ms_interaction = ss_interaction / df_interaction
-    ms_within = ss_within / df_within
-
-    f_factor1 = ms_factor1 / ms_within
-    f_factor2 = ms_factor2 / ms_within
-    f_interaction = ms_interaction / ms_within
-
-    p_factor1 = anova_table['PR(>F)'][f'C({factor1})']
-    p_factor2 = anova_table['PR(>F)'][f'C({factor2})']
-    p_interaction = anova_table['PR(>F)'][f'C({factor1}):C({factor2})']
-
-    alpha = 0.05
-    f_crit_factor1 = f.ppf(1 - alpha, df_factor1, df_within)
-    f_crit_factor2 = f.ppf(1 - alpha, df_factor2, df_within)
-    f_crit_interaction = f.ppf(1 - alpha, df_interaction, df_within)
-
-    results = {
-        "SS Rows (Factor 1)": ss_factor1,
-        "SS Columns (Factor 2)": ss_factor2,
-        "SS Interaction": ss_interaction,
-        "SS Within": ss_within,
-        "SS Total": ss_total,
-        "df Rows (Factor 1)": df_factor1,
-        "df Columns (Factor 2)": df_factor2,
-        "df Interaction": df_interaction,
-        "df Within": df_within,
-        "df Total": df_total,
-        "MS Rows (Factor 1)": ms_factor1,
-        "MS Columns (Factor 2)": ms_factor2,
-        "MS Interaction": ms_interaction,
-        "MS Within": ms_within,
-        "F-statistic Rows (Factor 1)": f_factor1,
-        "F-statistic Columns (Factor 2)": f_factor2,
-        "F-statistic Interaction": f_interaction,
-        "P-value Rows (Factor 1)": p_factor1,
-        "P-value Columns (Factor 2)": p_factor2,
-        "P-value Interaction": p_interaction,
-        "F-crit Rows (Factor 1)": f_crit_factor1,
-        "F-crit Columns (Factor 2)": f_crit_factor2,
-        "F-crit Interaction": f_crit_interaction,
-    }
-
-    return results, p_factor1, p_factor2, p_interaction
+            return jsonify({"error": UNSUPPORTED_FILE})
+
+    response = app.response_class(index_page, mimetype='text/html')
+    response.set_etag(index_etag)
+    return response.make_conditional(request)
+
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    # One upload, many analyses: an "analyses" JSON list of column triples and/or
+    # repeated "factors" and "responses" fields for every factor pair against every response
+    file = request.files.get('csvFile')
+    file_format = input_format(file.filename) if file else None
+    if not file_format:
+        return jsonify({"error": UNSUPPORTED_FILE})
+
+    try:
+        output = result_format(BATCH_FORMATS)
+        triples = batch_analyses(json.loads(request.form.get('analyses') or '[]'),
+                                 request.form.getlist('factors'), request.form.getlist('responses'))
+        with upload_job_source(file) as source:
+            results = run_analysis(analyze_batch_csv, source, triples, chunksize=app.config['CSV_CHUNKSIZE'],
+                                   file_format=file_format)
+    except PoolBusy as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+
+    if output == 'json':
+        return jsonify({"results": results})
+    if output == 'compact':
+        return jsonify(compact_batch(results))
+    try:
+        body, mimetype = encode_batch(results, output)
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+    return app.response_class(body, mimetype=mimetype)
+
+
+@app.route('/factorial', methods=['POST'])
+def factorial():
+    # N-way factorial ANOVA: repeated (or comma-separated) "factors" fields, the dependent_var,
+    # an optional covariate for ANCOVA and ss_type 1, 2 or 3
+    file = request.files.get('csvFile')
+    file_format = input_format(file.filename) if file else None
+    if not file_format:
+        return jsonify({"error": UNSUPPORTED_FILE})
+
+    factors = [f.strip() for field in request.form.getlist('factors') for f in field.split(',') if f.strip()]
+    dependent_var = request.form.get('dependent_var', '')
+    covariate = request.form.get('covariate') or None
+    backend = request.form.get('backend', app.config['ANOVA_BACKEND'])
+    try:
+        ss_type = int(request.form.get('ss_type') or SS_TYPE)
+        if ss_type not in SS_TYPES:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "SS type must be 1, 2 or 3."})
+    if backend not in BACKENDS:
+        return jsonify({"error": "Unknown ANOVA backend."})
+    try:
+        factorial_columns(factors, dependent_var, covariate)
+        output = result_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+
+    key = result_key(digest_stream(file.stream), file_format, 'factorial', factors, dependent_var, covariate,
+                     ss_type, backend, ALPHA)
+    etag = format_etag(key, output)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    result = result_cache.get(key) if result_cache is not None else None
+    if result is None:
+        try:
+            with upload_job_source(file) as source:
+                effects = run_analysis(analyze_factorial_csv, source, factors, dependent_var, covariate, ss_type,
+                                       backend, chunksize=app.config['CSV_CHUNKSIZE'], file_format=file_format)
+        except PoolBusy as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+        except ColumnError:
+            return jsonify({"error": "One or more specified columns do not exist in the uploaded file."})
+        except ValueError as e:
+            return jsonify({"error": str(e)})
+        # A list keeps the table's order through jsonify, which sorts object keys
+        result = {"factors": factors, "dependent_var": dependent_var, "covariate": covariate, "ss_type": ss_type,
+                  "effects": [{"Effect": effect, **row} for effect, row in effects.items()]}
+        if result_cache is not None:
+            result_cache.put(key, result)
+
+    response = jsonify(compact_factorial(result) if output == 'compact' else result)
+    response.set_etag(etag)
+    return response
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    # Same form as POST /, but answers at once with a job to poll instead of waiting for the result
+    file = request.files.get('csvFile')
+    file_format = input_format(file.filename) if file else None
+    if not file_format:
+        return jsonify({"error": UNSUPPORTED_FILE})
+
+    factor1 = request.form['factor1']
+    factor2 = request.form['factor2']
+    dependent_var = request.form['dependent_var']
+    try:
+        options = analysis_options(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+
+    key = None
+    if reproducible(options):
+        key = result_key(digest_stream(file.stream), file_format, factor1, factor2, dependent_var,
+                         ALPHA, SS_TYPE, sorted(options.items()))
+    result = result_cache.get(key) if result_cache is not None and key is not None else None
+    if result is not None:
+        job_id = job_store.create(status='done', result=result, key=key)
+    else:
+        try:
+            source, filepath = spool_for_job(file, app.config['UPLOAD_MODE'], app.config['UPLOAD_FOLDER'],
+                                             app.config['UPLOAD_SPOOL_MAX_SIZE'])
+        except ValueError as e:
+            return jsonify({"error": str(e)})
+        job_id = job_store.create(key=key)
+        try:
+            future = job_pool.submit(run_job, job_store.path, job_id, analyze_csv, source, factor1, factor2,
+                                     dependent_var, chunksize=app.config['CSV_CHUNKSIZE'], file_format=file_format,
+                                     cleanup=filepath, resampling_workers=app.config['RESAMPLING_WORKERS'], **options)
+        except PoolBusy as e:
+            if filepath is not None:
+                os.remove(filepath)
+            job_store.update(job_id, status='failed', stage='failed', error=str(e))
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+        job_store.track(job_id, future, cleanup=filepath)
+        if result_cache is not None and key is not None:
+            future.add_done_callback(lambda _: cache_job_result(job_id))
+
+    return jsonify({
+        "job_id": job_id,
+        "status_url": url_for('job_status', job_id=job_id),
+        "result_url": url_for('job_result', job_id=job_id),
+    }), 202
+
+
+def cache_job_result(job_id):
+    # Done callback of a job: later uploads of the same file and parameters are served from the cache
+    job = job_store.get(job_id)
+    if job is not None and job['status'] == 'done' and job['key']:
+        result_cache.put(job['key'], job['result'])
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job."}), 404
+    del job['result'], job['key']
+    return jsonify(job)
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job."}), 404
+    if job['status'] == 'failed':
+        return jsonify({"error": job['error']})
+    if job['status'] != 'done':
+        return jsonify({"status": job['status'], "stage": job['stage'], "rows": job['rows']}), 202
+    try:
+        output = result_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+    # A finished job has the same ETag as POST / of the same upload and parameters
+    response = jsonify(compact_result(job['result']) if output == 'compact' else job['result'])
+    if job['key']:
+        response.set_etag(format_etag(job['key'], output))
+    return response.make_conditional(request)
+
+
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    # An append-only analysis: the column roles are fixed now, rows arrive later in batches
+    fields = request.get_json(silent=True) or request.form
+    try:
+        columns = [fields['factor1'], fields['factor2'], fields['dependent_var']]
+    except KeyError:
+        return jsonify({"error": "A session needs factor1, factor2 and dependent_var."})
+    if len(set(columns)) < 3:
+        return jsonify({"error": "factor1, factor2 and dependent_var must be different columns."})
+
+    session_id = session_store.create(*columns)
+    return jsonify({
+        "session_id": session_id,
+        "url": url_for('get_session', session_id=session_id),
+        "rows_url": url_for('append_session_rows', session_id=session_id),
+    }), 201
+
+
+@app.route('/sessions/<session_id>/rows', methods=['POST'])
+def append_session_rows(session_id):
+    # A batch is either a file upload or a JSON body {"rows": [{column: value, ...}, ...]};
+    # it is reduced to cell statistics and merged, without touching earlier batches
+    session = session_store.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown session."}), 404
+    columns = session['factor1'], session['factor2'], session['dependent_var']
+
+    file = request.files.get('csvFile')
+    try:
+        if file:
+            file_format = input_format(file.filename)
+            if not file_format:
+                return jsonify({"error": UNSUPPORTED_FILE})
+            file.stream.seek(0)
+            stats = read_cell_stats(file.stream, *columns, chunksize=app.config['CSV_CHUNKSIZE'],
+                                    file_format=file_format)
+        else:
+            body = request.get_json(silent=True)
+            if not isinstance(body, dict) or not isinstance(body.get('rows'), list):
+                return jsonify({"error": "Send a data file or a JSON object with a list of rows."})
+            stats = read_records_cell_stats(body['rows'], *columns)
+        # Merging can still fail when the batch's levels can't be ordered with the session's
+        merged = session_store.append(session_id, stats)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)})
+    if merged is None:
+        return jsonify({"error": "Unknown session."}), 404
+    return jsonify({"appended": stats.total, "rows": merged.total})
+
+
+@app.route('/sessions/<session_id>', methods=['GET', 'DELETE'])
+def get_session(session_id):
+    if request.method == 'DELETE':
+        if not session_store.delete(session_id):
+            return jsonify({"error": "Unknown session."}), 404
+        return jsonify({"session_id": session_id, "deleted": True})
+
+    session = session_store.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown session."}), 404
+    try:
+        output = result_format()
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+    stats = session.pop('stats')
+    session['rows'] = stats.total
+    session['result'] = cells_results(stats, ALPHA, is_checked(request.args.get('posthoc')))[0] if stats.total else None
+    if output == 'compact' and session['result'] is not None:
+        session['result'] = compact_result(session['result'])
+    return jsonify(session)
+
+
+@app.route('/sessions/<session_id>/summary')
+def get_session_summary(session_id):
+    session = session_store.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown session."}), 404
+    return jsonify(dump_summary(session['stats'], session['factor1'], session['factor2'], session['dependent_var']))
+
+
+@app.route('/summaries', methods=['POST'])
+def create_summary():
+    # Reduce one shard to its mergeable per-cell summary
+    file = request.files.get('csvFile')
+    file_format = input_format(file.filename) if file else None
+    if not file_format:
+        return jsonify({"error": UNSUPPORTED_FILE})
+
+    try:
+        with upload_job_source(file) as source:
+            result = run_analysis(summarize_file, source, request.form['factor1'], request.form['factor2'],
+                                  request.form['dependent_var'], chunksize=app.config['CSV_CHUNKSIZE'],
+                                  file_format=file_format)
+    except PoolBusy as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    except KeyError:
+        return jsonify({"error": "A summary needs factor1, factor2 and dependent_var."})
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+    return jsonify(result)
+
+
+@app.route('/summaries/merge', methods=['POST'])
+def merge_summary():
+    # Summaries come as a JSON body {"summaries": [...]} or as several uploaded "summaries" files
+    body = request.get_json(silent=True)
+    try:
+        if isinstance(body, dict):
+            summaries = body.get('summaries') or []
+        else:
+            summaries = [json.load(f.stream) for f in request.files.getlist('summaries')]
+        columns, stats = merge_summaries(summaries)
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+    return jsonify({"summary": dump_summary(stats, *columns),
+                    "result": anova_from_cells(stats, ALPHA)[0] if stats.total else None})
+
+
+@app.route('/datasets', methods=['GET', 'POST'])
+def datasets():
+    if request.method == 'GET':
+        # Level lists can be long, so the listing only counts them
+        return jsonify({"datasets": [
+            {**meta, "columns": [{"name": c['name'], "kind": c['kind'],
+                                  "levels": None if c['levels'] is None else len(c['levels'])}
+                                 for c in meta['columns']]}
+            for meta in dataset_registry.list()]})
+
+    # Register an upload once; later analyses name its dataset_id instead of re-sending the file
+    file = request.files.get('csvFile')
+    file_format = input_format(file.filename) if file else None
+    if not file_format:
+        return jsonify({"error": UNSUPPORTED_FILE})
+    try:
+        with upload_job_source(file) as source:
+            meta = run_analysis(register_dataset, dataset_registry.directory, source, file_format,
+                                request.form.get('name') or file.filename, chunksize=app.config['CSV_CHUNKSIZE'])
+    except PoolBusy as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+    return jsonify({**meta, "url": url_for('dataset', dataset_id=meta['dataset_id'])}), 201
+
+
+@app.route('/datasets/<dataset_id>', methods=['GET', 'DELETE'])
+def dataset(dataset_id):
+    if request.method == 'DELETE':
+        if not dataset_registry.delete(dataset_id):
+            return jsonify({"error": "Unknown dataset."}), 404
+        return jsonify({"dataset_id": dataset_id, "deleted": True})
+
+    meta = dataset_registry.get(dataset_id)
+    if meta is None:
+        return jsonify({"error": "Unknown dataset."}), 404
+    return jsonify(meta)
+
+
+@app.route('/datasets/<dataset_id>/analyze', methods=['POST'])
+def analyze_registered(dataset_id):
+    # Same fields as POST / minus the file, as form fields or a JSON object
+    fields = request.get_json(silent=True) or request.form
+    if dataset_registry.get(dataset_id) is None:
+        return jsonify({"error": "Unknown dataset."}), 404
+    try:
+        factor1, factor2, dependent_var = fields['factor1'], fields['factor2'], fields['dependent_var']
+        options = analysis_options(fields)
+        output = result_format()
+    except KeyError:
+        return jsonify({"error": "An analysis needs factor1, factor2 and dependent_var."})
+    except ValueError as e:
+        return jsonify({"error": str(e)})
+
+    # Registered datasets never change, so their id stands in for the file's digest
+    key = None
+    if reproducible(options):
+        key = result_key('dataset', dataset_id, factor1, factor2, dependent_var, ALPHA, SS_TYPE,
+                         sorted(options.items()))
+        response = not_modified(format_etag(key, output))
+        if response is not None:
+            return response
+    cache = result_cache if key is not None else None
+
+    result = cache.get(key) if cache is not None else None
+    if result is None:
+        try:
+            result = run_analysis(analyze_dataset, dataset_registry.directory, dataset_id, factor1, factor2,
+                                  dependent_var, resampling_workers=app.config['RESAMPLING_WORKERS'], **options)[0]
+        except PoolBusy as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+        except KeyError:
+            return jsonify({"error": "Unknown dataset."}), 404
+        except ValueError as e:
+            return jsonify({"error": str(e)})
+        if cache is not None:
+            cache.put(key, result)
+
+    response = jsonify(compact_result(result) if output == 'compact' else result)
+    if key is not None:
+        response.set_etag(format_etag(key, output))
+    return response
+
+
+@app.route('/healthz')
+def healthz():
+    return jsonify({"status": "ok", "in_flight": job_pool.in_flight, "max_pending": job_pool.max_pending})
+
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text format; async job counts are read from the job store at scrape time
+    if metrics_store is None:
+        return jsonify({"error": "Metrics are disabled."}), 404
+    jobs = [({'status': status}, count) for status, count in job_store.counts().items()]
+    return app.response_class(metrics_store.render({'anova_jobs': jobs}),
+                              content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    if result_cache is None:
+        return jsonify({"error": "Result cache is disabled."})
+    return jsonify(result_cache.stats())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,34 @@
+"""Static CSS/JS and the compiled page templates that link them.
+
+Each static URL carries a digest of the file's contents (?v=...), so a changed file
+gets a new URL and versioned responses can be cached by browsers and proxies for a
+year without ever going stale.
+"""
+import hashlib
+import os
+
+from flask import request
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def static_url(app, filename):
+    with open(os.path.join(app.static_folder, filename), 'rb') as f:
+        version = hashlib.sha256(f.read()).hexdigest()[:12]
+    return f"{app.static_url_path}/{filename}?v={version}"
+
+
+def compile_page(app, source, **static_files):
+    """Compile a page template once, with static_files {name: filename} bound to their versioned URLs."""
+    return app.jinja_env.from_string(source, globals={name: static_url(app, filename)
+                                                      for name, filename in static_files.items()})
+
+
+def cache_static(response):
+    # after_request hook: only versioned URLs are immutable, a bare /static/... path still revalidates
+    if request.endpoint == 'static' and request.args.get('v') and response.status_code == 200:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
@@ -0,0 +1,264 @@
+"""Benchmarks of CSV parsing, model fitting, F tests and full requests.
+
+Every case is a synthetic design written to a temporary CSV, or one of the bundled
+sample files as a fixed baseline. Each stage is timed on its own:
+
+- parse: read_columns, i.e. parsing the three columns of the CSV
+- encode: factor levels to integer codes (EncodedRows)
+- fit: the SS table of the case's backend
+- ftest: F statistics, p-values and critical values from the table
+- request: a POST / round trip through the Flask test client (result cache off, analyses inline)
+
+    python benchmark.py run [--suite quick|full] [--case NAME ...] [--repeat 3] [-o results.json]
+    python benchmark.py compare baseline.json results.json [--threshold 0.25] [--min-seconds 0.005]
+
+compare exits with status 1 when a stage got slower than baseline by more than the
+threshold (and by more than min-seconds, below which timings are mostly noise).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+import pandas as pd
+import scipy
+
+from anova import CellStats, EncodedRows, anova_results, cell_anova_table, statsmodels_rows_table
+from absorption import sparse_rows_table
+from robust import art_tests, cell_wald_tests
+from ingest import read_columns
+
+VERSION = 1
+HERE = os.path.dirname(os.path.abspath(__file__))
+WRITE_ROWS = 1_000_000
+
+# Synthetic cases: rows, levels of each factor, balanced or Zipf-distributed levels,
+# normal or lognormal (skewed) response, and the backend and test method that fit them
+QUICK = [
+    {'name': 'balanced-1k', 'rows': 1_000, 'levels': (2, 3)},
+    {'name': 'balanced-100k', 'rows': 100_000, 'levels': (4, 5)},
+    {'name': 'unbalanced-100k', 'rows': 100_000, 'levels': (20, 10), 'balanced': False},
+    {'name': 'skewed-1m', 'rows': 1_000_000, 'levels': (10, 10), 'skewed': True},
+    {'name': 'highcard-cells-1m', 'rows': 1_000_000, 'levels': (5_000, 20), 'balanced': False},
+    {'name': 'highcard-sparse-1m', 'rows': 1_000_000, 'levels': (5_000, 20), 'balanced': False,
+     'backend': 'sparse'},
+    {'name': 'statsmodels-10k', 'rows': 10_000, 'levels': (4, 5), 'backend': 'statsmodels'},
+    {'name': 'welch-1m', 'rows': 1_000_000, 'levels': (10, 10), 'balanced': False, 'method': 'welch'},
+    {'name': 'hc3-1m', 'rows': 1_000_000, 'levels': (10, 10), 'balanced': False, 'method': 'hc3'},
+    {'name': 'art-1m', 'rows': 1_000_000, 'levels': (10, 10), 'balanced': False, 'method': 'art'},
+]
+FULL = QUICK + [
+    {'name': 'balanced-10m', 'rows': 10_000_000, 'levels': (10, 10)},
+    {'name': 'unbalanced-50m', 'rows': 50_000_000, 'levels': (100, 50), 'balanced': False},
+    {'name': 'highcard-sparse-50m', 'rows': 50_000_000, 'levels': (5_000, 2_000), 'balanced': False,
+     'backend': 'sparse'},
+]
+SUITES = {'quick': QUICK, 'full': FULL}
+
+# The bundled sample files, as fixed baselines
+SAMPLES = [
+    {'name': 'data-2', 'path': 'data 2.csv', 'columns': ('Brand', 'Temperature', 'Value')},
+    {'name': 'shopping-trends', 'path': 'shopping_trends.csv',
+     'columns': ('Gender', 'Category', 'Purchase Amount (USD)')},
+]
+
+
+def synthetic_rows(rows, levels, balanced=True, skewed=False, seed=0):
+    """Yield a synthetic two-factor design in DataFrames of at most WRITE_ROWS rows."""
+    rng = np.random.default_rng(seed)
+    a, b = levels
+    # Fixed effects per level and per cell, so every effect is present
+    effect1, effect2 = rng.normal(size=a), rng.normal(size=b)
+    zipf1, zipf2 = 1 / np.arange(1, a + 1), 1 / np.arange(1, b + 1)
+    labels1 = np.array([f'A{i}' for i in range(a)], dtype=object)
+    labels2 = np.array([f'B{j}' for j in range(b)], dtype=object)
+    for start in range(0, rows, WRITE_ROWS):
+        size = min(WRITE_ROWS, rows - start)
+        if balanced:
+            index = np.arange(start, start + size)
+            codes1, codes2 = index % a, (index // a) % b
+        else:
+            codes1 = rng.choice(a, size, p=zipf1 / zipf1.sum())
+            codes2 = rng.choice(b, size, p=zipf2 / zipf2.sum())
+        mean = effect1[codes1] + effect2[codes2] + 0.5 * effect1[codes1] * effect2[codes2]
+        y = np.exp(mean / 4 + rng.normal(size=size)) if skewed else mean + rng.normal(size=size)
+        yield pd.DataFrame({'factor1': labels1[codes1], 'factor2': labels2[codes2], 'y': y})
+
+
+def write_case(case, directory):
+    path = os.path.join(directory, case['name'] + '.csv')
+    for i, chunk in enumerate(synthetic_rows(case['rows'], case['levels'], case.get('balanced', True),
+                                             case.get('skewed', False))):
+        chunk.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+    return path
+
+
+def fit(rows, backend, method='classic'):
+    if backend == 'statsmodels':
+        return statsmodels_rows_table(rows)
+    if backend == 'sparse':
+        return sparse_rows_table(rows)
+    stats = CellStats.from_rows(rows)
+    # Robust methods add their own tests to the classic table
+    if method == 'art':
+        art_tests(rows)
+    elif method != 'classic':
+        cell_wald_tests(stats, method)
+    return cell_anova_table(stats)
+
+
+def measure(function, repeat):
+    """Best and median seconds per call; quick functions are looped so each timing lasts ~0.2 s."""
+    timer = timeit.Timer(function)
+    number = 1
+    if timer.timeit(1) < 0.2:
+        number, _ = timer.autorange()
+    times = [t / number for t in timer.repeat(repeat, number)]
+    return {'min': min(times), 'median': statistics.median(times), 'number': number}
+
+
+def _client():
+    # Results must be recomputed on every request, in this process, without metrics or timing logs
+    os.environ['RESULT_CACHE_PATH'] = ''
+    os.environ['ANOVA_WORKERS'] = '0'
+    os.environ['METRICS_PATH'] = ''
+    os.environ['TIMING_LOG'] = '0'
+    import app1
+    return app1.app.test_client()
+
+
+def run_case(case, path, repeat, max_request_rows):
+    factor1, factor2, y = case.get('columns', ('factor1', 'factor2', 'y'))
+    backend = case.get('backend', 'cells')
+    method = case.get('method', 'classic')
+    df = read_columns(path, factor1, factor2, y)
+    rows = EncodedRows.from_frame(df, factor1, factor2, y)
+    table = fit(rows, backend, method)
+
+    stages = {
+        'parse': lambda: read_columns(path, factor1, factor2, y),
+        'encode': lambda: EncodedRows.from_frame(df, factor1, factor2, y),
+        'fit': lambda: fit(rows, backend, method),
+        'ftest': lambda: anova_results(table),
+    }
+    if len(df) <= max_request_rows:
+        client = _client()
+
+        def request():
+            with open(path, 'rb') as f:
+                response = client.post('/', data={'csvFile': (f, 'data.csv'), 'factor1': factor1,
+                                                  'factor2': factor2, 'dependent_var': y, 'backend': backend,
+                                                  'method': method},
+                                       content_type='multipart/form-data')
+            if 'error' in response.get_json():
+                raise RuntimeError(f"{case['name']}: {response.get_json()['error']}")
+
+        stages['request'] = request
+
+    return {
+        'case': case['name'],
+        'rows': len(df),
+        'levels': [len(rows.levels1), len(rows.levels2)],
+        'backend': backend,
+        'method': method,
+        'stages': {name: measure(function, repeat) for name, function in stages.items()},
+    }
+
+
+def run(cases, repeat=3, max_request_rows=1_000_000, samples=SAMPLES, progress=None):
+    results = []
+    for sample in samples:
+        results.append(run_case(sample, os.path.join(HERE, sample['path']), repeat, max_request_rows))
+        if progress is not None:
+            progress(results[-1])
+    for case in cases:
+        with tempfile.TemporaryDirectory() as directory:
+            results.append(run_case(case, write_case(case, directory), repeat, max_request_rows))
+        if progress is not None:
+            progress(results[-1])
+    return {
+        'version': VERSION,
+        'created': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'packages': {module.__name__: module.__version__ for module in (np, pd, scipy)},
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=0.25, min_seconds=0.005):
+    """(case, stage, baseline seconds, current seconds, ratio, regressed) for every stage in both runs."""
+    before = {(r['case'], stage): t['min'] for r in baseline['results'] for stage, t in r['stages'].items()}
+    rows = []
+    for result in current['results']:
+        for stage, timing in result['stages'].items():
+            old = before.get((result['case'], stage))
+            if old is None:
+                continue
+            new = timing['min']
+            regressed = new > old * (1 + threshold) and new - old > min_seconds
+            rows.append((result['case'], stage, old, new, new / old, regressed))
+    return rows
+
+
+def _report(result):
+    timings = '  '.join(f"{stage} {t['min'] * 1000:.2f}ms" for stage, t in result['stages'].items())
+    print(f"{result['case']:<20} {result['rows']:>10} rows  {timings}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help="run the benchmarks and write their timings as JSON")
+    run_parser.add_argument('--suite', choices=SUITES, default='quick')
+    run_parser.add_argument('--case', action='append', help="run only these cases (repeatable)")
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--max-request-rows', type=int, default=1_000_000,
+                            help="skip the request stage for cases larger than this")
+    run_parser.add_argument('--no-samples', action='store_true', help="skip the bundled sample files")
+    run_parser.add_argument('-o', '--output')
+    compare_parser = commands.add_parser('compare', help="compare two runs, exiting with 1 on a regression")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.25, help="allowed slowdown (0.25 = 25%%)")
+    compare_parser.add_argument('--min-seconds', type=float, default=0.005)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        cases = SUITES[args.suite]
+        samples = [] if args.no_samples else SAMPLES
+        if args.case:
+            known = {c['name'] for c in FULL + SAMPLES}
+            unknown = set(args.case) - known
+            if unknown:
+                parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+            cases = [c for c in FULL if c['name'] in args.case]
+            samples = [s for s in samples if s['name'] in args.case]
+        report = run(cases, args.repeat, args.max_request_rows, samples, _report)
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + '\n')
+        else:
+            print(text)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold, args.min_seconds)
+    for case, stage, old, new, ratio, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{case:<20} {stage:<8} {old * 1000:>10.2f}ms -> {new * 1000:>10.2f}ms  x{ratio:.2f}{flag}")
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""Bootstrap confidence intervals for partial eta-squared and partial omega-squared.
+
+Rows are resampled with replacement within each cell (a stratified bootstrap), so
+every resample keeps the cell counts of the data. Each resample is then summarized by
+its cell sums and within-cell SS alone, and the Type II effect SS of a whole batch
+of resamples come from anova.effect_ss with a single pseudo-inverse.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from anova import EncodedRows, effect_df, effect_ss
+
+RESAMPLES = 10_000
+CONFIDENCE = 0.95
+# Elements of the (batch, rows) resample matrix; bounds memory at ~32 MB per batch
+BATCH_ELEMENTS = 4_000_000
+
+EFFECTS = ("Rows (Factor 1)", "Columns (Factor 2)", "Interaction")
+
+
+def effect_sizes(ss_effects, df_effects, ss_within, df_within, total):
+    """Partial eta-squared and partial omega-squared; ss_effects has the effects on its last axis."""
+    ss_effects = np.asarray(ss_effects, dtype=float)
+    ss_within = np.asarray(ss_within, dtype=float)[..., None]
+    df_effects = np.asarray(df_effects, dtype=float)
+    ms_within = ss_within / df_within
+    with np.errstate(invalid='ignore', divide='ignore'):
+        eta = ss_effects / (ss_effects + ss_within)
+        omega = (ss_effects - df_effects * ms_within) / (ss_effects + (total - df_effects) * ms_within)
+    return eta, omega
+
+
+def _resample_batch(centered, position_start, position_size, n, cell_sums, df_effects, df_within, seed, size):
+    # One batch of resamples: draw each row's replacement from the rows of its own cell
+    rng = np.random.default_rng(seed)
+    draws = position_start + (rng.random((size, len(centered))) * position_size).astype(np.int64)
+    values = centered[draws]
+
+    counts = n.ravel()
+    nonempty = np.flatnonzero(counts)
+    starts = np.concatenate([[0], np.cumsum(counts[nonempty])[:-1]])
+    deviation_sums = np.add.reduceat(values, starts, axis=1)
+    # Within-cell SS from deviations around the original cell means, which keeps it well conditioned
+    ss_within = (np.add.reduceat(values ** 2, starts, axis=1) - deviation_sums ** 2 / counts[nonempty]).sum(axis=1)
+
+    sums = np.broadcast_to(cell_sums.ravel(), (size, n.size)).copy()
+    sums[:, nonempty] += deviation_sums
+    ss_factor1, ss_factor2, ss_interaction, _ = effect_ss(n, sums.reshape(size, *n.shape))
+    eta, omega = effect_sizes(np.stack([ss_factor1, ss_factor2, ss_interaction], axis=-1),
+                              df_effects, ss_within, df_within, counts.sum())
+    return np.concatenate([eta, omega], axis=1)
+
+
+def _resample_batches(centered, position_start, position_size, n, cell_sums, df_effects, df_within, batches):
+    return np.concatenate([_resample_batch(centered, position_start, position_size, n, cell_sums,
+                                           df_effects, df_within, seed, size) for seed, size in batches])
+
+
+def bootstrap_effect_sizes(rows, resamples=RESAMPLES, confidence=CONFIDENCE, seed=None, workers=1):
+    """Point estimates and percentile CIs of partial eta- and omega-squared for the EncodedRows of an analysis.
+
+    Resamples are drawn in batches, each with its own child of SeedSequence(seed), so a
+    given seed gives the same intervals whatever the number of workers.
+    """
+    shape = rows.shape
+    order = np.argsort(rows.cell, kind='stable')
+    cell, y = rows.cell[order], rows.y[order]
+
+    n = np.bincount(cell, minlength=shape[0] * shape[1]).reshape(shape)
+    counts = n.ravel()
+    cell_sums = np.bincount(cell, weights=y, minlength=n.size)
+    cell_means = np.divide(cell_sums, counts, out=np.zeros(n.size), where=counts > 0)
+    centered = y - cell_means[cell]
+    # For every row position, the first row and the size of the cell it belongs to
+    position_start = (np.cumsum(counts) - counts)[cell]
+    position_size = counts[cell]
+
+    df_effects = np.array(effect_df(n), dtype=float)
+    df_within = len(y) - (n > 0).sum()
+
+    ss_factor1, ss_factor2, ss_interaction, _ = effect_ss(n, cell_sums.reshape(shape))
+    eta, omega = effect_sizes([ss_factor1, ss_factor2, ss_interaction], df_effects,
+                              (centered ** 2).sum(), df_within, len(y))
+
+    batch = max(1, min(resamples, BATCH_ELEMENTS // max(len(y), 1)))
+    sizes = [min(batch, resamples - start) for start in range(0, resamples, batch)]
+    batches = list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+    args = (centered, position_start, position_size, n, cell_sums.reshape(shape), df_effects, df_within)
+
+    # Each worker gets every workers-th batch, so the data is sent to it only once
+    workers = min(workers, len(batches))
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(_resample_batches, *args, batches[i::workers]) for i in range(workers)]
+            replicates = np.concatenate([future.result() for future in futures])
+    else:
+        replicates = _resample_batches(*args, batches)
+
+    tail = (1 - confidence) / 2
+    lower, upper = np.nanquantile(replicates, [tail, 1 - tail], axis=0)
+    results = {}
+    for i, effect in enumerate(EFFECTS):
+        for j, (name, estimate) in enumerate((("Partial Eta-squared", eta), ("Partial Omega-squared", omega))):
+            column = j * len(EFFECTS) + i
+            results[f"{name} {effect}"] = float(estimate[i])
+            results[f"{name} {effect} CI Lower"] = float(lower[column])
+            results[f"{name} {effect} CI Upper"] = float(upper[column])
+    return results
+
+
+def bootstrap_test(df, factor1, factor2, dependent_var, resamples=RESAMPLES, confidence=CONFIDENCE, seed=None,
+                   workers=1):
+    return bootstrap_effect_sizes(EncodedRows.from_frame(df, factor1, factor2, dependent_var), resamples, confidence,
+                                  seed, workers)
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing, contextmanager
+
+CACHE_PATH = os.path.join(tempfile.gettempdir(), 'anova-results.sqlite3')
+MAX_BYTES = 64 * 1024 * 1024
+TTL = 24 * 60 * 60
+
+
+def digest_stream(stream, block_size=1024 * 1024):
+    """SHA-256 of a seekable stream; the stream is rewound afterwards."""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for block in iter(lambda: stream.read(block_size), b''):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def result_key(content_digest, *params):
+    """Cache key for one analysis: the uploaded bytes plus every parameter that affects the result."""
+    return hashlib.sha256(json.dumps([content_digest, *params]).encode()).hexdigest()
+
+
+class ResultCache:
+    """SQLite-backed LRU/TTL cache of analysis results, shared by every process using the same file."""
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES, ttl=TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS results '
+                       '(key TEXT PRIMARY KEY, value TEXT, size INTEGER, created REAL, accessed REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+
+    @contextmanager
+    def _connect(self):
+        with closing(sqlite3.connect(self.path, timeout=30)) as db:
+            with db:
+                yield db
+
+    def _count(self, db, name):
+        db.execute('INSERT INTO counters VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute('SELECT value FROM results WHERE key = ? AND created > ?',
+                             (key, now - self.ttl)).fetchone()
+            if row is None:
+                self._count(db, 'misses')
+                return None
+            db.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+            self._count(db, 'hits')
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        text = json.dumps(value)
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)', (key, text, len(text), now, now))
+            self._evict(db, now)
+
+    def _evict(self, db, now):
+        expired = db.execute('DELETE FROM results WHERE created <= ?', (now - self.ttl,)).rowcount
+        # Drop least recently used entries until the stored results fit in max_bytes
+        kept, evicted = 0, []
+        for key, size in db.execute('SELECT key, size FROM results ORDER BY accessed DESC').fetchall():
+            kept += size
+            if kept > self.max_bytes:
+                evicted.append((key,))
+        db.executemany('DELETE FROM results WHERE key = ?', evicted)
+        if expired or evicted:
+            db.execute('INSERT INTO counters VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?',
+                       ('evictions', expired + len(evicted), expired + len(evicted)))
+
+    def stats(self):
+        with self._connect() as db:
+            counters = dict(db.execute('SELECT name, value FROM counters').fetchall())
+            entries, size = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        return {
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'evictions': counters.get('evictions', 0),
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+        }
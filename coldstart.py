@@ -0,0 +1,47 @@
+"""Cold-start report for the serverless app.
+
+Runs each stage in a fresh interpreter and prints the wall time plus the import cost
+broken down by top-level package:
+
+    python coldstart.py [app_module]
+"""
+import os
+import subprocess
+import sys
+from collections import Counter
+
+STAGES = [
+    ("import", "import {app}"),
+    ("GET /", "import {app}; {app}.app.test_client().get('/')"),
+    ("GET /healthz", "import {app}; {app}.app.test_client().get('/healthz')"),
+    ("first POST imports", "import {app}; import ingest"),
+]
+
+
+def run_stage(statement):
+    timed = f"import time; _t = time.perf_counter(); {statement}; print(time.perf_counter() - _t)"
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', timed],
+                          capture_output=True, text=True, check=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall = float(proc.stdout.strip().splitlines()[-1])
+
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    by_package = Counter()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        by_package[name.strip().split('.')[0]] += int(self_us)
+    return wall, by_package
+
+
+def main(app='app', top=10):
+    for label, statement in STAGES:
+        wall, by_package = run_stage(statement.format(app=app))
+        print(f"{label}: {wall * 1000:.1f} ms wall, {sum(by_package.values()) / 1000:.1f} ms in imports")
+        for package, us in by_package.most_common(top):
+            print(f"    {package:<24} {us / 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
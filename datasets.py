@@ -0,0 +1,222 @@
+"""Server-side registry of uploaded datasets, stored as memory-mapped Arrow IPC files.
+
+A dataset is converted once, chunk by chunk. Text columns become int32 level codes
+(-1 for missing) with their levels kept in a JSON sidecar, and numeric columns
+become float64. Analyses then memory-map the file and read the record batches of
+just the columns they use. No parsing happens, and every worker process shares the
+same page cache.
+"""
+import json
+import os
+import tempfile
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from anova import ALPHA, CellStats
+from defaults import CHUNKSIZE
+from ingest import ColumnError, analyze_frame, cells_results, check_method, read_raw_chunks
+
+DATASET_DIR = os.path.join(tempfile.gettempdir(), 'anova-datasets')
+
+
+class DatasetRegistry:
+    """Datasets under directory: <id>.arrow holds the columns and <id>.json their description."""
+
+    def __init__(self, directory=DATASET_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, dataset_id, suffix):
+        # Ids are hex uuids; anything else can't name a file in the registry
+        if not (len(dataset_id) == 32 and all(c in '0123456789abcdef' for c in dataset_id)):
+            raise KeyError(dataset_id)
+        return os.path.join(self.directory, dataset_id + suffix)
+
+    def register(self, source, file_format='csv', name=None, chunksize=CHUNKSIZE, progress=None):
+        """Convert source into a registered dataset and return its description."""
+        import pyarrow as pa
+        import pyarrow.ipc
+
+        dataset_id = uuid.uuid4().hex
+        path = self._path(dataset_id, '.arrow')
+        partial = path + '.partial'
+        columns, levels, lookups, writer, rows = None, {}, {}, None, 0
+        try:
+            for chunk in read_raw_chunks(source, chunksize, file_format):
+                if columns is None:
+                    # The first chunk decides which columns are numeric and which are factors
+                    columns = {str(c): 'numeric' if pd.api.types.is_numeric_dtype(chunk[c]) else 'factor'
+                               for c in chunk.columns}
+                    if len(columns) < len(chunk.columns):
+                        raise ValueError("Column names must be unique.")
+                    levels = {c: [] for c, kind in columns.items() if kind == 'factor'}
+                    lookups = {c: {} for c in levels}
+                    schema = pa.schema([(c, pa.int32() if kind == 'factor' else pa.float64())
+                                        for c, kind in columns.items()])
+                    writer = pyarrow.ipc.new_file(partial, schema)
+                chunk.columns = [str(c) for c in chunk.columns]
+
+                arrays = []
+                for column, kind in columns.items():
+                    if kind == 'numeric':
+                        try:
+                            arrays.append(pa.array(pd.to_numeric(chunk[column]).to_numpy(dtype=float)))
+                        except (ValueError, TypeError):
+                            raise ValueError(f"Column {column} has non-numeric values after row {rows}.")
+                    else:
+                        arrays.append(pa.array(_encode(chunk[column], levels[column], lookups[column])))
+                writer.write_batch(pa.record_batch(arrays, schema=schema))
+                rows += len(chunk)
+                if progress is not None:
+                    progress('registering', rows)
+            if writer is None:
+                raise ValueError("The file has no data.")
+            writer.close()
+            os.replace(partial, path)
+        except BaseException:
+            if writer is not None:
+                writer.close()
+            for leftover in (partial, path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            raise
+
+        meta = {
+            'dataset_id': dataset_id,
+            'name': name,
+            'rows': rows,
+            'columns': [{'name': c, 'kind': kind, 'levels': levels.get(c)} for c, kind in columns.items()],
+            'bytes': os.path.getsize(path),
+            'created': time.time(),
+        }
+        with open(self._path(dataset_id, '.json.partial'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(self._path(dataset_id, '.json.partial'), self._path(dataset_id, '.json'))
+        return meta
+
+    def get(self, dataset_id):
+        try:
+            with open(self._path(dataset_id, '.json')) as f:
+                return json.load(f)
+        except (KeyError, FileNotFoundError):
+            return None
+
+    def list(self):
+        ids = sorted(f[:-len('.json')] for f in os.listdir(self.directory) if f.endswith('.json'))
+        return [meta for meta in map(self.get, ids) if meta is not None]
+
+    def delete(self, dataset_id):
+        meta = self.get(dataset_id)
+        if meta is None:
+            return False
+        # Workers that still map the file keep reading it; the space is freed once they're done
+        os.remove(self._path(dataset_id, '.json'))
+        os.remove(self._path(dataset_id, '.arrow'))
+        return True
+
+    def _batches(self, dataset_id, columns):
+        import pyarrow as pa
+        import pyarrow.ipc
+
+        meta = self.get(dataset_id)
+        if meta is None:
+            raise KeyError(dataset_id)
+        kinds = {c['name']: c for c in meta['columns']}
+        _check_dataset_columns(kinds, *columns)
+        reader = pyarrow.ipc.open_file(pa.memory_map(self._path(dataset_id, '.arrow')))
+        for i in range(reader.num_record_batches):
+            yield kinds, reader.get_batch(i)
+
+    def cell_stats(self, dataset_id, factor1, factor2, dependent_var, progress=None):
+        """Fold a dataset into per-cell statistics, one memory-mapped record batch at a time."""
+        stats = None
+        rows = 0
+        for kinds, batch in self._batches(dataset_id, [factor1, factor2, dependent_var]):
+            if kinds[dependent_var]['kind'] != 'numeric':
+                raise ValueError(f"Column {dependent_var} is not numeric.")
+            codes1, levels1 = _factor_codes(batch, kinds[factor1])
+            codes2, levels2 = _factor_codes(batch, kinds[factor2])
+            y = batch.column(dependent_var).to_numpy()
+            keep = (codes1 >= 0) & (codes2 >= 0) & ~np.isnan(y)
+            batch_stats = CellStats.from_codes(codes1[keep], codes2[keep], y[keep], levels1, levels2)
+            # Stored factors give every batch the same levels, so the merges skip reindexing
+            stats = batch_stats if stats is None else stats.merge(batch_stats)
+            rows += batch.num_rows
+            if progress is not None:
+                progress('ingesting', rows)
+        if stats is None or stats.total == 0:
+            raise ValueError("No complete rows to analyze.")
+        # Levels are stored in order of appearance; sort them as a CSV read would
+        return stats.reindex(sorted(stats.levels1), sorted(stats.levels2))
+
+    def columns(self, dataset_id, factors, responses):
+        """The factor columns (as categoricals) and response columns of a dataset, in one DataFrame."""
+        parts = []
+        for kinds, batch in self._batches(dataset_id, [*factors, *responses]):
+            part = {}
+            for column in factors:
+                codes, levels = _factor_codes(batch, kinds[column])
+                # Sorted categories give the same level order, and so the same resamples, as a CSV read
+                part[column] = pd.Categorical.from_codes(codes, categories=levels).reorder_categories(sorted(levels))
+            for column in responses:
+                if kinds[column]['kind'] != 'numeric':
+                    raise ValueError(f"Column {column} is not numeric.")
+                part[column] = batch.column(column).to_numpy()
+            parts.append(pd.DataFrame(part))
+        return pd.concat(parts, ignore_index=True)
+
+
+def _check_dataset_columns(kinds, *columns):
+    missing = [c for c in dict.fromkeys(columns) if c not in kinds]
+    if missing:
+        raise ColumnError(f"Columns not found: {', '.join(missing)}")
+
+
+def _encode(values, levels, lookup):
+    # Map values to codes of a level list that grows as new levels show up, -1 for missing
+    codes, uniques = _levels(values)
+    mapping = np.empty(len(uniques), dtype=np.int32)
+    for i, level in enumerate(uniques):
+        if level not in lookup:
+            lookup[level] = len(levels)
+            levels.append(level)
+        mapping[i] = lookup[level]
+    return np.where(codes >= 0, mapping[np.maximum(codes, 0)], -1).astype(np.int32)
+
+
+def _levels(values):
+    # Codes and string levels of a column; numbers read as they would in a CSV, so 3.0 is "3"
+    codes, uniques = pd.factorize(values)
+    if pd.api.types.is_numeric_dtype(uniques):
+        return codes, [str(int(u)) if float(u).is_integer() else str(u) for u in uniques]
+    return codes, [str(u) for u in uniques]
+
+
+def _factor_codes(batch, column):
+    # Factor columns are stored as codes; a numeric column used as a factor is coded on the fly
+    values = batch.column(column['name']).to_numpy()
+    if column['kind'] == 'factor':
+        return values, column['levels']
+    return _levels(values)
+
+
+def analyze_dataset(directory, dataset_id, factor1, factor2, dependent_var, backend='cells', alpha=ALPHA,
+                    progress=None, permutations=0, bootstrap=0, confidence=0.95, seed=None, resampling_workers=1,
+                    posthoc=False, method='classic'):
+    check_method(method, backend, permutations, bootstrap)
+    registry = DatasetRegistry(directory)
+    if backend == 'cells' and not (permutations or bootstrap or method == 'art'):
+        stats = registry.cell_stats(dataset_id, factor1, factor2, dependent_var, progress)
+        if progress is not None:
+            progress('computing', stats.total)
+        return cells_results(stats, alpha, posthoc, method)
+    df = registry.columns(dataset_id, [factor1, factor2], [dependent_var])
+    return analyze_frame(df, factor1, factor2, dependent_var, backend, alpha, progress, permutations, bootstrap,
+                         confidence, seed, resampling_workers, posthoc, method)
+
+
+def register_dataset(directory, source, file_format='csv', name=None, chunksize=CHUNKSIZE, progress=None):
+    return DatasetRegistry(directory).register(source, file_format, name, chunksize, progress)
@@ -0,0 +1,25 @@
+# Analysis defaults shared by the apps. This module must stay free of heavy imports so the
+# apps can read it at startup without loading pandas, scipy or statsmodels.
+BACKENDS = ('cells', 'statsmodels', 'sparse')
+# Tests of the two-way effects: the classic F test, or one of the robust modes in robust.py
+METHODS = ('classic', 'welch', 'hc3', 'art')
+ALPHA = 0.05
+SS_TYPE = 2
+CHUNKSIZE = 100_000
+
+# File suffixes the apps accept, and the input format each is read as
+INPUT_SUFFIXES = {
+    '.csv': 'csv',
+    '.csv.gz': 'csv.gz',
+    '.csv.zst': 'csv.zst',
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.xlsx': 'excel',
+}
+
+
+def input_format(filename):
+    """Input format of a file name, or None if it isn't one the apps read."""
+    name = (filename or '').lower()
+    return next((file_format for suffix, file_format in INPUT_SUFFIXES.items() if name.endswith(suffix)), None)
@@ -0,0 +1,273 @@
+"""N-way factorial ANOVA, with an optional covariate (ANCOVA), from per-cell statistics.
+
+Rows are reduced to one record per observed combination of factor levels: its count,
+the mean and M2 of the response and, with a covariate, of the covariate and their
+co-moment. Every model is then fitted in that cell space. The design has one row per
+observed cell, is built as a sparse matrix in sum-to-zero coding, and only its
+(parameters x parameters) normal equations are ever dense. Nothing grows with the row
+count, and empty cells cost nothing.
+
+Type I SS are sequential (the covariate first, then the terms in order), Type II SS adjust
+each term for every term that doesn't contain it, and Type III SS are Wald tests of
+each term's sum-coded parameters in the full model, as in anova_lm(typ=3).
+"""
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from anova import ALPHA, SS_TYPE, _factorize, effects_table
+
+SS_TYPES = (1, 2, 3)
+
+
+class FactorialCells:
+    """Statistics of the observed cells of an N-factor layout, one row per cell.
+
+    cells is a DataFrame indexed by the levels of every factor, with columns n, mean
+    and m2 for the response, plus mean_x, m2_x and c_xy when there is a covariate.
+    """
+
+    def __init__(self, factors, cells, covariate=None):
+        self.factors = list(factors)
+        self.cells = cells
+        self.covariate = covariate
+
+    @classmethod
+    def from_frame(cls, df, factors, dependent_var, covariate=None):
+        # Rows missing any of the columns are dropped, as patsy does
+        data = df[[*factors, dependent_var, *([covariate] if covariate else [])]].dropna()
+        encoded = [_factorize(data[f]) for f in factors]
+        cell = np.zeros(len(data), dtype=np.int64)
+        for codes, levels in encoded:
+            # Compacting after every factor keeps the combined index from overflowing
+            cell, _ = pd.factorize(cell * len(levels) + codes, sort=True)
+        size = int(cell.max()) + 1 if len(cell) else 0
+        first = np.zeros(size, dtype=np.int64)
+        first[cell] = np.arange(len(cell))
+        index = pd.MultiIndex.from_arrays(
+            [np.asarray(levels, dtype=object)[codes[first]] for codes, levels in encoded], names=factors)
+
+        y = data[dependent_var].to_numpy(dtype=float)
+        n = np.bincount(cell, minlength=size)
+        columns = {'n': n, 'mean': np.bincount(cell, weights=y, minlength=size) / n}
+        dy = y - columns['mean'][cell]
+        columns['m2'] = np.bincount(cell, weights=dy ** 2, minlength=size)
+        if covariate:
+            x = data[covariate].to_numpy(dtype=float)
+            columns['mean_x'] = np.bincount(cell, weights=x, minlength=size) / n
+            dx = x - columns['mean_x'][cell]
+            columns['m2_x'] = np.bincount(cell, weights=dx ** 2, minlength=size)
+            columns['c_xy'] = np.bincount(cell, weights=dx * dy, minlength=size)
+        return cls(factors, pd.DataFrame(columns, index=index), covariate)
+
+    @property
+    def total(self):
+        return int(self.cells['n'].sum())
+
+    def merge(self, other):
+        """Combine two sets of cell statistics; cells are matched by their levels."""
+        if self.cells.empty:
+            return other
+        if other.cells.empty:
+            return self
+        return FactorialCells(self.factors, _combine(pd.concat([self.cells, other.cells])), self.covariate)
+
+
+def _combine(parts):
+    # Pool the rows of parts that describe the same cell (Chan et al., for any number of parts)
+    by_cell = list(range(parts.index.nlevels))
+    n = parts['n'].groupby(level=by_cell).sum()
+    weight = parts['n'] / n.reindex(parts.index).to_numpy()
+    combined = {'n': n}
+    deviations = {}
+    for moment, mean in (('m2', 'mean'), ('m2_x', 'mean_x')):
+        if mean in parts:
+            combined[mean] = (parts[mean] * weight).groupby(level=by_cell).sum()
+            deviations[mean] = parts[mean] - combined[mean].reindex(parts.index).to_numpy()
+            combined[moment] = (parts[moment] + parts['n'] * deviations[mean] ** 2).groupby(level=by_cell).sum()
+    if 'c_xy' in parts:
+        co_moment = parts['c_xy'] + parts['n'] * deviations['mean'] * deviations['mean_x']
+        combined['c_xy'] = co_moment.groupby(level=by_cell).sum()
+    return pd.DataFrame(combined)
+
+
+def factorial_terms(factors):
+    """Every main effect and interaction of factors, lowest order first, as patsy orders a*b*c."""
+    return [term for order in range(1, len(factors) + 1) for term in combinations(factors, order)]
+
+
+def _sum_coding(codes, size):
+    # Sparse sum-to-zero contrast columns of one factor: level j < size-1 is column j, the last level is -1s
+    rows = np.arange(len(codes))
+    last = codes == size - 1
+    data = np.ones(len(codes))
+    coded = sparse.csr_matrix((data[~last], (rows[~last], codes[~last])), shape=(len(codes), size - 1))
+    if last.any() and size > 1:
+        last_rows = np.repeat(rows[last], size - 1)
+        minus = sparse.csr_matrix((-np.ones(len(last_rows)), (last_rows, np.tile(np.arange(size - 1), last.sum()))),
+                                  shape=coded.shape)
+        coded = coded + minus
+    return coded
+
+
+def _row_kron(a, b):
+    # Row-wise Kronecker product: row i is kron(a[i], b[i])
+    return sparse.kron(a, np.ones((1, b.shape[1])), format='csr').multiply(
+        sparse.kron(np.ones((1, a.shape[1])), b, format='csr')).tocsr()
+
+
+class _Design:
+    """Normal equations of the full model in cell space, and fits of any subset of its columns."""
+
+    def __init__(self, cells, terms, covariate):
+        index = cells.cells.index.remove_unused_levels()
+        coding = {f: _sum_coding(np.asarray(index.codes[i]), len(index.levels[i]))
+                  for i, f in enumerate(cells.factors)}
+        blocks = [sparse.csr_matrix(np.ones((len(index), 1)))]
+        self.columns = {}
+        start = 1
+        for term in terms:
+            block = coding[term[0]]
+            for factor in term[1:]:
+                block = _row_kron(block, coding[factor])
+            blocks.append(block)
+            self.columns[term] = np.arange(start, start + block.shape[1])
+            start += block.shape[1]
+
+        stats = cells.cells
+        n = stats['n'].to_numpy(dtype=float)
+        total = n.sum()
+        # Centering on the grand means keeps the normal equations well conditioned
+        y = stats['mean'].to_numpy() - (n * stats['mean'].to_numpy()).sum() / total
+        self.within = float(stats['m2'].sum())
+        if covariate:
+            x = stats['mean_x'].to_numpy() - (n * stats['mean_x'].to_numpy()).sum() / total
+            blocks.append(sparse.csr_matrix(x[:, None]))
+            self.columns[covariate] = np.array([start])
+
+        design = sparse.hstack(blocks, format='csr')
+        self.gram = (design.T @ design.multiply(n[:, None])).toarray()
+        self.rhs = design.T @ (n * y)
+        self.total_ss = float((n * y ** 2).sum()) + self.within
+        if covariate:
+            # Within-cell variation of the covariate enters only its own slope
+            self.gram[-1, -1] += stats['m2_x'].sum()
+            self.rhs[-1] += stats['c_xy'].sum()
+        self.n = total
+        self._fits = {}
+        self._full = None
+
+    def fit(self, effects):
+        """Explained SS (beyond the grand mean) and rank of the model with the intercept plus effects."""
+        key = frozenset(effects)
+        if key not in self._fits:
+            columns = np.concatenate([[0], *(self.columns[e] for e in effects)]).astype(int)
+            gram, rhs = self.gram[np.ix_(columns, columns)], self.rhs[columns]
+            values, vectors = np.linalg.eigh(gram)
+            keep = values > values.max() * len(values) * np.finfo(float).eps
+            projected = vectors[:, keep].T @ rhs
+            self._fits[key] = (float((projected ** 2 / values[keep]).sum()), int(keep.sum()))
+        return self._fits[key]
+
+    def wald(self, effect):
+        """SS of effect's parameters being zero in the full model, and its rank."""
+        if self._full is None:
+            gram_pinv = np.linalg.pinv(self.gram, rcond=len(self.gram) * np.finfo(float).eps, hermitian=True)
+            self._full = gram_pinv, gram_pinv @ self.rhs
+        gram_pinv, coefficients = self._full
+        block = self.columns[effect]
+        values, vectors = np.linalg.eigh(gram_pinv[np.ix_(block, block)])
+        keep = values > values.max() * len(values) * np.finfo(float).eps
+        projected = vectors[:, keep].T @ coefficients[block]
+        return float((projected ** 2 / values[keep]).sum()), int(keep.sum())
+
+
+def factorial_table(cells, ss_type=SS_TYPE):
+    """SS and degrees of freedom of every term, the covariate and the within-cells error.
+
+    Returns an ordered {effect: (ss, df)} for anova.effects_table; interactions are
+    named like "a:b" and the error is "Within".
+    """
+    if ss_type not in SS_TYPES:
+        raise ValueError(f"Unknown SS type: {ss_type}")
+    if cells.total == 0:
+        raise ValueError("No complete rows to analyze.")
+    terms = factorial_terms(cells.factors)
+    covariate = [cells.covariate] if cells.covariate else []
+    design = _Design(cells, terms, cells.covariate)
+    full = [*covariate, *terms]
+
+    table = {}
+    if ss_type == 1:
+        previous = design.fit([])
+        for i, effect in enumerate(full):
+            current = design.fit(full[:i + 1])
+            table[effect] = (current[0] - previous[0], current[1] - previous[1])
+            previous = current
+    elif ss_type == 2:
+        for effect in full:
+            # Terms that contain the effect are left out of both models
+            others = [e for e in full if e != effect and not (isinstance(effect, tuple) and isinstance(e, tuple)
+                                                              and set(effect) <= set(e))]
+            with_effect, without = design.fit([*others, effect]), design.fit(others)
+            table[effect] = (with_effect[0] - without[0], with_effect[1] - without[1])
+    else:
+        for effect in full:
+            table[effect] = design.wald(effect)
+
+    explained, rank = design.fit(full)
+    # Without a covariate the full model fits every cell mean, leaving exactly the within-cell SS
+    ss_within = design.total_ss - explained if covariate else design.within
+    table = {_effect_name(effect): (max(float(ss), 0.0), float(df)) for effect, (ss, df) in table.items()}
+    table['Within'] = (float(ss_within), float(design.n - rank))
+    return table
+
+
+def _effect_name(effect):
+    return ':'.join(effect) if isinstance(effect, tuple) else effect
+
+
+def statsmodels_factorial_table(df, factors, dependent_var, covariate=None, ss_type=SS_TYPE):
+    """Reference implementation: OLS on the rows, sum-coded factors, then anova_lm(typ=ss_type)."""
+    import statsmodels.api as sm
+    from statsmodels.formula.api import ols
+
+    if ss_type not in SS_TYPES:
+        raise ValueError(f"Unknown SS type: {ss_type}")
+    columns = [*factors, dependent_var, *([covariate] if covariate else [])]
+    data = df[columns].dropna()
+    names = {column: f'v{i}' for i, column in enumerate(columns)}
+    data = pd.DataFrame({names[c]: _factorize(data[c])[0] if c in factors else data[c].to_numpy(dtype=float)
+                         for c in columns})
+    effects = [*([covariate] if covariate else []), *factorial_terms(factors)]
+    terms = {effect: (names[effect] if effect == covariate else
+                      ':'.join(f'C({names[f]}, Sum)' for f in effect)) for effect in effects}
+    response = names[dependent_var]
+    if ss_type == 1:
+        # patsy moves numeric terms after the factors, so the sequence of fits is spelled out
+        models = [ols(f"{response} ~ {' + '.join(list(terms.values())[:i]) or '1'}", data=data).fit()
+                  for i in range(len(terms) + 1)]
+        table = {_effect_name(effect): (models[i].ssr - models[i + 1].ssr, models[i].df_resid - models[i + 1].df_resid)
+                 for i, effect in enumerate(effects)}
+        table['Within'] = (models[-1].ssr, models[-1].df_resid)
+        return {effect: (float(ss), float(df)) for effect, (ss, df) in table.items()}
+
+    model = ols(f"{response} ~ {' + '.join(terms.values())}", data=data).fit()
+    anova_table = sm.stats.anova_lm(model, typ=ss_type)
+    table = {_effect_name(effect): (float(anova_table['sum_sq'][term]), float(anova_table['df'][term]))
+             for effect, term in terms.items()}
+    table['Within'] = (float(anova_table['sum_sq']['Residual']), float(anova_table['df']['Residual']))
+    return table
+
+
+def factorial_anova(df, factors, dependent_var, covariate=None, ss_type=SS_TYPE, backend='cells', alpha=ALPHA):
+    """Effects table of an N-way factorial ANOVA (ANCOVA with a covariate) of rows in memory."""
+    if backend == 'statsmodels':
+        table = statsmodels_factorial_table(df, factors, dependent_var, covariate, ss_type)
+    elif backend == 'cells':
+        table = factorial_table(FactorialCells.from_frame(df, factors, dependent_var, covariate), ss_type)
+    else:
+        raise ValueError(f"Unknown ANOVA backend: {backend}")
+    return effects_table(table, alpha)
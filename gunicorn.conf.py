@@ -0,0 +1,19 @@
+import os
+
+# Production settings for `gunicorn -c gunicorn.conf.py app1:app`, overridable through env vars
+bind = f"0.0.0.0:{os.environ.get('PORT', '8003')}"
+# Exported so app1 can size each worker's analysis pool to its share of the cores
+workers = int(os.environ.setdefault('WEB_CONCURRENCY', '2'))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Import pandas/scipy/statsmodels once in the master and share them copy-on-write with the workers
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# Large uploads take a while to arrive and to analyze
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 120))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+accesslog = '-'
+errorlog = '-'
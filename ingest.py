@@ -0,0 +1,366 @@
+import io
+import os
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from absorption import sparse_cell_table
+from anova import ALPHA, CellStats, EncodedRows, anova_from_cells, anova_from_rows, anova_results, effects_table
+from bootstrap import bootstrap_effect_sizes
+from defaults import CHUNKSIZE, METHODS, SS_TYPE
+from factorial import FactorialCells, factorial_anova, factorial_table
+from permutation import PERMUTATION_KEYS, permutation_pvalues
+from posthoc import posthoc_tests
+from robust import art_tests, cell_wald_tests, robust_results
+
+# Readable formats; the CSV ones name their compression
+CSV_COMPRESSION = {'csv': None, 'csv.gz': 'gzip', 'csv.zst': 'zstd'}
+INPUT_FORMATS = (*CSV_COMPRESSION, 'parquet', 'arrow', 'excel')
+
+
+class ColumnError(ValueError):
+    pass
+
+
+def _csv_options(factors, responses):
+    wanted = set(factors) | set(responses)
+    # Categoricals hold each distinct label once and factorize through their integer codes
+    dtype = {column: 'category' for column in factors}
+    dtype.update({column: 'float64' for column in responses})
+    return {
+        # A callable usecols skips unknown names instead of raising, so we can report them ourselves
+        'usecols': lambda column: column in wanted,
+        'dtype': dtype,
+    }
+
+
+def _check_columns(available, *columns):
+    missing = [c for c in dict.fromkeys(columns) if c not in available]
+    if missing:
+        raise ColumnError(f"Columns not found: {', '.join(missing)}")
+
+
+def _typed(df, factors, responses):
+    # Columnar and Excel files keep their own types; make factors strings and responses floats, as read from a CSV
+    for column in factors:
+        df[column] = df[column].astype(str).where(df[column].notna()).astype('category')
+    for column in responses:
+        df[column] = pd.to_numeric(df[column]).astype('float64')
+    return df
+
+
+def _arrow_input(source):
+    import pyarrow as pa
+
+    # A path is memory-mapped, so only the pages of the projected columns are ever read
+    if isinstance(source, (str, os.PathLike)):
+        return pa.memory_map(os.fspath(source))
+    if isinstance(source, io.BytesIO):
+        return pa.py_buffer(source.getbuffer())
+    source.seek(0)
+    return pa.py_buffer(source.read())
+
+
+def _arrow_chunks(source, columns, chunksize, file_format):
+    try:
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError(f"Reading {file_format} files requires pyarrow.")
+
+    if file_format == 'parquet':
+        reader = pyarrow.parquet.ParquetFile(source)
+        _check_columns(reader.schema_arrow.names, *columns or [])
+        if chunksize is None:
+            yield reader.read(columns=columns)
+            return
+        yield from reader.iter_batches(batch_size=chunksize, columns=columns)
+        return
+
+    reader = pyarrow.ipc.open_file(_arrow_input(source))
+    _check_columns(reader.schema.names, *columns or [])
+    if chunksize is None:
+        table = reader.read_all()
+        yield table if columns is None else table.select(columns)
+        return
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        if columns is not None:
+            batch = batch.select(columns)
+        for start in range(0, batch.num_rows, chunksize):
+            yield batch.slice(start, chunksize)
+
+
+def read_raw_chunks(source, chunksize=CHUNKSIZE, file_format='csv', columns=None, csv_options=None):
+    """Yield source in DataFrames of at most chunksize rows (all of it if chunksize is None).
+
+    columns=None reads every column with the types the format gives it.
+    """
+    if file_format in CSV_COMPRESSION:
+        reader = pd.read_csv(source, chunksize=chunksize, compression=CSV_COMPRESSION[file_format],
+                             **csv_options or {})
+        if chunksize is None:
+            _check_columns(reader.columns, *columns or [])
+            yield reader
+            return
+        with reader:
+            for chunk in reader:
+                _check_columns(chunk.columns, *columns or [])
+                yield chunk
+    elif file_format == 'excel':
+        try:
+            df = pd.read_excel(source, **csv_options or {})
+        except ImportError:
+            raise ValueError("Reading Excel files requires openpyxl.")
+        _check_columns(df.columns, *columns or [])
+        if chunksize is None:
+            yield df
+            return
+        for start in range(0, max(len(df), 1), chunksize):
+            yield df.iloc[start:start + chunksize]
+    elif file_format in ('parquet', 'arrow'):
+        for batch in _arrow_chunks(source, columns, chunksize, file_format):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unknown input format: {file_format}")
+
+
+def read_chunks(source, factors, responses, chunksize=CHUNKSIZE, file_format='csv'):
+    """Yield the factor and response columns of source in DataFrames of at most chunksize rows.
+
+    Only those columns are read: CSV parsing skips the others, and Parquet, Arrow
+    IPC/Feather and Excel readers are given the column list. chunksize=None yields
+    the whole file as one DataFrame. Factors come out as strings and responses as
+    float64 whatever the format.
+    """
+    columns = list(dict.fromkeys([*factors, *responses]))
+    chunks = read_raw_chunks(source, chunksize, file_format, columns, _csv_options(factors, responses))
+    if file_format in ('parquet', 'arrow', 'excel'):
+        chunks = (_typed(chunk, factors, responses) for chunk in chunks)
+    yield from chunks
+
+
+def read_columns(source, factor1, factor2, dependent_var, file_format='csv'):
+    """Read only the three analysis columns into a DataFrame."""
+    return next(read_chunks(source, [factor1, factor2], [dependent_var], None, file_format))
+
+
+def read_cell_stats(source, factor1, factor2, dependent_var, chunksize=CHUNKSIZE, progress=None, file_format='csv'):
+    """Fold a file into per-cell statistics one chunk at a time.
+
+    Each chunk is reduced to its cell table and discarded, so memory is bounded by
+    the chunk size and the number of cells rather than by the file size.
+    progress, if given, is called as progress('ingesting', rows_read) after each chunk.
+    """
+    stats = CellStats.empty()
+    rows = 0
+    for chunk in read_chunks(source, [factor1, factor2], [dependent_var], chunksize, file_format):
+        stats = stats.merge(CellStats.from_frame(chunk, factor1, factor2, dependent_var))
+        rows += len(chunk)
+        if progress is not None:
+            progress('ingesting', rows)
+    if stats.total == 0:
+        raise ValueError("No complete rows to analyze.")
+    return stats
+
+
+def read_records_cell_stats(records, factor1, factor2, dependent_var):
+    """Cell statistics of a list of {column: value} records, typed the way read_columns types a CSV."""
+    df = pd.DataFrame.from_records(records)
+    _check_columns(df.columns, factor1, factor2, dependent_var)
+    return CellStats.from_frame(_typed(df, [factor1, factor2], [dependent_var]), factor1, factor2, dependent_var)
+
+
+def analyze_frame(df, factor1, factor2, dependent_var, backend='cells', alpha=ALPHA, progress=None, permutations=0,
+                  bootstrap=0, confidence=0.95, seed=None, resampling_workers=1, posthoc=False, method='classic'):
+    """ANOVA of rows already in memory, plus optional permutation p-values, bootstrap effect-size CIs
+    and post-hoc comparisons."""
+    if backend == 'sparse' and (permutations or bootstrap or posthoc):
+        raise ValueError("Permutations, bootstrap resamples and post-hoc tests need the cells or statsmodels backend.")
+    check_method(method, backend, permutations, bootstrap)
+    if progress is not None:
+        progress('computing', len(df))
+    # Encode the factors once; every step below works on the integer codes and cell index
+    rows = EncodedRows.from_frame(df, factor1, factor2, dependent_var)
+    results = anova_from_rows(rows, backend, alpha)
+    if method == 'art':
+        results = robust_results(results, art_tests(rows), method, alpha)
+    elif method != 'classic':
+        results = robust_results(results, cell_wald_tests(CellStats.from_rows(rows), method), method, alpha)
+    if permutations:
+        if progress is not None:
+            progress('permuting', len(df))
+        pvalues = permutation_pvalues(rows, permutations, seed, resampling_workers)
+        results[0].update(zip(PERMUTATION_KEYS, pvalues))
+    if bootstrap:
+        if progress is not None:
+            progress('bootstrapping', len(df))
+        results[0].update(bootstrap_effect_sizes(rows, bootstrap, confidence, seed, resampling_workers))
+    if posthoc:
+        results[0]['Post-hoc'] = posthoc_tests(CellStats.from_rows(rows), alpha)
+    return results
+
+
+def analyze_csv(source, factor1, factor2, dependent_var, backend='cells', alpha=ALPHA, chunksize=CHUNKSIZE,
+                progress=None, permutations=0, bootstrap=0, confidence=0.95, seed=None, resampling_workers=1,
+                file_format='csv', posthoc=False, method='classic'):
+    check_method(method, backend, permutations, bootstrap)
+    if backend == 'cells' and not (permutations or bootstrap or method == 'art'):
+        stats = read_cell_stats(source, factor1, factor2, dependent_var, chunksize, progress, file_format)
+        if progress is not None:
+            progress('computing', stats.total)
+        return cells_results(stats, alpha, posthoc, method)
+    if backend == 'sparse' and not (permutations or bootstrap or posthoc):
+        # Only the observed cells are kept, never the full grid of level pairs
+        cells = read_factorial_cells(source, [factor1, factor2], dependent_var, None, chunksize, progress, file_format)
+        if progress is not None:
+            progress('computing', cells.total)
+        return anova_results(factorial_sparse_table(cells), alpha)
+    # Resampling works on the rows themselves, so the three columns are read in full
+    df = read_columns(source, factor1, factor2, dependent_var, file_format)
+    return analyze_frame(df, factor1, factor2, dependent_var, backend, alpha, progress, permutations, bootstrap,
+                         confidence, seed, resampling_workers, posthoc, method)
+
+
+def check_method(method, backend='cells', permutations=0, bootstrap=0):
+    """Raise ValueError unless the test method can run with these settings."""
+    if method not in METHODS:
+        raise ValueError(f"Unknown test method: {method}")
+    if method != 'classic' and backend != 'cells':
+        raise ValueError("The welch, hc3 and art methods need the cells backend.")
+    if method != 'classic' and (permutations or bootstrap):
+        raise ValueError("Permutation tests and bootstrap resamples use the classic F test.")
+
+
+def cells_results(stats, alpha=ALPHA, posthoc=False, method='classic'):
+    """ANOVA of cell statistics, with a robust test method and post-hoc comparisons when asked for."""
+    results = anova_from_cells(stats, alpha)
+    if method != 'classic':
+        results = robust_results(results, cell_wald_tests(stats, method), method, alpha)
+    if posthoc:
+        results[0]['Post-hoc'] = posthoc_tests(stats, alpha)
+    return results
+
+
+def factorial_columns(factors, dependent_var, covariate=None):
+    """Check the columns of an N-way analysis: at least one factor, each used once."""
+    if not factors:
+        raise ValueError("An N-way analysis needs at least one factor.")
+    columns = [*factors, dependent_var, *([covariate] if covariate else [])]
+    if len(set(columns)) < len(columns):
+        raise ValueError("Each column can only be used once.")
+
+
+def read_factorial_cells(source, factors, dependent_var, covariate=None, chunksize=CHUNKSIZE, progress=None,
+                         file_format='csv'):
+    """Fold a file into the per-cell statistics of an N-way layout one chunk at a time."""
+    responses = [dependent_var, *([covariate] if covariate else [])]
+    cells = None
+    rows = 0
+    for chunk in read_chunks(source, factors, responses, chunksize, file_format):
+        chunk_cells = FactorialCells.from_frame(chunk, factors, dependent_var, covariate)
+        cells = chunk_cells if cells is None else cells.merge(chunk_cells)
+        rows += len(chunk)
+        if progress is not None:
+            progress('ingesting', rows)
+    if cells is None or cells.total == 0:
+        raise ValueError("No complete rows to analyze.")
+    return cells
+
+
+def analyze_factorial_csv(source, factors, dependent_var, covariate=None, ss_type=SS_TYPE, backend='cells',
+                          alpha=ALPHA, chunksize=CHUNKSIZE, progress=None, file_format='csv'):
+    """Effects table of an N-way factorial ANOVA, or an ANCOVA when covariate is given."""
+    factorial_columns(factors, dependent_var, covariate)
+    if backend == 'sparse':
+        raise ValueError("The sparse backend only runs two-way analyses.")
+    if backend == 'cells':
+        cells = read_factorial_cells(source, factors, dependent_var, covariate, chunksize, progress, file_format)
+        if progress is not None:
+            progress('computing', cells.total)
+        return effects_table(factorial_table(cells, ss_type), alpha)
+    responses = [dependent_var, *([covariate] if covariate else [])]
+    df = next(read_chunks(source, factors, responses, None, file_format))
+    if progress is not None:
+        progress('computing', len(df))
+    return factorial_anova(df, factors, dependent_var, covariate, ss_type, backend, alpha)
+
+
+def factorial_sparse_table(cells):
+    """Two-way table of the sparse backend from the observed cells of a two-factor layout."""
+    index = cells.cells.index
+    return sparse_cell_table(index.codes[0], index.codes[1], cells.cells['n'].to_numpy(),
+                             cells.cells['mean'].to_numpy(), cells.cells['m2'].to_numpy())
+
+
+def batch_analyses(analyses=None, factors=None, responses=None):
+    """List the (factor1, factor2, dependent_var) triples of a batch request, without duplicates.
+
+    analyses is a list of {"factor1", "factor2", "dependent_var"} objects; factors and
+    responses additionally request every pair of factors against every response.
+    """
+    try:
+        triples = [(a['factor1'], a['factor2'], a['dependent_var']) for a in analyses or []]
+    except (KeyError, TypeError):
+        raise ValueError("Each analysis needs factor1, factor2 and dependent_var.")
+    triples += [(f1, f2, y) for f1, f2 in combinations(factors or [], 2) for y in responses or []]
+    triples = list(dict.fromkeys(triples))
+    if not triples:
+        raise ValueError("No analyses requested.")
+    factor_columns = {f for f1, f2, _ in triples for f in (f1, f2)}
+    overlap = factor_columns & {y for _, _, y in triples}
+    if overlap:
+        raise ValueError(f"Columns used both as factor and response: {', '.join(sorted(overlap))}")
+    return triples
+
+
+def read_batch_cell_stats(source, triples, chunksize=CHUNKSIZE, file_format='csv', progress=None):
+    """Fold a file into the cell statistics of many analyses in a single pass.
+
+    Factor columns are encoded once per chunk, and each factor pair's cell index is
+    shared by all responses analyzed against it. A pair requested in both orders is
+    computed once and transposed.
+    """
+    pairs = {}
+    for f1, f2, y in triples:
+        pairs.setdefault(tuple(sorted((f1, f2))), set()).add(y)
+    factors = sorted({f for pair in pairs for f in pair})
+    responses = sorted({y for ys in pairs.values() for y in ys})
+    stats = {(f1, f2, y): CellStats.empty() for (f1, f2), ys in pairs.items() for y in ys}
+
+    rows = 0
+    for chunk in read_chunks(source, factors, responses, chunksize, file_format):
+        codes = {f: pd.factorize(chunk[f], sort=True) for f in factors}
+        values = {y: chunk[y].to_numpy(dtype=float) for y in responses}
+        for (f1, f2), ys in pairs.items():
+            (codes1, levels1), (codes2, levels2) = codes[f1], codes[f2]
+            complete = (codes1 >= 0) & (codes2 >= 0)
+            for y in ys:
+                keep = complete & ~np.isnan(values[y])
+                chunk_stats = CellStats.from_codes(codes1[keep], codes2[keep], values[y][keep],
+                                                   levels1.tolist(), levels2.tolist())
+                stats[f1, f2, y] = stats[f1, f2, y].merge(chunk_stats)
+        rows += len(chunk)
+        if progress is not None:
+            progress('ingesting', rows)
+
+    results = {}
+    for f1, f2, y in triples:
+        cell_stats = stats[f1, f2, y] if (f1, f2, y) in stats else stats[f2, f1, y].transpose()
+        results[f1, f2, y] = cell_stats.drop_empty_levels()
+    return results
+
+
+def analyze_batch_csv(source, triples, alpha=ALPHA, chunksize=CHUNKSIZE, file_format='csv', progress=None):
+    results = []
+    batch_stats = read_batch_cell_stats(source, triples, chunksize, file_format, progress)
+    if progress is not None:
+        progress('computing', sum(stats.total for stats in batch_stats.values()))
+    for (f1, f2, y), stats in batch_stats.items():
+        if stats.total == 0:
+            result = {"error": "No complete rows to analyze."}
+        else:
+            result = anova_from_cells(stats, alpha)[0]
+        results.append({"factor1": f1, "factor2": f2, "dependent_var": y, "result": result})
+    return results
@@ -0,0 +1,231 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing, contextmanager
+
+JOB_STORE_PATH = os.path.join(tempfile.gettempdir(), 'anova-jobs.sqlite3')
+JOB_TTL = 24 * 60 * 60
+
+# Workers start from a clean server process, never forked from a threaded web worker
+POOL_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+if POOL_CONTEXT.get_start_method() == 'forkserver':
+    # The server imports the analysis modules once, so each new worker starts with pandas and scipy loaded
+    POOL_CONTEXT.set_forkserver_preload(['ingest', 'timing'])
+
+
+class PoolBusy(RuntimeError):
+    pass
+
+
+class PoolBroken(PoolBusy):
+    # A worker died mid-analysis (e.g. killed for running out of memory); the pool is rebuilt on next use
+    pass
+
+
+class JobPool:
+    """Runs analyses in worker processes, refusing new work once max_pending jobs are queued.
+
+    With workers=0 jobs run inline in the calling thread. The executor is created on
+    first use, so a pool built at import time is safe to share with forked web workers,
+    and created again after a worker process dies and breaks it.
+    on_change, if given, is called with the new in-flight count whenever it changes.
+    """
+
+    def __init__(self, workers=None, max_pending=None, on_change=None):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.max_pending = max_pending or max(self.workers, 1) * 4
+        self.on_change = on_change
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    @property
+    def inline(self):
+        return self.workers == 0
+
+    def _get_executor(self):
+        # A forked child must not reuse its parent's executor
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=POOL_CONTEXT)
+            self._pid = os.getpid()
+        return self._executor
+
+    def _discard(self, executor):
+        # A broken executor refuses all further work, so the next job gets a new one
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _submit(self, fn, *args, **kwargs):
+        with self._lock:
+            executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            # Broken by an earlier job since its last use: retry once on a fresh pool
+            self._discard(executor)
+            with self._lock:
+                executor = self._get_executor()
+            future = executor.submit(fn, *args, **kwargs)
+
+        def check(future):
+            if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                self._discard(executor)
+        future.add_done_callback(check)
+        return future
+
+    def _release(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            in_flight = self.in_flight
+        if self.on_change is not None:
+            self.on_change(in_flight)
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self.in_flight >= self.max_pending:
+                raise PoolBusy("Too many analyses in progress, please retry shortly.")
+            self.in_flight += 1
+            in_flight = self.in_flight
+        if self.on_change is not None:
+            self.on_change(in_flight)
+
+        try:
+            if self.inline:
+                future = Future()
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except Exception as e:
+                    future.set_exception(e)
+            else:
+                future = self._submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            self._release(None)
+            raise PoolBroken("The analysis workers could not be started, please retry shortly.")
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        try:
+            return self.submit(fn, *args, **kwargs).result()
+        except BrokenProcessPool:
+            raise PoolBroken("An analysis worker stopped unexpectedly, please retry shortly.")
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown()
+        self._executor = None
+
+
+class JobStore:
+    """SQLite record of asynchronous jobs, readable and writable from any process on the host."""
+
+    def __init__(self, path=JOB_STORE_PATH, ttl=JOB_TTL):
+        self.path = path
+        self.ttl = ttl
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, stage TEXT, '
+                       'rows INTEGER, result TEXT, error TEXT, created REAL, updated REAL, key TEXT)')
+            # Stores created before jobs carried their result cache key
+            if 'key' not in {column for _, column, *_ in db.execute('PRAGMA table_info(jobs)')}:
+                db.execute('ALTER TABLE jobs ADD COLUMN key TEXT')
+
+    @contextmanager
+    def _connect(self):
+        with closing(sqlite3.connect(self.path, timeout=30)) as db:
+            with db:
+                yield db
+
+    def create(self, status='queued', result=None, key=None):
+        """Record a new job; key is the result cache key of its analysis."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute('DELETE FROM jobs WHERE updated <= ?', (now - self.ttl,))
+            db.execute('INSERT INTO jobs (id, status, stage, rows, result, error, created, updated, key) '
+                       'VALUES (?, ?, ?, 0, ?, NULL, ?, ?, ?)',
+                       (job_id, status, status, None if result is None else json.dumps(result), now, now, key))
+        return job_id
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self._connect() as db:
+            db.execute(f'UPDATE jobs SET {assignments}, updated = ? WHERE id = ?',
+                       (*fields.values(), time.time(), job_id))
+
+    def track(self, job_id, future, cleanup=None):
+        """Mark the job failed if its future fails outside run_job, e.g. when the pool breaks.
+
+        run_job records its own errors, so this only catches a worker that died or a call
+        that never reached one; cleanup is the file run_job would have removed.
+        """
+        def check(future):
+            error = 'Job cancelled.' if future.cancelled() else future.exception()
+            if error is None:
+                return
+            self.update(job_id, status='failed', stage='failed', error=str(error) or type(error).__name__)
+            if cleanup is not None and os.path.exists(cleanup):
+                os.remove(cleanup)
+        future.add_done_callback(check)
+
+    def counts(self):
+        """Number of live jobs by status."""
+        with self._connect() as db:
+            rows = db.execute('SELECT status, COUNT(*) FROM jobs WHERE updated > ? GROUP BY status',
+                              (time.time() - self.ttl,)).fetchall()
+        return dict(rows)
+
+    def get(self, job_id):
+        with self._connect() as db:
+            row = db.execute('SELECT status, stage, rows, result, error, created, updated, key FROM jobs '
+                             'WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        status, stage, rows, result, error, created, updated, key = row
+        return {
+            'job_id': job_id,
+            'status': status,
+            'stage': stage,
+            'rows': rows,
+            'result': None if result is None else json.loads(result),
+            'error': error,
+            'created': created,
+            'updated': updated,
+            'key': key,
+        }
+
+
+def run_job(store_path, job_id, fn, *args, cleanup=None, **kwargs):
+    """Run fn in a worker, recording its progress and outcome in the job store.
+
+    fn is called with a progress(stage, rows) callback and must return a JSON-able
+    result, or a tuple whose first item is one. cleanup is a file removed afterwards.
+    """
+    store = JobStore(store_path)
+    store.update(job_id, status='running', stage='starting')
+    try:
+        result = fn(*args, progress=lambda stage, rows: store.update(job_id, stage=stage, rows=rows), **kwargs)
+        if isinstance(result, tuple):
+            result = result[0]
+        store.update(job_id, status='done', stage='done', result=result)
+    except Exception as e:
+        store.update(job_id, status='failed', stage='failed', error=str(e))
+    finally:
+        if cleanup is not None:
+            os.remove(cleanup)
@@ -0,0 +1,180 @@
+"""Prometheus-style request metrics shared by every web worker on the host.
+
+gunicorn runs several worker processes, and a scrape reaches only one of them, so
+the counts live in SQLite (like the job store and the result cache) and every worker
+adds to the same rows. Each process sums its observations in memory and writes them in
+one transaction at most every flush_interval seconds, when it serves a scrape, and at
+exit, so requests don't wait on the disk.
+
+Gauges that describe a live process (analyses in flight) are kept per pid. Rows of
+processes that have exited are dropped when the metrics are rendered.
+"""
+import atexit
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing, contextmanager
+
+METRICS_PATH = os.path.join(tempfile.gettempdir(), 'anova-metrics.sqlite3')
+FLUSH_INTERVAL = 10
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+METRICS = {
+    'anova_request_duration_seconds': ('histogram', "Request latency by endpoint, method and status."),
+    'anova_stage_duration_seconds': ('histogram', "Time spent in each stage of a request."),
+    'anova_rows_processed_total': ('counter', "Data rows analyzed, by endpoint."),
+    'anova_analysis_seconds_total': ('counter', "Seconds spent analyzing those rows, by endpoint "
+                                                "(rate of rows over rate of seconds gives rows/sec)."),
+    'anova_analyses_in_flight': ('gauge', "Analyses submitted to the job pool and not yet finished."),
+    'anova_jobs': ('gauge', "Asynchronous jobs by status."),
+}
+
+
+class MetricsStore:
+    """Counters, histograms and per-process gauges in one SQLite table, buffered per process."""
+
+    def __init__(self, path=METRICS_PATH, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._reset()
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS metrics (name TEXT, labels TEXT, value REAL, pid INTEGER, '
+                       'PRIMARY KEY (name, labels))')
+        # A forked web worker starts with empty buffers, and every process writes what it has left on exit
+        os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.flush)
+
+    def _reset(self):
+        # Also run in a forked child, where a lock held by another thread at fork time would never be released
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._gauges = {}
+        self._flushed = time.monotonic()
+
+    @contextmanager
+    def _connect(self):
+        with closing(sqlite3.connect(self.path, timeout=30)) as db:
+            # WAL stays consistent without an fsync per commit; a crash can only lose the last flushes
+            db.execute('PRAGMA synchronous=NORMAL')
+            with db:
+                yield db
+
+    def record(self, increments):
+        """Add every (name, labels, amount) of increments; they reach the store on the next flush."""
+        with self._lock:
+            for name, labels, amount in increments:
+                # Label sets are serialized only when flushed
+                key = (name, tuple(sorted(labels.items())))
+                self._counts[key] = self._counts.get(key, 0) + amount
+        self._flush_if_due()
+
+    def set_gauge(self, name, value, labels=None):
+        # Keyed by this process, so each worker reports its own share
+        pid = os.getpid()
+        with self._lock:
+            self._gauges[name, _labels({**(labels or {}), 'pid': str(pid)})] = (value, pid)
+        self._flush_if_due()
+
+    def _flush_if_due(self):
+        if time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write this process's buffered counts and gauges in one transaction."""
+        with self._lock:
+            counts, gauges = self._counts, self._gauges
+            self._counts, self._gauges = {}, {}
+            self._flushed = time.monotonic()
+        if not counts and not gauges:
+            return
+        with self._connect() as db:
+            db.executemany('INSERT INTO metrics VALUES (?, ?, ?, NULL) '
+                           'ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value',
+                           [(name, _labels(dict(labels)), amount) for (name, labels), amount in counts.items()])
+            db.executemany('INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?)',
+                           [(name, labels, value, pid) for (name, labels), (value, pid) in gauges.items()])
+
+    def render(self, gauges=None):
+        """Prometheus text exposition of every stored metric, plus gauges {name: [(labels, value)]}.
+
+        This process's buffer is flushed first; other workers' observations show up
+        within their flush interval.
+        """
+        self.flush()
+        with self._connect() as db:
+            dead = [pid for (pid,) in db.execute('SELECT DISTINCT pid FROM metrics WHERE pid IS NOT NULL')
+                    if not _alive(pid)]
+            db.executemany('DELETE FROM metrics WHERE pid = ?', [(pid,) for pid in dead])
+            rows = db.execute('SELECT name, labels, value FROM metrics ORDER BY name, labels').fetchall()
+
+        samples = {}
+        rows.sort(key=_sort_key)
+        for name, labels, value in rows:
+            samples.setdefault(_family(name), []).append((name, json.loads(labels), value))
+        for name, values in (gauges or {}).items():
+            if values:
+                samples.setdefault(name, []).extend((name, labels, value) for labels, value in values)
+
+        lines = []
+        for family in METRICS:
+            if family not in samples:
+                continue
+            kind, help_text = METRICS[family]
+            lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} {kind}')
+            for name, labels, value in samples[family]:
+                lines.append(f'{name}{_format_labels(labels)} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+
+def histogram(name, labels, value, buckets=LATENCY_BUCKETS):
+    """The increments that observe value in a cumulative histogram."""
+    # Every bucket gets a row, empty ones included, so each series exists from the first observation
+    increments = [(f'{name}_bucket', {**labels, 'le': f'{le:g}'}, int(value <= le)) for le in buckets]
+    increments.append((f'{name}_bucket', {**labels, 'le': '+Inf'}, 1))
+    increments.append((f'{name}_sum', labels, value))
+    increments.append((f'{name}_count', labels, 1))
+    return increments
+
+
+def _sort_key(row):
+    # Series by name and labels, with histogram buckets in numeric order
+    name, labels, _ = row
+    labels = json.loads(labels)
+    le = labels.pop('le', None)
+    return name, _labels(labels), float(le) if le is not None else 0.0
+
+
+def _family(name):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            return name[:-len(suffix)]
+    return name
+
+
+def _labels(labels):
+    return json.dumps(labels, sort_keys=True)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    # Buckets read best in order, and Prometheus doesn't mind label order
+    items = sorted(labels.items(), key=lambda item: (item[0] == 'le', item[0]))
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + '}'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
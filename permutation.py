@@ -0,0 +1,95 @@
+"""Permutation p-values for the two-way ANOVA F statistics.
+
+The response is shuffled across all rows (unrestricted permutation of observations)
+and the three F statistics are recomputed for every shuffle. Cell counts don't change
+under a shuffle, so each permutation only needs its table of cell sums. With the rows
+laid out cell by cell, those are the block sums of the shuffled responses: a batch of
+permutations is one in-place row-wise shuffle plus one np.add.reduceat, and the Type II
+SS for the whole batch come from anova.effect_ss with a single pseudo-inverse.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from anova import EncodedRows, effect_df, effect_ss
+
+PERMUTATIONS = 9999
+PERMUTATION_KEYS = (
+    "Permutation P-value Rows (Factor 1)",
+    "Permutation P-value Columns (Factor 2)",
+    "Permutation P-value Interaction",
+)
+# Elements of the (batch, rows) permuted-response matrix; bounds memory at ~32 MB per batch
+BATCH_ELEMENTS = 4_000_000
+
+
+def _f_statistics(n, sums, ss_total, df):
+    ss_factor1, ss_factor2, ss_interaction, ss_cells = effect_ss(n, sums)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ms_within = (ss_total - ss_cells) / df['within']
+        return np.stack([ss_factor1 / df['factor1'] / ms_within,
+                         ss_factor2 / df['factor2'] / ms_within,
+                         ss_interaction / df['interaction'] / ms_within], axis=-1)
+
+
+def _count_exceedances(y, n, ss_total, df, observed, seed, size):
+    # One batch: count permutations whose F reaches the observed F, per effect
+    rng = np.random.default_rng(seed)
+    shuffled = np.empty((size, len(y)))
+    shuffled[:] = y
+    rng.permuted(shuffled, axis=1, out=shuffled)
+
+    # After a shuffle, the first n[0] responses form cell 0, the next n[1] cell 1, ...
+    counts = n.ravel()
+    nonempty = np.flatnonzero(counts)
+    starts = np.concatenate([[0], np.cumsum(counts[nonempty])[:-1]])
+    sums = np.zeros((size, n.size))
+    sums[:, nonempty] = np.add.reduceat(shuffled, starts, axis=1)
+    f_perm = _f_statistics(n, sums.reshape(size, *n.shape), ss_total, df)
+    # Relative tolerance so ties with the observed statistic aren't lost to rounding
+    return (f_perm >= observed * (1 - 1e-12)).sum(axis=0)
+
+
+def _count_batches(y, n, ss_total, df, observed, batches):
+    return sum(_count_exceedances(y, n, ss_total, df, observed, seed, size) for seed, size in batches)
+
+
+def permutation_pvalues(rows, permutations=PERMUTATIONS, seed=None, workers=1):
+    """Permutation p-values (factor1, factor2, interaction) for the EncodedRows of an analysis.
+
+    Permutations are drawn in batches, each with its own child of SeedSequence(seed), so
+    a given seed gives the same p-values whatever the number of workers. An effect with
+    no degrees of freedom (e.g. in a disconnected design) or no finite F gets NaN, as
+    its classic p-value does.
+    """
+    cell, y, shape = rows.cell, rows.y, rows.shape
+    n = np.bincount(cell, minlength=shape[0] * shape[1]).reshape(shape)
+    sums = np.bincount(cell, weights=y, minlength=n.size).reshape(shape)
+    ss_total = float(((y - y.mean()) ** 2).sum())
+
+    df = dict(zip(('factor1', 'factor2', 'interaction'), effect_df(n)), within=len(y) - (n > 0).sum())
+    observed = _f_statistics(n, sums, ss_total, df)
+
+    batch = max(1, min(permutations, BATCH_ELEMENTS // max(len(y), 1)))
+    sizes = [min(batch, permutations - start) for start in range(0, permutations, batch)]
+    batches = list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+
+    # Each worker gets every workers-th batch, so the data is sent to it only once
+    workers = min(workers, len(batches))
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(_count_batches, y, n, ss_total, df, observed, batches[i::workers])
+                       for i in range(workers)]
+            counts = sum(future.result() for future in futures)
+    else:
+        counts = _count_batches(y, n, ss_total, df, observed, batches)
+
+    # The observed arrangement counts as one of the permutations
+    testable = (np.array([df['factor1'], df['factor2'], df['interaction']]) > 0) & np.isfinite(observed)
+    pvalues = np.where(testable, (counts + 1) / (permutations + 1), np.nan)
+    return tuple(float(p) for p in pvalues)
+
+
+def permutation_test(df, factor1, factor2, dependent_var, permutations=PERMUTATIONS, seed=None, workers=1):
+    return permutation_pvalues(EncodedRows.from_frame(df, factor1, factor2, dependent_var), permutations, seed,
+                               workers)
@@ -0,0 +1,134 @@
+"""Two-way tests for unequal variances and non-normal data.
+
+The classic F test divides every effect by one pooled within-cell variance, which
+misleads when cells have very different spreads. Two modes here test the effects on
+the cell means instead, giving each cell its own variance. They use only the per-cell
+count, mean and M2, so they run on the same streamed cell statistics as the default:
+
+- welch: the Welch-James statistic with Johansen's (1980) approximate denominator df,
+  the two-way generalization of Welch's one-way ANOVA
+- hc3: a Wald test with the HC3 covariance, which for the saturated cell-means model
+  is M2 / (n - 1)^2 per cell, referred to F(q, N - cells)
+
+Both test unweighted marginal means (Type III hypotheses), and need every combination
+of levels observed at least twice. The third mode is rank-based:
+
+- art: the aligned rank transform (Wobbrock et al. 2011). Each effect gets its own
+  response: the residual from the cell mean plus that effect's estimate. The response
+  is ranked and then analyzed by the usual cell table. This needs the rows themselves.
+  All three responses are ranked together in one vectorized pass, ties included.
+"""
+import numpy as np
+
+from anova import ALPHA, EFFECT_NAMES, CellStats, EncodedRows, cell_anova_table
+from fdist import f_crit, f_pvalue
+
+
+def _differences(k):
+    # Sum-to-zero contrasts of k levels, one row per degree of freedom
+    return np.hstack([np.eye(k - 1), -np.ones((k - 1, 1))])
+
+
+def cell_mean_contrasts(a, b):
+    """Contrast matrices over the a * b cell means (row-major) of each effect."""
+    return {
+        'factor1': np.kron(_differences(a), np.full((1, b), 1 / b)),
+        'factor2': np.kron(np.full((1, a), 1 / a), _differences(b)),
+        'interaction': np.kron(_differences(a), _differences(b)),
+    }
+
+
+def cell_wald_tests(stats, method):
+    """{effect: (F, df1, df2)} of the welch or hc3 test, from cell statistics."""
+    if method not in ('welch', 'hc3'):
+        raise ValueError(f"The {method} test can't be computed from cell statistics.")
+    stats = stats.drop_empty_levels()
+    n = stats.n.ravel().astype(float)
+    if (n < 2).any():
+        raise ValueError(f"The {method} test needs at least two observations in every combination of levels.")
+    mean, m2 = stats.mean.ravel(), stats.m2.ravel()
+    # Variance of each cell mean: s^2 / n for Welch, the HC3 estimate otherwise
+    variance = m2 / (n - 1) / n if method == 'welch' else m2 / (n - 1) ** 2
+
+    tests = {}
+    for effect, contrasts in cell_mean_contrasts(*stats.n.shape).items():
+        q = contrasts.shape[0]
+        if q == 0:
+            tests[effect] = (np.nan, 0.0, np.nan)
+            continue
+        estimate = contrasts @ mean
+        inverse = np.linalg.pinv((contrasts * variance) @ contrasts.T, hermitian=True)
+        wald = float(estimate @ inverse @ estimate)
+        if method == 'hc3':
+            tests[effect] = (wald / q, float(q), float(n.sum() - len(n)))
+            continue
+        # Johansen's A from the diagonal of V C' (C V C')^-1 C
+        leverage = variance * np.einsum('ji,jk,ki->i', contrasts, inverse, contrasts)
+        a = float(np.sum(leverage ** 2 / (n - 1)))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tests[effect] = (wald / (q + 2 * a - 6 * a / (q + 2)), float(q), q * (q + 2) / (3 * a))
+    return tests
+
+
+def average_ranks(values):
+    """1-based ranks within each row of a 2-D array, ties sharing the mean of their positions."""
+    values = np.ascontiguousarray(values, dtype=float)
+    order = np.argsort(values, axis=1)
+    ordered = np.take_along_axis(values, order, axis=1)
+    # Runs of equal values, numbered across all rows at once
+    starts = np.ones(values.shape, dtype=bool)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    run = np.cumsum(starts.ravel()) - 1
+    first = np.flatnonzero(starts.ravel()) % values.shape[1]
+    average = first + (np.bincount(run) + 1) / 2
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, order, average[run].reshape(values.shape), axis=1)
+    return ranks
+
+
+def art_tests(rows):
+    """{effect: (F, df1, df2)} of the aligned rank transform of EncodedRows."""
+    a, b = rows.shape
+    cell = rows.cell.astype(np.int64)
+    codes1, codes2 = rows.codes1.astype(np.int64), rows.codes2.astype(np.int64)
+    y = rows.y
+    n = np.bincount(cell, minlength=a * b)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cell_mean = np.bincount(cell, weights=y, minlength=a * b) / n
+    mean1 = np.bincount(codes1, weights=y, minlength=a) / np.bincount(codes1, minlength=a)
+    mean2 = np.bincount(codes2, weights=y, minlength=b) / np.bincount(codes2, minlength=b)
+    grand = y.mean()
+
+    residual = y - cell_mean[cell]
+    # One row per effect, so each is sorted as a contiguous block
+    ranks = average_ranks([
+        residual + mean1[codes1] - grand,
+        residual + mean2[codes2] - grand,
+        residual + cell_mean[cell] - mean1[codes1] - mean2[codes2] + grand,
+    ])
+
+    tests = {}
+    for column, effect in enumerate(('factor1', 'factor2', 'interaction')):
+        ranked = EncodedRows(rows.codes1, rows.codes2, ranks[column], rows.levels1, rows.levels2)
+        table = cell_anova_table(CellStats.from_rows(ranked))
+        (ss, df), (ss_within, df_within) = table[effect], table['within']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tests[effect] = ((ss / df) / (ss_within / df_within), df, df_within)
+    return tests
+
+
+def robust_results(results, tests, method, alpha=ALPHA):
+    """results, as from anova_results, with the F tests replaced by tests {effect: (F, df1, df2)}.
+
+    SS, df and MS stay those of the classic table. Each effect's denominator df is
+    added as "Error df <effect>", and the method as "Method".
+    """
+    flat = dict(results[0])
+    for effect, (f_stat, df1, df2) in tests.items():
+        name = EFFECT_NAMES[effect]
+        flat[f"F-statistic {name}"] = float(f_stat)
+        flat[f"P-value {name}"] = float(f_pvalue(f_stat, df1, df2))
+        flat[f"F-crit {name}"] = float(f_crit(alpha, df1, df2)) if df1 > 0 else float('nan')
+        flat[f"Error df {name}"] = float(df2)
+    flat["Method"] = method
+    return flat, flat["P-value Rows (Factor 1)"], flat["P-value Columns (Factor 2)"], flat["P-value Interaction"]
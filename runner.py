@@ -0,0 +1,168 @@
+"""Two-way ANOVA of many files from the command line, without the web app.
+
+Each file is streamed through the same engine as POST / in a process pool. Output is
+written as each file finishes: one JSON line per file (the compact result schema of
+schema.py plus its "file"), or one CSV row per effect.
+
+    python runner.py 'data/*.parquet' more.csv --factor1 A --factor2 B --dependent-var Y [-o results.jsonl]
+    python runner.py 'data/**/*.csv' --factor1 A --factor2 B --dependent-var Y -o results.csv --resume
+
+With --resume, files already recorded in the output (by the path they were given as)
+are skipped and new records are appended. A record cut short by an interrupted run is
+dropped, and its file is analyzed again. Files that fail (missing columns, unreadable
+data) are recorded with their error, and the run then exits with status 1.
+"""
+import argparse
+import csv
+import glob
+import io
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+
+from anova import ALPHA, BACKENDS
+from defaults import CHUNKSIZE, METHODS, input_format
+from ingest import analyze_csv
+from schema import ROW_COLUMNS, compact_result, effect_rows
+
+OUTPUT_FORMATS = ('jsonl', 'csv')
+CSV_COLUMNS = ('file', *ROW_COLUMNS)
+
+
+def expand_paths(patterns):
+    """The files matching each pattern (or the path itself), in order and without duplicates."""
+    paths = {}
+    for pattern in patterns:
+        if any(c in pattern for c in '*?['):
+            matches = sorted(glob.glob(pattern, recursive=True))
+            if not matches:
+                print(f"warning: no files match {pattern}", file=sys.stderr)
+        else:
+            matches = [pattern]
+        paths.update(dict.fromkeys(matches))
+    return list(paths)
+
+
+def analyze_file(path, factor1, factor2, dependent_var, backend='cells', alpha=ALPHA, chunksize=CHUNKSIZE,
+                 method='classic'):
+    """The output record of one file: its compact result, or the error that stopped it."""
+    file_format = input_format(path)
+    if file_format is None:
+        return {'file': path, 'error': "Unsupported file type."}
+    try:
+        result = analyze_csv(path, factor1, factor2, dependent_var, backend, alpha, chunksize,
+                             file_format=file_format, method=method)[0]
+    except (OSError, ValueError) as e:
+        return {'file': path, 'error': str(e)}
+    return {'file': path, **compact_result(result)}
+
+
+def run_files(paths, workers=None, **options):
+    """Yield the record of every path as it finishes; workers=0 runs them in this process."""
+    if workers == 0:
+        for path in paths:
+            yield analyze_file(path, **options)
+        return
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers) as executor:
+        # A few files queued per worker keeps every core busy without submitting thousands at once
+        pending = set()
+        for path in paths:
+            pending.add(executor.submit(analyze_file, path, **options))
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from (future.result() for future in done)
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def resume_output(path, output_format):
+    """Drop the records an interrupted run left incomplete from path, and return the files it finished."""
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline='') as f:
+        text = f.read()
+    # Anything after the last newline was cut off mid-write
+    text = text[:text.rfind('\n') + 1]
+
+    if output_format == 'jsonl':
+        kept, done = [], set()
+        for line in io.StringIO(text):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and 'file' in record:
+                kept.append(line)
+                done.add(record['file'])
+        content = ''.join(kept)
+    else:
+        # A file's rows end with its total row, or are a single error row
+        rows = list(csv.DictReader(io.StringIO(text, newline='')))
+        done = {row['file'] for row in rows if row.get('effect') == 'total' or row.get('error')}
+        out = io.StringIO(newline='')
+        writer = csv.DictWriter(out, CSV_COLUMNS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(row for row in rows if row['file'] in done)
+        content = out.getvalue()
+
+    with open(path + '.tmp', 'w', newline='') as f:
+        f.write(content)
+    os.replace(path + '.tmp', path)
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('files', nargs='+', help="files or quoted glob patterns (** matches subdirectories)")
+    parser.add_argument('--factor1', required=True)
+    parser.add_argument('--factor2', required=True)
+    parser.add_argument('--dependent-var', required=True)
+    parser.add_argument('--backend', choices=BACKENDS, default='cells')
+    parser.add_argument('--method', choices=METHODS, default='classic', help="test of the effects (see robust.py)")
+    parser.add_argument('--alpha', type=float, default=ALPHA)
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    parser.add_argument('--workers', type=int, help="worker processes (default: CPU count; 0 runs in this process)")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, help="default: csv for a .csv --output, else jsonl")
+    parser.add_argument('-o', '--output', help="write here instead of stdout")
+    parser.add_argument('--resume', action='store_true', help="skip the files already in --output and append")
+    args = parser.parse_args(argv)
+    if args.resume and not args.output:
+        parser.error("--resume needs --output")
+    output_format = args.format or ('csv' if args.output and args.output.endswith('.csv') else 'jsonl')
+
+    paths = expand_paths(args.files)
+    done = resume_output(args.output, output_format) if args.resume else set()
+    todo = [path for path in paths if path not in done]
+    print(f"{len(todo)} files to analyze, {len(paths) - len(todo)} already done", file=sys.stderr)
+
+    appending = args.resume and os.path.exists(args.output) and os.path.getsize(args.output) > 0
+    out = open(args.output, 'a' if appending else 'w', newline='') if args.output else sys.stdout
+    writer = csv.DictWriter(out, CSV_COLUMNS, lineterminator='\n') if output_format == 'csv' else None
+    if writer is not None and not appending:
+        writer.writeheader()
+
+    failed = 0
+    try:
+        for record in run_files(todo, args.workers, factor1=args.factor1, factor2=args.factor2,
+                                dependent_var=args.dependent_var, backend=args.backend, alpha=args.alpha,
+                                chunksize=args.chunksize, method=args.method):
+            failed += 'error' in record
+            if writer is None:
+                out.write(json.dumps(record) + '\n')
+            else:
+                writer.writerows({'file': record['file'], **row} for row in effect_rows(record))
+            # Every finished file is on disk before the next one, so --resume loses at most the ones in flight
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if failed:
+        print(f"{failed} files failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""Compact, versioned encodings of analysis results.
+
+The two-way result of POST / is a flat object of verbose keys such as "F-statistic
+Columns (Factor 2)". The compact schema carries the same numbers as an effects array:
+
+    {"format": "anova-result", "version": 1,
+     "effects": [{"effect": "factor1", "ss", "df", "ms", "f", "p", "fcrit"}, ...],
+     "within": {"ss", "df", "ms"}, "total": {"ss", "df"}}
+
+Effects may also carry "p_perm" (permutation p-value), "eta2"/"omega2" with their
+"eta2_ci"/"omega2_ci" bounds and, under a robust "method", the denominator "df2". The
+result may carry "posthoc" as in the verbose form. N-way
+results use the same schema with their own effect names ("a", "a:b", ...). Batches
+can also be encoded as MessagePack, or as an Arrow IPC stream of one row per effect.
+"""
+import io
+
+from anova import EFFECT_NAMES
+
+FORMAT = 'anova-result'
+VERSION = 1
+
+RESULT_FORMATS = ('json', 'compact')
+BATCH_FORMATS = ('json', 'compact', 'msgpack', 'arrow')
+MIMETYPES = {
+    'msgpack': 'application/vnd.msgpack',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+# Compact statistic keys and their verbose names
+STATISTICS = {'ss': "SS", 'df': "df", 'ms': "MS", 'f': "F-statistic", 'p': "P-value", 'fcrit': "F-crit"}
+EFFECT_SIZES = {'eta2': "Partial Eta-squared", 'omega2': "Partial Omega-squared"}
+# Columns of the flat, one-row-per-effect layout (Arrow and CSV); df2 is set by robust methods only
+ROW_COLUMNS = ('effect', *STATISTICS, 'df2', 'error')
+
+
+def _row(row):
+    return {key: row[name] for key, name in STATISTICS.items() if name in row}
+
+
+def _compact_two_way(result):
+    effects = []
+    for effect, name in EFFECT_NAMES.items():
+        if effect == 'within':
+            continue
+        row = {'effect': effect, **{key: result[f"{stat} {name}"] for key, stat in STATISTICS.items()}}
+        if f"Error df {name}" in result:
+            row['df2'] = result[f"Error df {name}"]
+        if f"Permutation P-value {name}" in result:
+            row['p_perm'] = result[f"Permutation P-value {name}"]
+        for key, size in EFFECT_SIZES.items():
+            if f"{size} {name}" in result:
+                row[key] = result[f"{size} {name}"]
+                row[f'{key}_ci'] = [result[f"{size} {name} CI Lower"], result[f"{size} {name} CI Upper"]]
+        effects.append(row)
+    within = EFFECT_NAMES['within']
+    compact = {
+        'effects': effects,
+        'within': {key: result[f"{STATISTICS[key]} {within}"] for key in ('ss', 'df', 'ms')},
+        'total': {key: result[f"{STATISTICS[key]} Total"] for key in ('ss', 'df')},
+    }
+    if 'Method' in result:
+        compact['method'] = result['Method']
+    if 'Post-hoc' in result:
+        compact['posthoc'] = result['Post-hoc']
+    return compact
+
+
+def compact_result(result):
+    """The compact form of a two-way result of POST /; errors pass through unchanged."""
+    if 'error' in result:
+        return result
+    return {'format': FORMAT, 'version': VERSION, **_compact_two_way(result)}
+
+
+def compact_factorial(result):
+    """The compact form of a result of POST /factorial, whose effects end with the error and "Total"."""
+    *rows, error, total = result['effects']
+    return {
+        'format': FORMAT,
+        'version': VERSION,
+        **{key: value for key, value in result.items() if key != 'effects'},
+        'effects': [{'effect': row['Effect'], **_row(row)} for row in rows],
+        'within': _row(error),
+        'total': _row(total),
+    }
+
+
+def compact_batch(results):
+    """The compact form of the results of POST /batch."""
+    return {
+        'format': FORMAT,
+        'version': VERSION,
+        'results': [{**{k: v for k, v in item.items() if k != 'result'},
+                     **(item['result'] if 'error' in item['result'] else _compact_two_way(item['result']))}
+                    for item in results],
+    }
+
+
+def effect_rows(compact):
+    """Flat rows of a compact result, one per effect plus within and total; an error is a single row."""
+    if 'error' in compact:
+        rows = [{'error': compact['error']}]
+    else:
+        rows = [*compact['effects'], {'effect': 'within', **compact['within']}, {'effect': 'total', **compact['total']}]
+    return [{name: row.get(name) for name in ROW_COLUMNS} for row in rows]
+
+
+def encode_batch(results, result_format):
+    """(body, mimetype) of the batch results in a binary format, 'msgpack' or 'arrow'."""
+    compact = compact_batch(results)
+    if result_format == 'msgpack':
+        try:
+            import msgpack
+        except ImportError:
+            raise ValueError("MessagePack output requires msgpack.")
+        return msgpack.packb(compact), MIMETYPES['msgpack']
+    if result_format == 'arrow':
+        return _arrow_stream(compact), MIMETYPES['arrow']
+    raise ValueError(f"Unknown result format: {result_format}")
+
+
+def _arrow_stream(compact):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ValueError("Arrow output requires pyarrow.")
+
+    columns = {name: [] for name in ('factor1', 'factor2', 'dependent_var', *ROW_COLUMNS)}
+    for item in compact['results']:
+        for row in effect_rows(item):
+            for name, values in columns.items():
+                values.append(item[name] if name in ('factor1', 'factor2', 'dependent_var') else row[name])
+
+    schema = pa.schema([
+        *(pa.field(name, pa.string()) for name in ('factor1', 'factor2', 'dependent_var', 'effect')),
+        *(pa.field(name, pa.float64()) for name in (*STATISTICS, 'df2')),
+        pa.field('error', pa.string()),
+    ], metadata={'format': FORMAT, 'version': str(VERSION)})
+    table = pa.Table.from_pydict(columns, schema=schema)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
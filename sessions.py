@@ -0,0 +1,79 @@
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from contextlib import closing, contextmanager
+
+from anova import CellStats
+
+SESSION_STORE_PATH = os.path.join(tempfile.gettempdir(), 'anova-sessions.sqlite3')
+SESSION_TTL = 7 * 24 * 60 * 60
+
+
+class SessionStore:
+    """SQLite record of append-only analysis sessions and their running cell statistics.
+
+    Only the per-cell count, mean and M2 are kept, so appending a batch costs the
+    batch's own reduction plus a merge over the cells, however many rows came before.
+    """
+
+    def __init__(self, path=SESSION_STORE_PATH, ttl=SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, factor1 TEXT, factor2 TEXT, '
+                       'dependent_var TEXT, batches INTEGER, stats TEXT, created REAL, updated REAL)')
+
+    @contextmanager
+    def _connect(self):
+        with closing(sqlite3.connect(self.path, timeout=30)) as db:
+            with db:
+                yield db
+
+    def create(self, factor1, factor2, dependent_var):
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute('DELETE FROM sessions WHERE updated <= ?', (now - self.ttl,))
+            db.execute('INSERT INTO sessions VALUES (?, ?, ?, ?, 0, ?, ?, ?)',
+                       (session_id, factor1, factor2, dependent_var, json.dumps(CellStats.empty().to_dict()),
+                        now, now))
+        return session_id
+
+    def get(self, session_id):
+        with self._connect() as db:
+            row = db.execute('SELECT factor1, factor2, dependent_var, batches, stats, created, updated '
+                             'FROM sessions WHERE id = ?', (session_id,)).fetchone()
+        if row is None:
+            return None
+        factor1, factor2, dependent_var, batches, stats, created, updated = row
+        return {
+            'session_id': session_id,
+            'factor1': factor1,
+            'factor2': factor2,
+            'dependent_var': dependent_var,
+            'batches': batches,
+            'stats': CellStats.from_dict(json.loads(stats)),
+            'created': created,
+            'updated': updated,
+        }
+
+    def append(self, session_id, stats):
+        """Merge a batch's cell statistics into the session; returns the merged statistics, or None."""
+        with self._connect() as db:
+            # Take the write lock before reading, so concurrent appends to a session can't lose a batch
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT stats FROM sessions WHERE id = ?', (session_id,)).fetchone()
+            if row is None:
+                return None
+            merged = CellStats.from_dict(json.loads(row[0])).merge(stats)
+            db.execute('UPDATE sessions SET stats = ?, batches = batches + 1, updated = ? WHERE id = ?',
+                       (json.dumps(merged.to_dict()), time.time(), session_id))
+        return merged
+
+    def delete(self, session_id):
+        with self._connect() as db:
+            return db.execute('DELETE FROM sessions WHERE id = ?', (session_id,)).rowcount > 0
@@ -1 +1,6 @@
-python app1.py
+#!/bin/bash
+# APP_MODE=dev runs the Flask development server with the debugger instead of gunicorn
+if [ "$APP_MODE" = "dev" ]; then
+    exec python app1.py
+fi
+exec gunicorn -c gunicorn.conf.py app1:app
@@ -0,0 +1,149 @@
+// Level names, methods and error messages come from the upload or the server, never from this page
+function escapeHtml(value) {
+    return String(value).replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'})[c]);
+}
+
+// data is a result in the compact schema (?format=compact)
+function showResults(data) {
+    const [factor1, factor2, interaction] = data.effects;
+    // Update the results section
+    document.getElementById('results').innerHTML = `
+        <h3 class="title">Results</h3>
+        <p><strong>SS Rows (Factor 1):</strong> ${factor1.ss.toFixed(4)}</p>
+        <p><strong>SS Columns (Factor 2):</strong> ${factor2.ss.toFixed(4)}</p>
+        <p><strong>SS Interaction:</strong> ${interaction.ss.toFixed(4)}</p>
+        <p><strong>SS Within:</strong> ${data.within.ss.toFixed(4)}</p>
+        <p><strong>SS Total:</strong> ${data.total.ss.toFixed(4)}</p>
+        <p><strong>df Rows (Factor 1):</strong> ${factor1.df}</p>
+        <p><strong>df Columns (Factor 2):</strong> ${factor2.df}</p>
+        <p><strong>df Interaction:</strong> ${interaction.df}</p>
+        <p><strong>df Within:</strong> ${data.within.df}</p>
+        <p><strong>df Total:</strong> ${data.total.df}</p>
+        <p><strong>MS Rows (Factor 1):</strong> ${factor1.ms.toFixed(4)}</p>
+        <p><strong>MS Columns (Factor 2):</strong> ${factor2.ms.toFixed(4)}</p>
+        <p><strong>MS Interaction:</strong> ${interaction.ms.toFixed(4)}</p>
+        <p><strong>MS Within:</strong> ${data.within.ms.toFixed(4)}</p>
+        <p><strong>F-statistic Rows (Factor 1):</strong> ${factor1.f.toFixed(4)}</p>
+        <p><strong>F-statistic Columns (Factor 2):</strong> ${factor2.f.toFixed(4)}</p>
+        <p><strong>F-statistic Interaction:</strong> ${interaction.f.toFixed(4)}</p>
+        <p><strong>P-value Rows (Factor 1):</strong> ${factor1.p.toFixed(10)}</p>
+        <p><strong>P-value Columns (Factor 2):</strong> ${factor2.p.toFixed(10)}</p>
+        <p><strong>P-value Interaction:</strong> ${interaction.p.toFixed(10)}</p>
+        <p><strong>F-crit Rows (Factor 1):</strong> ${factor1.fcrit.toFixed(4)}</p>
+        <p><strong>F-crit Columns (Factor 2):</strong> ${factor2.fcrit.toFixed(4)}</p>
+        <p><strong>F-crit Interaction:</strong> ${interaction.fcrit.toFixed(4)}</p>
+        ${data.method ? `
+            <p><strong>Test:</strong> ${escapeHtml(data.method)} (F, p and F-crit above; SS and MS are the classic table)</p>
+            <p><strong>Error df Rows (Factor 1):</strong> ${factor1.df2.toFixed(2)}</p>
+            <p><strong>Error df Columns (Factor 2):</strong> ${factor2.df2.toFixed(2)}</p>
+            <p><strong>Error df Interaction:</strong> ${interaction.df2.toFixed(2)}</p>` : ''}
+        ${factor1.p_perm !== undefined ? `
+            <p><strong>Permutation P-value Rows (Factor 1):</strong> ${factor1.p_perm.toFixed(4)}</p>
+            <p><strong>Permutation P-value Columns (Factor 2):</strong> ${factor2.p_perm.toFixed(4)}</p>
+            <p><strong>Permutation P-value Interaction:</strong> ${interaction.p_perm.toFixed(4)}</p>` : ''}
+        ${factor1.eta2_ci !== undefined ? [[factor1, 'Rows (Factor 1)'], [factor2, 'Columns (Factor 2)'], [interaction, 'Interaction']].map(([effect, name]) =>
+            [['eta2', 'Partial Eta-squared'], ['omega2', 'Partial Omega-squared']].map(([size, label]) => `
+            <p><strong>${label} ${name}:</strong> ${effect[size].toFixed(4)}
+                (CI ${effect[`${size}_ci`][0].toFixed(4)} to ${effect[`${size}_ci`][1].toFixed(4)})</p>`).join('')).join('') : ''}
+        ${data.posthoc ? showPosthoc(data.posthoc) : ''}
+
+        <h3 class="title">Analysis of Results</h3>
+
+        <h4>Effect of Factor 1 on the Dependent Variable</h4>
+        ${factor1.p < 0.05 ? 
+            `<p><strong>Statistically Significant:</strong> Yes (p = ${factor1.p.toFixed(4)})</p>
+            <p>Changes in Factor 1 lead to meaningful variations in the outcome. We reject the null hypothesis that Factor 1 has no effect.</p>` :
+            `<p><strong>Statistically Significant:</strong> No (p = ${factor1.p.toFixed(4)})</p>
+            <p>Any observed variations due to Factor 1 may be due to random chance. We fail to reject the null hypothesis.</p>`}
+
+        <h4>Effect of Factor 2 on the Dependent Variable</h4>
+        ${factor2.p < 0.05 ? 
+            `<p><strong>Statistically Significant:</strong> Yes (p = ${factor2.p.toFixed(4)})</p>
+            <p>Variations in Factor 2 contribute significantly to differences in the outcome. The null hypothesis is rejected.</p>` :
+            `<p><strong>Statistically Significant:</strong> No (p = ${factor2.p.toFixed(4)})</p>
+            <p>Factor 2 does not play a crucial role in influencing the outcome. We fail to reject the null hypothesis.</p>`}
+
+        <h4>Interaction Between Factor 1 and Factor 2</h4>
+        ${interaction.p < 0.05 ? 
+            `<p><strong>Statistically Significant:</strong> Yes (p = ${interaction.p.toFixed(4)})</p>
+            <p>The effect of one factor depends on the level of the other factor. The influence of Factor 1 on the dependent variable is not consistent across different levels of Factor 2, and vice versa. This suggests that the two factors interact in a way that impacts the outcome beyond their individual effects.</p>` :
+            `<p><strong>Statistically Significant:</strong> No (p = ${interaction.p.toFixed(4)})</p>
+            <p>The two factors act independently. The effect of one factor does not change depending on the level of the other factor.</p>`}
+
+        <h4>Overall Implications</h4>
+        <p>The analysis reveals that:</p>
+        <ul>
+            <li>${factor1.p < 0.05 ? 'Factor 1 has a significant effect on the outcome.' : 'Factor 1 does not have a significant effect on the outcome.'}</li>
+            <li>${factor2.p < 0.05 ? 'Factor 2 has a significant effect on the outcome.' : 'Factor 2 does not have a significant effect on the outcome.'}</li>
+            <li>${interaction.p < 0.05 ? 'There is a significant interaction between Factor 1 and Factor 2, indicating that their combined effect is more complex than their individual contributions.' : 'There is no significant interaction between Factor 1 and Factor 2, meaning they act independently.'}</li>
+        </ul>
+    `;
+
+    // Show the result container
+    document.getElementById('resultContainer').style.display = 'block';
+}
+
+// Significant Tukey pairs of each factor (at most 20 each) and the simple effects
+function showPosthoc(posthoc) {
+    const pairs = (name, c) => {
+        const rows = c.p_tukey.map((p, i) => i).filter(i => c.reject_tukey[i]).slice(0, 20).map(i => `
+            <li>${escapeHtml(c.level_a[i])} vs ${escapeHtml(c.level_b[i])}: diff ${c.diff[i].toFixed(4)}
+                (CI ${c.ci_lower[i].toFixed(4)} to ${c.ci_upper[i].toFixed(4)}), Tukey p = ${c.p_tukey[i].toFixed(4)}, Holm p = ${c.p_holm[i].toFixed(4)}</li>`);
+        const count = c.reject_tukey.filter(r => r).length;
+        return `<h4>${name}: ${count} of ${c.diff.length} pairs differ (Tukey HSD)</h4><ul>${rows.join('')}</ul>`;
+    };
+    const simple = (name, e) => `<h4>${name}</h4><ul>${e.within.map((level, i) => `
+        <li>${escapeHtml(level)}: F = ${e.F[i].toFixed(4)}, p = ${e.p[i].toFixed(4)}</li>`).join('')}</ul>`;
+    return `<h3 class="title">Post-hoc Comparisons</h3>
+        ${pairs('Factor 1', posthoc.factor1)}
+        ${pairs('Factor 2', posthoc.factor2)}
+        ${simple('Simple effects of Factor 1 at each level of Factor 2', posthoc.factor1_within_factor2)}
+        ${simple('Simple effects of Factor 2 at each level of Factor 1', posthoc.factor2_within_factor1)}`;
+}
+
+function showStatus(label, message) {
+    document.getElementById('results').innerHTML = `<p><strong>${label}:</strong> ${escapeHtml(message)}</p>`;
+    document.getElementById('resultContainer').style.display = 'block';
+}
+
+// Poll the job until it finishes, reporting progress meanwhile
+function pollJob(job) {
+    fetch(job.status_url)
+    .then(response => response.json())
+    .then(status => {
+        if (status.status === 'done') {
+            return fetch(`${job.result_url}?format=compact`).then(response => response.json()).then(showResults);
+        }
+        if (status.status === 'failed' || status.error) {
+            showStatus('Error', status.error);
+            return;
+        }
+        showStatus('Status', `${status.stage} (${status.rows} rows read)`);
+        setTimeout(() => pollJob(job), 1000);
+    })
+    .catch(error => {
+        console.error('Error:', error);
+    });
+}
+
+document.getElementById('anovaForm').addEventListener('submit', function(event) {
+    event.preventDefault(); // Prevent form submission
+
+    var formData = new FormData(this); // Get form data
+
+    fetch('/jobs', {
+        method: 'POST',
+        body: formData
+    })
+    .then(response => response.json())
+    .then(job => {
+        if (job.error) {
+            showStatus('Error', job.error);
+        } else {
+            pollJob(job);
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+    });
+});
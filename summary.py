@@ -0,0 +1,138 @@
+"""Mergeable per-cell summaries for sharded two-way ANOVA.
+
+A summary holds the column roles and, for every non-empty cell, its count, mean and
+sum of squared deviations (M2). Summaries of disjoint shards merge exactly (Chan et
+al. parallel update), so the ANOVA of the merged summary equals a single pass over
+all the rows up to float rounding.
+
+    python summary.py summarize shard.parquet FACTOR1 FACTOR2 DEPENDENT_VAR [-o shard.json]
+    python summary.py merge a.json b.json ... [-o merged.json] [--alpha 0.05]
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from anova import ALPHA, CellStats, anova_from_cells
+from defaults import CHUNKSIZE, input_format
+from ingest import read_cell_stats
+
+FORMAT = 'two-way-anova-summary'
+VERSION = 1
+
+
+class SummaryError(ValueError):
+    pass
+
+
+def dump_summary(stats, factor1, factor2, dependent_var):
+    """JSON-able summary; cells are [row, column, n, mean, m2] with indices into the level lists."""
+    rows, cols = np.nonzero(stats.n)
+    return {
+        'format': FORMAT,
+        'version': VERSION,
+        'factor1': factor1,
+        'factor2': factor2,
+        'dependent_var': dependent_var,
+        'levels1': stats.levels1,
+        'levels2': stats.levels2,
+        'cells': [[int(i), int(j), int(stats.n[i, j]), float(stats.mean[i, j]), float(stats.m2[i, j])]
+                  for i, j in zip(rows, cols)],
+    }
+
+
+def load_summary(data):
+    """Parse a summary into ((factor1, factor2, dependent_var), CellStats); raises SummaryError."""
+    if not isinstance(data, dict) or data.get('format') != FORMAT:
+        raise SummaryError("Not a two-way ANOVA summary.")
+    if data.get('version') != VERSION:
+        raise SummaryError(f"Unsupported summary version: {data.get('version')}")
+    try:
+        columns = (data['factor1'], data['factor2'], data['dependent_var'])
+        levels1, levels2 = list(data['levels1']), list(data['levels2'])
+        cells = np.asarray(data['cells'], dtype=float).reshape(-1, 5)
+    except (KeyError, TypeError, ValueError):
+        raise SummaryError("Malformed summary.")
+    # Levels are matched by name when summaries are merged, so they must be distinct strings
+    for levels in (data['levels1'], data['levels2']):
+        if (not isinstance(levels, list) or not all(isinstance(level, str) for level in levels)
+                or len(set(levels)) < len(levels)):
+            raise SummaryError("Malformed summary: factor levels must be distinct strings.")
+
+    rows, cols = cells[:, 0].astype(np.int64), cells[:, 1].astype(np.int64)
+    in_range = (rows >= 0) & (rows < len(levels1)) & (cols >= 0) & (cols < len(levels2))
+    if not in_range.all() or (cells[:, 2] < 0).any():
+        raise SummaryError("Malformed summary.")
+    # A cell listed twice would silently overwrite the first entry's rows
+    if len(np.unique(rows * len(levels2) + cols)) < len(cells):
+        raise SummaryError("Malformed summary: a cell is listed more than once.")
+    shape = (len(levels1), len(levels2))
+    n, mean, m2 = np.zeros(shape, dtype=np.int64), np.zeros(shape), np.zeros(shape)
+    n[rows, cols], mean[rows, cols], m2[rows, cols] = cells[:, 2], cells[:, 3], cells[:, 4]
+    return columns, CellStats(levels1, levels2, n, mean, m2)
+
+
+def merge_summaries(summaries):
+    """Merge summaries of the same columns into ((factor1, factor2, dependent_var), CellStats)."""
+    if not summaries:
+        raise SummaryError("No summaries to merge.")
+    loaded = [load_summary(s) for s in summaries]
+    columns = loaded[0][0]
+    if any(other != columns for other, _ in loaded[1:]):
+        raise SummaryError("Summaries are for different columns.")
+    stats = CellStats.empty()
+    for _, shard in loaded:
+        stats = stats.merge(shard)
+    return columns, stats
+
+
+def summarize_file(source, factor1, factor2, dependent_var, chunksize=CHUNKSIZE, file_format='csv', progress=None):
+    return dump_summary(read_cell_stats(source, factor1, factor2, dependent_var, chunksize, progress, file_format),
+                        factor1, factor2, dependent_var)
+
+
+def _write_json(data, path=None):
+    if path is None:
+        json.dump(data, sys.stdout, indent=2)
+        print()
+    else:
+        with open(path, 'w') as f:
+            json.dump(data, f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    summarize = commands.add_parser('summarize', help="reduce a data shard to a summary")
+    summarize.add_argument('file', help="CSV (optionally .gz/.zst), Parquet, Arrow/Feather or .xlsx")
+    summarize.add_argument('factor1')
+    summarize.add_argument('factor2')
+    summarize.add_argument('dependent_var')
+    summarize.add_argument('-o', '--output')
+    merge = commands.add_parser('merge', help="merge summaries and print the ANOVA table")
+    merge.add_argument('summaries', nargs='+')
+    merge.add_argument('-o', '--output', help="also write the merged summary here")
+    merge.add_argument('--alpha', type=float, default=ALPHA)
+    args = parser.parse_args(argv)
+
+    if args.command == 'summarize':
+        file_format = input_format(args.file)
+        if file_format is None:
+            parser.error(f"unsupported file type: {args.file}")
+        _write_json(summarize_file(args.file, args.factor1, args.factor2, args.dependent_var,
+                                  file_format=file_format), args.output)
+        return
+
+    summaries = []
+    for path in args.summaries:
+        with open(path) as f:
+            summaries.append(json.load(f))
+    columns, stats = merge_summaries(summaries)
+    if args.output:
+        _write_json(dump_summary(stats, *columns), args.output)
+    _write_json(anova_from_cells(stats, args.alpha)[0])
+
+
+if __name__ == '__main__':
+    main()
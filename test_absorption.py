@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+from scipy.sparse import csgraph
+
+from absorption import sparse_rows_table
+from anova import CellStats, EncodedRows, cell_anova_table, statsmodels_rows_table
+
+
+def _rows(a, b, rows, seed, blocks=1):
+    rng = np.random.default_rng(seed)
+    # Factor 2 levels near factor 1's (mod b) only, so most cells are empty; blocks > 1 splits the design apart
+    i = rng.integers(0, a, rows)
+    j = (i * b // a + rng.integers(0, 4, rows)) % (b // blocks) + (i % blocks) * (b // blocks)
+    y = rng.normal(size=rows) + np.sin(i) + 0.1 * j + 50
+    return EncodedRows.from_frame(pd.DataFrame({'A': i, 'B': j, 'Y': y}), 'A', 'B', 'Y')
+
+
+def _assert_tables_match(ours, reference, rel):
+    for effect, (ss, df) in reference.items():
+        assert ours[effect][0] == pytest.approx(ss, rel=rel, abs=1e-7), effect
+        assert ours[effect][1] == df, effect
+
+
+def test_matches_statsmodels_on_a_complete_unbalanced_design():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'A': rng.choice(6, 800, p=[0.4, 0.2, 0.15, 0.1, 0.1, 0.05]), 'B': rng.choice(5, 800),
+                       'Y': rng.normal(size=800)})
+    rows = EncodedRows.from_frame(df, 'A', 'B', 'Y')
+    _assert_tables_match(sparse_rows_table(rows), statsmodels_rows_table(rows), rel=1e-8)
+
+
+@pytest.mark.parametrize('a, b, blocks', [(40, 30, 1), (2000, 300, 1), (300, 600, 1), (60, 40, 2), (90, 60, 3)])
+def test_matches_cells_on_sparse_designs(a, b, blocks):
+    rows = _rows(a, b, 20 * a, seed=a + b, blocks=blocks)
+    cells = cell_anova_table(CellStats.from_rows(rows))
+    _assert_tables_match(sparse_rows_table(rows), cells, rel=1e-8)
+
+    # Each extra disconnected block takes one df from every effect
+    a_seen, b_seen = len(rows.levels1), len(rows.levels2)
+    edges = sparse.coo_matrix((np.ones(len(rows.y)), (rows.codes1, a_seen + rows.codes2.astype(np.int64))),
+                              shape=(a_seen + b_seen,) * 2)
+    found = csgraph.connected_components(edges, directed=False)[0]
+    assert found >= blocks
+    assert cells['factor1'][1] == a_seen - found and cells['factor2'][1] == b_seen - found
+
+
+def test_every_level_its_own_block():
+    # Each factor 1 level has factor 2 levels of its own: the reduced system is empty and nothing is left to test
+    rng = np.random.default_rng(1)
+    i = rng.integers(0, 300, 6000)
+    j = i * 7 + rng.integers(0, 4, 6000)
+    rows = EncodedRows.from_frame(pd.DataFrame({'A': i, 'B': j, 'Y': rng.normal(size=6000)}), 'A', 'B', 'Y')
+    table = sparse_rows_table(rows)
+    _assert_tables_match(table, cell_anova_table(CellStats.from_rows(rows)), rel=1e-8)
+    assert table['factor1'] == (0.0, 0.0) and table['interaction'][1] == 0
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from anova import EncodedRows, two_way_anova_with_replication
+
+
+def _frame(rows=400, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'A': rng.choice(['north', 'south', 'east'], rows), 'B': rng.choice(['x', 'y'], rows),
+                       'Y': rng.normal(size=rows)})
+    df.loc[::37, 'A'] = None
+    return df
+
+
+def test_codes_follow_sorted_levels():
+    df = _frame()
+    rows = EncodedRows.from_frame(df, 'A', 'B', 'Y')
+    data = df.dropna()
+    assert rows.levels1 == ['east', 'north', 'south'] and rows.levels2 == ['x', 'y']
+    assert rows.codes1.dtype == np.int8 and rows.cell.dtype == np.int8
+    np.testing.assert_array_equal(np.array(rows.levels1)[rows.codes1], data['A'])
+    np.testing.assert_array_equal(np.array(rows.levels2)[rows.codes2], data['B'])
+    np.testing.assert_array_equal(rows.cell, rows.codes1 * 2 + rows.codes2)
+
+
+def test_wide_factors_get_a_wider_code_type():
+    rows = EncodedRows.from_frame(pd.DataFrame({'A': np.arange(300).astype(str), 'B': ['x'] * 300,
+                                                'Y': np.zeros(300)}), 'A', 'B', 'Y')
+    assert rows.codes1.dtype == np.int16 and rows.codes2.dtype == np.int8
+
+
+def test_categoricals_encode_like_strings():
+    df = _frame()
+    # Unsorted categories, including one that never occurs, must not change the codes
+    categorical = df.astype({'A': pd.CategoricalDtype(['south', 'west', 'north', 'east']), 'B': 'category'})
+    strings, codes = EncodedRows.from_frame(df, 'A', 'B', 'Y'), EncodedRows.from_frame(categorical, 'A', 'B', 'Y')
+    np.testing.assert_array_equal(codes.cell, strings.cell)
+    np.testing.assert_array_equal(codes.y, strings.y)
+    assert codes.levels1 == strings.levels1 and codes.levels2 == strings.levels2
+
+    for backend in ('cells', 'statsmodels'):
+        expected = two_way_anova_with_replication(df, 'A', 'B', 'Y', backend)[0]
+        result = two_way_anova_with_replication(categorical, 'A', 'B', 'Y', backend)[0]
+        for key, value in expected.items():
+            assert result[key] == pytest.approx(value, rel=1e-9), (backend, key)
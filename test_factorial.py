@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from factorial import FactorialCells, factorial_table, factorial_terms, statsmodels_factorial_table
+
+
+def _frame(levels, rows=600, seed=0):
+    rng = np.random.default_rng(seed)
+    factors = 'abc'[:len(levels)]
+    df = pd.DataFrame({f: rng.choice([f'{f}{i}' for i in range(count)], rows) for f, count in zip(factors, levels)})
+    df['x'] = rng.normal(size=rows) * 2 + (df['a'] == 'a0')
+    # A large offset checks that the sums of squares don't lose precision to the mean
+    df['y'] = rng.normal(size=rows) + 0.5 * df['x'] + (df['a'] == 'a0') + 1000
+    return df, list(factors)
+
+
+def _assert_tables_match(ours, reference):
+    assert list(ours) == list(reference)
+    for effect, (ss, df) in reference.items():
+        assert ours[effect][0] == pytest.approx(ss, rel=1e-7, abs=1e-8), effect
+        assert ours[effect][1] == df, effect
+
+
+@pytest.mark.parametrize('ss_type', [1, 2, 3])
+@pytest.mark.parametrize('covariate', [None, 'x'])
+@pytest.mark.parametrize('levels', [(3, 2), (3, 4, 2)])
+def test_matches_statsmodels(levels, covariate, ss_type):
+    df, factors = _frame(levels)
+    ours = factorial_table(FactorialCells.from_frame(df, factors, 'y', covariate), ss_type)
+    _assert_tables_match(ours, statsmodels_factorial_table(df, factors, 'y', covariate, ss_type))
+
+
+def _nested_type2_table(df, factors, covariate):
+    # anova_lm(typ=2) is wrong for rank-deficient designs, so Type II is spelled out as nested OLS fits
+    from statsmodels.formula.api import ols
+
+    full = [*([covariate] if covariate else []), *factorial_terms(factors)]
+    term = {effect: effect if effect == covariate else ':'.join(f'C({f})' for f in effect) for effect in full}
+
+    def fit(effects):
+        return ols(f"y ~ {' + '.join(term[e] for e in effects) or '1'}", data=df).fit()
+
+    table = {}
+    for effect in full:
+        others = [e for e in full if e != effect and not (isinstance(effect, tuple) and isinstance(e, tuple)
+                                                          and set(effect) <= set(e))]
+        with_effect, without = fit([*others, effect]), fit(others)
+        table[':'.join(effect) if isinstance(effect, tuple) else effect] = (
+            without.ssr - with_effect.ssr, without.df_resid - with_effect.df_resid)
+    model = fit(full)
+    table['Within'] = (model.ssr, model.df_resid)
+    return table
+
+
+@pytest.mark.filterwarnings('ignore:The design matrix is rank-deficient')
+@pytest.mark.parametrize('covariate', [None, 'x'])
+def test_empty_cell(covariate):
+    df, factors = _frame((3, 4, 2))
+    df = df[~((df['a'] == 'a0') & (df['b'] == 'b1'))]
+    cells = FactorialCells.from_frame(df, factors, 'y', covariate)
+    _assert_tables_match(factorial_table(cells, 1), statsmodels_factorial_table(df, factors, 'y', covariate, 1))
+    _assert_tables_match(factorial_table(cells, 2), _nested_type2_table(df, factors, covariate))
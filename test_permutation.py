@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+import permutation
+
+from anova import two_way_anova_with_replication
+from permutation import permutation_test
+
+
+def test_effects_without_df_get_no_permutation_pvalue():
+    # Two blocks of levels that never meet: factor2 and the interaction have no df left
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame([(f1, f2, rng.normal()) for f1, f2 in [('a', 'x'), ('b', 'y'), ('c', 'x'), ('d', 'y')]
+                       for _ in range(5)], columns=['A', 'B', 'Y'])
+    classic = two_way_anova_with_replication(df, 'A', 'B', 'Y')[0]
+    p_factor1, p_factor2, p_interaction = permutation_test(df, 'A', 'B', 'Y', permutations=99, seed=1)
+    assert np.isnan(classic["P-value Columns (Factor 2)"]) and np.isnan(classic["P-value Interaction"])
+    assert np.isnan(p_factor2) and np.isnan(p_interaction)
+    assert 0 < p_factor1 <= 1
+
+
+def test_seeded_pvalues_do_not_depend_on_workers(monkeypatch):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'A': rng.choice(['a1', 'a2', 'a3'], 90), 'B': rng.choice(['b1', 'b2'], 90)})
+    df['Y'] = rng.normal(size=90) + (df['A'] == 'a1') * 0.5
+    # Small batches, so the permutations are split over several batches and both workers
+    monkeypatch.setattr(permutation, 'BATCH_ELEMENTS', 90 * 40)
+    serial = permutation_test(df, 'A', 'B', 'Y', permutations=999, seed=7, workers=1)
+    assert permutation_test(df, 'A', 'B', 'Y', permutations=999, seed=7, workers=2) == serial
+    assert permutation_test(df, 'A', 'B', 'Y', permutations=999, seed=7, workers=3) == serial
+    assert permutation_test(df, 'A', 'B', 'Y', permutations=999, seed=8, workers=1) != serial
@@ -0,0 +1,32 @@
+import time
+
+import numpy as np
+import pytest
+from scipy.stats import studentized_range
+
+from anova import CellStats
+from posthoc import posthoc_tests, studentized_range_sf
+
+
+@pytest.mark.parametrize('k, df', [(2, 1), (3, 10), (10, 60), (50, 5000)])
+def test_studentized_range_matches_scipy(k, df):
+    q = np.array([0.5, 2.0, 4.0, 6.0])
+    np.testing.assert_allclose(studentized_range_sf(k, df)(q), studentized_range.sf(q, k, df), atol=1e-8)
+
+
+def test_tukey_with_50_levels_is_fast():
+    rng = np.random.default_rng(0)
+    codes1, codes2 = rng.integers(0, 50, 20_000), rng.integers(0, 3, 20_000)
+    y = rng.normal(codes1 / 50, 1.0)
+    stats = CellStats.from_codes(codes1, codes2, y, [f'L{i}' for i in range(50)], ['a', 'b', 'c'])
+
+    start = time.perf_counter()
+    result = posthoc_tests(stats)
+    assert time.perf_counter() - start < 1.0
+
+    pairs = result['factor1']
+    assert len(pairs['p_tukey']) == 50 * 49 // 2
+    # Spot-check a few pairs against scipy's (much slower) numerical integration
+    q = np.abs(np.asarray(pairs['t'][:5])) * np.sqrt(2)
+    expected = studentized_range.sf(q, 50, result['df_within'])
+    np.testing.assert_allclose(pairs['p_tukey'][:5], expected, atol=1e-8)
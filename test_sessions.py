@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from anova import CellStats, anova_from_cells
+from ingest import read_cell_stats, read_records_cell_stats
+from sessions import SessionStore
+
+
+def test_excel_batch_then_json_rows(tmp_path):
+    # Excel cells keep their numeric type, so the factor levels must be made strings like those of JSON rows
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'A': rng.choice([1, 2, 3], 60), 'B': rng.choice([10, 20], 60), 'Y': rng.normal(size=60)})
+    path = tmp_path / 'batch.xlsx'
+    df.iloc[:40].to_excel(path, index=False)
+    records = df.iloc[40:].to_dict('records')
+
+    store = SessionStore(str(tmp_path / 'sessions.sqlite3'))
+    session_id = store.create('A', 'B', 'Y')
+    store.append(session_id, read_cell_stats(str(path), 'A', 'B', 'Y', chunksize=16, file_format='excel'))
+    merged = store.append(session_id, read_records_cell_stats(records, 'A', 'B', 'Y'))
+
+    single = CellStats.from_frame(df.astype({'A': str, 'B': str}), 'A', 'B', 'Y')
+    assert merged.levels1 == ['1', '2', '3'] and merged.levels2 == ['10', '20']
+    merged = merged.reindex(single.levels1, single.levels2)
+    np.testing.assert_array_equal(merged.n, single.n)
+    np.testing.assert_allclose(merged.mean, single.mean)
+    np.testing.assert_allclose(merged.m2, single.m2)
+
+
+def test_batches_merge_to_a_single_pass(tmp_path):
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({'A': rng.choice(['a1', 'a2', 'a3'], 500), 'B': rng.choice(['b1', 'b2', 'b3'], 500),
+                       'Y': rng.normal(100, 15, 500)})
+    store = SessionStore(str(tmp_path / 'sessions.sqlite3'))
+    session_id = store.create('A', 'B', 'Y')
+    # The first batch lacks a level of each factor, so later batches have to extend the grid
+    batches = [df.iloc[:150].query("A != 'a3' and B != 'b1'"), df.iloc[150:400], df.iloc[400:]]
+    for batch in batches:
+        store.append(session_id, CellStats.from_frame(batch, 'A', 'B', 'Y'))
+
+    session = store.get(session_id)
+    single = CellStats.from_frame(pd.concat(batches), 'A', 'B', 'Y')
+    assert session['batches'] == 3 and session['stats'].total == single.total
+    merged = session['stats'].reindex(single.levels1, single.levels2)
+    np.testing.assert_array_equal(merged.n, single.n)
+    np.testing.assert_allclose(merged.mean, single.mean, rtol=1e-12)
+    np.testing.assert_allclose(merged.m2, single.m2, rtol=1e-10)
+    for key, value in anova_from_cells(single)[0].items():
+        assert anova_from_cells(merged)[0][key] == pytest.approx(value, rel=1e-9, nan_ok=True), key
+
+    assert store.append('missing', single) is None
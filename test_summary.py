@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from anova import CellStats, anova_from_cells
+from summary import SummaryError, dump_summary, load_summary, merge_summaries, summarize_file
+
+
+def _frame(rows=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'A': rng.choice(['a1', 'a2', 'a3'], rows),
+        'B': rng.choice(['b1', 'b2', 'b3', 'b4'], rows),
+        'Y': rng.normal(100, 15, rows),
+    })
+
+
+def test_two_shard_merge_equals_single_pass(tmp_path):
+    df = _frame()
+    # The second shard lacks a level of each factor, so the merge has to align their levels
+    shards = [df.iloc[:1200], df.iloc[1200:].query("A != 'a3' and B != 'b1'")]
+    summaries = []
+    for i, shard in enumerate(shards):
+        path = tmp_path / f'shard{i}.csv'
+        shard.to_csv(path, index=False)
+        summaries.append(summarize_file(str(path), 'A', 'B', 'Y'))
+
+    _, merged = merge_summaries(summaries)
+    single = CellStats.from_frame(pd.concat(shards), 'A', 'B', 'Y')
+    merged = merged.reindex(single.levels1, single.levels2)
+    np.testing.assert_array_equal(merged.n, single.n)
+    np.testing.assert_allclose(merged.mean, single.mean, rtol=1e-12)
+    np.testing.assert_allclose(merged.m2, single.m2, rtol=1e-10)
+
+    merged_results, single_results = anova_from_cells(merged)[0], anova_from_cells(single)[0]
+    assert merged_results.keys() == single_results.keys()
+    for key, value in single_results.items():
+        assert merged_results[key] == pytest.approx(value, rel=1e-9, nan_ok=True), key
+
+
+def test_duplicate_cells_are_rejected():
+    summary = dump_summary(CellStats.from_frame(_frame(200), 'A', 'B', 'Y'), 'A', 'B', 'Y')
+    summary['cells'].append(list(summary['cells'][0]))
+    with pytest.raises(SummaryError):
+        load_summary(summary)
+
+
+@pytest.mark.parametrize('levels1', [[1, 2, 3], ['a1', 'a1', 'a3'], 'a1a2a3'])
+def test_levels_must_be_distinct_strings(levels1):
+    summary = dump_summary(CellStats.from_frame(_frame(200), 'A', 'B', 'Y'), 'A', 'B', 'Y')
+    summary['levels1'] = levels1
+    with pytest.raises(SummaryError):
+        load_summary(summary)
+
+
+def test_integer_levels_do_not_reach_merge():
+    # Integer levels would only fail later, when the merge sorts them together with string levels
+    strings = dump_summary(CellStats.from_frame(_frame(200), 'A', 'B', 'Y'), 'A', 'B', 'Y')
+    integers = dict(strings, levels1=[1, 2, 3])
+    with pytest.raises(SummaryError):
+        merge_summaries([strings, integers])
@@ -0,0 +1,154 @@
+"""Per-request stage timing, optional peak-memory tracking and a sampling profiler.
+
+A StageTimer records how long each named stage of a request took. Analyses that run
+in the job pool report their stages through the progress(stage, rows) callback they
+already take; timed_call wraps such a function in the worker and sends those timings
+back with its result, so the web process sees the whole breakdown.
+
+With track_memory, each stage also records its peak of Python-allocated memory
+(tracemalloc). That's accurate but slows allocation-heavy code, so it is opt-in. The
+Sampler is a plain-Python sampling profiler: it records one thread's stack at a fixed
+interval and writes the samples as collapsed stacks ("a;b;c 12" per line), which
+flamegraph.pl, speedscope and inferno read directly.
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """Durations (and optionally peak memory) of the named stages of one request."""
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.rows = 0
+        self._current = None
+
+    @contextmanager
+    def stage(self, name):
+        self._begin(name)
+        try:
+            yield
+        finally:
+            self._end()
+
+    def progress(self, stage, rows):
+        # A progress callback: each new stage name ends the previous one
+        self.rows = max(self.rows, rows)
+        if self._current is None or self._current[0] != stage:
+            self._end()
+            self._begin(stage)
+
+    def finish(self):
+        self._end()
+        return self.stages
+
+    def add(self, stages, rows=0):
+        """Merge stages timed elsewhere, e.g. in a worker process."""
+        for name, timing in stages.items():
+            total = self.stages.setdefault(name, {'seconds': 0.0})
+            total['seconds'] += timing['seconds']
+            if 'peak_bytes' in timing:
+                total['peak_bytes'] = max(total.get('peak_bytes', 0), timing['peak_bytes'])
+        self.rows = max(self.rows, rows)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def _begin(self, name):
+        if self.track_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self._current = (name, time.perf_counter())
+
+    def _end(self):
+        if self._current is None:
+            return
+        name, started = self._current
+        self._current = None
+        self.add({name: {'seconds': time.perf_counter() - started,
+                         **({'peak_bytes': tracemalloc.get_traced_memory()[1]}
+                            if self.track_memory and tracemalloc.is_tracing() else {})}})
+
+    def server_timing(self):
+        """Server-Timing header value: every stage plus the total, in milliseconds."""
+        entries = []
+        for name, timing in self.stages.items():
+            entry = f"{name};dur={timing['seconds'] * 1000:.2f}"
+            if 'peak_bytes' in timing:
+                entry += f';desc="peak {timing["peak_bytes"] / 2 ** 20:.1f} MiB"'
+            entries.append(entry)
+        entries.append(f"total;dur={self.elapsed * 1000:.2f}")
+        return ', '.join(entries)
+
+
+class Sampler:
+    """Samples the stack of one thread (by default the calling one) every interval seconds."""
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+def write_profile(path, *named_stacks):
+    """Write (root name, stack counts) pairs as one collapsed-stack file, each under its own root frame."""
+    with open(path, 'w') as f:
+        for root, stacks in named_stacks:
+            for stack, count in stacks.items():
+                f.write(f"{root};{stack} {count}\n")
+
+
+def timed_call(fn, args, kwargs, track_memory=False, profile_interval=None):
+    """Run fn(*args, progress=..., **kwargs) and return (result, stages, rows, stack samples).
+
+    Meant to be sent to the job pool: the stages are those fn reports through its
+    progress callback, timed in the process that runs it.
+    """
+    timer = StageTimer(track_memory)
+    tracing = track_memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    sampler = Sampler(profile_interval) if profile_interval else None
+    try:
+        if sampler is not None:
+            sampler.__enter__()
+        result = fn(*args, progress=timer.progress, **kwargs)
+    finally:
+        stacks = sampler.stop() if sampler is not None else Counter()
+        stages = timer.finish()
+        if tracing:
+            tracemalloc.stop()
+    return result, stages, timer.rows, stacks
@@ -0,0 +1,84 @@
+import io
+import os
+import tempfile
+from contextlib import contextmanager
+from tempfile import SpooledTemporaryFile
+
+from flask import Request, current_app
+
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+UPLOAD_MODES = ('stream', 'disk')
+
+
+class SpooledRequest(Request):
+    """Keep uploaded files in memory up to UPLOAD_SPOOL_MAX_SIZE before spilling to a temp file."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        max_size = current_app.config.get('UPLOAD_SPOOL_MAX_SIZE', SPOOL_MAX_SIZE)
+        return SpooledTemporaryFile(max_size=max_size, mode='rb+')
+
+
+@contextmanager
+def upload_source(file, mode='stream', folder='uploads'):
+    """Yield something pandas can read the uploaded file from.
+
+    In 'stream' mode this is the upload stream itself; in 'disk' mode the file is
+    saved under a unique name in folder and removed again however the block exits.
+    """
+    if mode not in UPLOAD_MODES:
+        raise ValueError(f"Unknown upload mode: {mode}")
+    if mode == 'stream':
+        file.stream.seek(0)
+        yield file.stream
+        return
+
+    fd, filepath = tempfile.mkstemp(suffix='.csv', dir=folder)
+    try:
+        file.stream.seek(0)
+        with os.fdopen(fd, 'wb') as out:
+            file.save(out)
+        yield filepath
+    finally:
+        os.remove(filepath)
+
+
+def spool_for_job(file, mode='stream', folder='uploads', max_size=SPOOL_MAX_SIZE):
+    """Copy an upload into a source that can be sent to a worker process.
+
+    Uploads that fit in memory become a BytesIO; larger ones are written to a temp
+    file whose path is passed instead, so big uploads are never pickled. Returns
+    (source, path), where path is the temp file the caller must remove, or None.
+    """
+    if mode not in UPLOAD_MODES:
+        raise ValueError(f"Unknown upload mode: {mode}")
+    stream = file.stream
+    stream.seek(0, io.SEEK_END)
+    if mode == 'stream' and stream.tell() <= max_size:
+        stream.seek(0)
+        return io.BytesIO(stream.read()), None
+
+    fd, filepath = tempfile.mkstemp(suffix='.csv', dir=folder if mode == 'disk' else None)
+    try:
+        stream.seek(0)
+        with os.fdopen(fd, 'wb') as out:
+            file.save(out)
+    except BaseException:
+        os.remove(filepath)
+        raise
+    return filepath, filepath
+
+
+@contextmanager
+def job_source(file, mode='stream', folder='uploads', max_size=SPOOL_MAX_SIZE, picklable=True):
+    """Like upload_source, but yields a source that can be sent to a worker process."""
+    if not picklable:
+        with upload_source(file, mode, folder) as source:
+            yield source
+        return
+
+    source, filepath = spool_for_job(file, mode, folder, max_size)
+    try:
+        yield source
+    finally:
+        if filepath is not None:
+            os.remove(filepath)